@@ -1,20 +1,56 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Response, Request, UploadFile, File
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from dotenv import load_dotenv
+from starlette.datastructures import MutableHeaders
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, AsyncIterator, Callable, NamedTuple, Set, Tuple
 from datetime import datetime, timezone, timedelta
 import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+import asyncio
 import os
 import logging
 import uuid
+import re
+import base64
+import binascii
+import gzip
+import hashlib
+import io
+import copy
+import contextvars
+import heapq
+import time
+import bisect
+import math
+from collections import Counter, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from bson import ObjectId
+from urllib.parse import parse_qs
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, CursorType, IndexModel, InsertOne, ReplaceOne, ReturnDocument, UpdateOne, monitoring
+from pymongo.collation import Collation, CollationStrength
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, OperationFailure
 import bcrypt
+import orjson
+from PIL import ExifTags, Image, UnidentifiedImageError
+from cachetools import LRUCache, TTLCache
 from jose import JWTError, jwt
 import requests
+# Optional codecs; br and zstd are only offered to clients when these are installed
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -25,20 +61,453 @@ SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production'
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 7 * 24 * 60  # 7 days
 
+# Admin configuration (user IDs, since usernames can be changed)
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.environ.get('ADMIN_USER_IDS', '').split(',') if user_id.strip()}
+
+# Password hashing configuration
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', 12))
+PASSWORD_HASH_POOL = os.environ.get('PASSWORD_HASH_POOL', 'thread')  # "thread" or "process"
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Authenticated user cache configuration
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000))
+PRINCIPAL_CACHE_TTL = float(os.environ.get('PRINCIPAL_CACHE_TTL', 60))
+
+# Home timeline configuration
+TIMELINE_MAX_ENTRIES = int(os.environ.get('TIMELINE_MAX_ENTRIES', 800))
+TIMELINE_BACKFILL_POSTS = int(os.environ.get('TIMELINE_BACKFILL_POSTS', 50))
+TIMELINE_FANOUT_BATCH = int(os.environ.get('TIMELINE_FANOUT_BATCH', 1000))
+CELEBRITY_FOLLOWER_THRESHOLD = int(os.environ.get('CELEBRITY_FOLLOWER_THRESHOLD', 10000))
+
+# Counter configuration
+COUNTER_FLUSH_SECONDS = float(os.environ.get('COUNTER_FLUSH_SECONDS', 1.0))
+COUNTER_FLUSH_BATCH = int(os.environ.get('COUNTER_FLUSH_BATCH', 1000))
+
+# Response cache configuration
+RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')  # "memory" or "mongo"
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+RESPONSE_CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', 30))
+RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 0))  # Cache-Control max-age for clients
+
+# Response compression configuration
+COMPRESSION_ENCODINGS = [encoding.strip() for encoding in os.environ.get('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(',')
+                         if encoding.strip()]  # server preference, used when the client weights them equally
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_OFFLOAD_SIZE = int(os.environ.get('COMPRESSION_OFFLOAD_SIZE', 64 * 1024))  # larger bodies compress on a thread
+COMPRESSION_WORKERS = int(os.environ.get('COMPRESSION_WORKERS', min(4, os.cpu_count() or 1)))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+COMPRESSION_ZSTD_LEVEL = int(os.environ.get('COMPRESSION_ZSTD_LEVEL', 3))
+
+# Batch endpoint configuration
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', 100))
+
+# Rate limiting and admission control configuration (limits are "<requests>/<seconds>")
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')  # "memory" or "mongo"
+RATE_LIMIT_AUTH = os.environ.get('RATE_LIMIT_AUTH', '10/60')
+RATE_LIMIT_WRITE = os.environ.get('RATE_LIMIT_WRITE', '30/60')
+RATE_LIMIT_TOGGLE = os.environ.get('RATE_LIMIT_TOGGLE', '120/60')
+RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '600/60')
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true'
+ADMISSION_MAX_CONCURRENT = int(os.environ.get('ADMISSION_MAX_CONCURRENT', 512))
+
+# Real-time event configuration
+LIKE_EVENT_WINDOW_SECONDS = float(os.environ.get('LIKE_EVENT_WINDOW_SECONDS', 0.25))
+
+# Trending configuration
+TRENDING_HALF_LIFE_HOURS = float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24))
+TRENDING_WINDOW_HOURS = float(os.environ.get('TRENDING_WINDOW_HOURS', 72))
+TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K', 100))
+TRENDING_RECOMPUTE_SECONDS = float(os.environ.get('TRENDING_RECOMPUTE_SECONDS', 300))
+TRENDING_WEIGHTS = {"like": 1.0, "comment": 2.0, "repost": 3.0}
+
+# Recommendation configuration
+RECOMMENDATION_NEIGHBORS = int(os.environ.get('RECOMMENDATION_NEIGHBORS', 50))
+RECOMMENDATION_RESULTS = int(os.environ.get('RECOMMENDATION_RESULTS', 100))
+RECOMMENDATION_PROFILE_LIKES = int(os.environ.get('RECOMMENDATION_PROFILE_LIKES', 200))
+RECOMMENDATION_SAMPLE_LIKERS = int(os.environ.get('RECOMMENDATION_SAMPLE_LIKERS', 1000))
+RECOMMENDATION_UPDATE_SECONDS = float(os.environ.get('RECOMMENDATION_UPDATE_SECONDS', 5))
+RECOMMENDATION_BLOCK_SIZE = 2048
+
+# Search configuration
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'mongo')  # "mongo" or "memory"
+SEARCH_SYNC_SECONDS = float(os.environ.get('SEARCH_SYNC_SECONDS', 30))
+SEARCH_SYNC_OVERLAP_SECONDS = float(os.environ.get('SEARCH_SYNC_OVERLAP_SECONDS', 60))
+
+# Socket.IO client manager configuration
+SOCKETIO_MANAGER = os.environ.get('SOCKETIO_MANAGER', 'memory')  # "memory" or "mongo"
+SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'socketio')
+SOCKETIO_COLLECTION_BYTES = int(os.environ.get('SOCKETIO_COLLECTION_BYTES', 64 * 1024 * 1024))
+SOCKETIO_RESUME_WINDOW = int(os.environ.get('SOCKETIO_RESUME_WINDOW', 1000))
+
+# Media storage configuration
+MEDIA_BACKEND = os.environ.get('MEDIA_BACKEND', 'gridfs')  # "gridfs" or "local"
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', ROOT_DIR / 'media'))
+MEDIA_BASE_URL = os.environ.get('MEDIA_BASE_URL', '').rstrip('/')  # public origin of media URLs; unset gives server-relative URLs
+MEDIA_MAX_BYTES = int(os.environ.get('MEDIA_MAX_BYTES', 20 * 1024 * 1024))
+MEDIA_CHUNK_SIZE = 256 * 1024
+# Image uploads are re-encoded at these widths; "full" replaces the original upload
+MEDIA_RENDITIONS = {
+    "thumb": int(os.environ.get('MEDIA_THUMB_WIDTH', 320)),
+    "feed": int(os.environ.get('MEDIA_FEED_WIDTH', 1080)),
+    "full": int(os.environ.get('MEDIA_FULL_WIDTH', 2048)),
+}
+MEDIA_IMAGE_FORMAT = os.environ.get('MEDIA_IMAGE_FORMAT', 'webp')  # "webp" or "jpeg"
+MEDIA_IMAGE_QUALITY = int(os.environ.get('MEDIA_IMAGE_QUALITY', 80))
+MEDIA_MAX_PIXELS = int(os.environ.get('MEDIA_MAX_PIXELS', 40_000_000))
+MEDIA_PROCESS_WORKERS = int(os.environ.get('MEDIA_PROCESS_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Export and import configuration
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 1000))
+IMPORT_MAX_ERRORS = int(os.environ.get('IMPORT_MAX_ERRORS', 20))
+IMPORT_CONCURRENCY = int(os.environ.get('IMPORT_CONCURRENCY', 4))
+
+# Health check configuration
+HEALTH_CACHE_SECONDS = float(os.environ.get('HEALTH_CACHE_SECONDS', 2))
+HEALTH_MONGO_TIMEOUT_SECONDS = float(os.environ.get('HEALTH_MONGO_TIMEOUT_SECONDS', 1))
+HEALTH_MAX_PING_MS = float(os.environ.get('HEALTH_MAX_PING_MS', 250))
+HEALTH_MAX_POOL_UTILIZATION = float(os.environ.get('HEALTH_MAX_POOL_UTILIZATION', 0.9))
+HEALTH_MAX_LOOP_LAG_MS = float(os.environ.get('HEALTH_MAX_LOOP_LAG_MS', 200))
+HEALTH_FAIL_WHEN_DEGRADED = os.environ.get('HEALTH_FAIL_WHEN_DEGRADED', 'false').lower() == 'true'
+
+# Metrics configuration
+METRICS_SLOW_REQUEST_MS = float(os.environ.get('METRICS_SLOW_REQUEST_MS', 500))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+COMMAND_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# Request instrumentation
+# MetricsMiddleware opens a RequestTrace per HTTP request in a context variable. Motor
+# copies the context into its executor threads, so the command listener attached to the
+# client can charge every Mongo command to the request that issued it.
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense"""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+class RequestTrace:
+    """The Mongo commands issued while serving one request"""
+    def __init__(self):
+        self.commands: List[Tuple[str, float]] = []
+        self._started: Dict[int, str] = {}
+
+def prometheus_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+               for name, value in labels.items())
+    return "{" + ",".join(escaped) + "}"
+
+class Metrics:
+    """Process-wide request and Mongo command metrics, rendered as Prometheus text"""
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = Counter()
+        self.latency: Dict[Tuple[str, str], Histogram] = {}
+        self.response_size: Dict[Tuple[str, str], Histogram] = {}
+        self.commands_per_request: Dict[Tuple[str, str], Histogram] = {}
+        self.mongo_commands = Counter()
+        self.mongo_seconds = defaultdict(float)
+
+    def record_request(self, method: str, route: str, status: int, seconds: float, size: int, trace: RequestTrace):
+        key = (method, route)
+        self.requests[(method, route, status)] += 1
+        self.latency.setdefault(key, Histogram(LATENCY_BUCKETS)).observe(seconds)
+        self.response_size.setdefault(key, Histogram(SIZE_BUCKETS)).observe(size)
+        self.commands_per_request.setdefault(key, Histogram(COMMAND_COUNT_BUCKETS)).observe(len(trace.commands))
+        for command, duration in trace.commands:
+            self.mongo_commands[(method, route, command)] += 1
+            self.mongo_seconds[(method, route, command)] += duration
+
+    def record_background_command(self, command: str, duration: float):
+        self.mongo_commands[("", "background", command)] += 1
+        self.mongo_seconds[("", "background", command)] += duration
+
+    def render(self, gauges: Dict[str, Tuple[str, float]] = None,
+               counters: Dict[str, Tuple[str, Tuple[str, ...], Dict[tuple, float]]] = None) -> str:
+        """Render everything recorded here plus caller-supplied gauges and labelled counters"""
+        lines = []
+
+        def histogram(name, help_text, series):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} histogram"])
+            for (method, route), hist in sorted(series.items()):
+                labels = {"method": method, "route": route}
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{prometheus_labels({**labels, 'le': '+Inf'})} {hist.count}")
+                lines.append(f"{name}_sum{prometheus_labels(labels)} {hist.sum}")
+                lines.append(f"{name}_count{prometheus_labels(labels)} {hist.count}")
+
+        def counter(name, help_text, series, label_names):
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} counter"])
+            for key, value in sorted(series.items()):
+                lines.append(f"{name}{prometheus_labels(dict(zip(label_names, key)))} {value}")
+
+        lines.extend(["# HELP irecommend_http_requests_in_flight Requests currently being served",
+                      "# TYPE irecommend_http_requests_in_flight gauge",
+                      f"irecommend_http_requests_in_flight {self.in_flight}"])
+        counter("irecommend_http_requests_total", "HTTP requests served", self.requests, ("method", "route", "status"))
+        histogram("irecommend_http_request_duration_seconds", "HTTP request latency", self.latency)
+        histogram("irecommend_http_response_size_bytes", "HTTP response body size", self.response_size)
+        histogram("irecommend_mongo_commands_per_request", "Mongo commands issued per HTTP request",
+                  self.commands_per_request)
+        counter("irecommend_mongo_commands_total", "Mongo commands by issuing route", self.mongo_commands,
+                ("method", "route", "command"))
+        counter("irecommend_mongo_command_seconds_total", "Time spent in Mongo commands by issuing route",
+                self.mongo_seconds, ("method", "route", "command"))
+        for name, (help_text, label_names, series) in (counters or {}).items():
+            counter(name, help_text, series, label_names)
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.extend([f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"])
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar("current_trace", default=None)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Charges each Mongo command's duration to the request (or background work) that ran it"""
+    def started(self, event):
+        trace = current_trace.get()
+        if trace is not None:
+            trace._started[event.request_id] = event.command_name
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        trace = current_trace.get()
+        duration = event.duration_micros / 1e6
+        if trace is None:
+            metrics.record_background_command(event.command_name, duration)
+        else:
+            trace._started.pop(event.request_id, None)
+            trace.commands.append((event.command_name, duration))
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and logging slow ones with their Mongo commands"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = RequestTrace()
+        token = current_trace.set(trace)
+        status, size = 500, 0
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status, size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        metrics.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight -= 1
+            current_trace.reset(token)
+            elapsed = time.perf_counter() - start
+            # The router stores the matched route in the scope; label by its template, not the raw path
+            route = scope.get("route")
+            route_path = getattr(route, "path", "unmatched")
+            metrics.record_request(scope["method"], route_path, status, elapsed, size, trace)
+            if elapsed * 1000 >= METRICS_SLOW_REQUEST_MS:
+                summary = Counter(command for command, _ in trace.commands)
+                logger.warning(
+                    "Slow request %s %s -> %s in %.0f ms; %d Mongo commands (%.0f ms): %s",
+                    scope["method"], scope["path"], status, elapsed * 1000, len(trace.commands),
+                    sum(duration for _, duration in trace.commands) * 1000,
+                    ", ".join(f"{command} x{count}" for command, count in summary.most_common())
+                )
+
+class ConnectionPoolTracker(monitoring.ConnectionPoolListener):
+    """Tracks checked-out connections per server so readiness can report pool utilization"""
+    def __init__(self):
+        self.in_use: Dict[Any, int] = defaultdict(int)
+
+    def connection_checked_out(self, event):
+        self.in_use[event.address] += 1
+
+    def connection_checked_in(self, event):
+        self.in_use[event.address] -= 1
+
+    def pool_closed(self, event):
+        self.in_use.pop(event.address, None)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+connection_pools = ConnectionPoolTracker()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener(), connection_pools])
 db = client[os.environ['DB_NAME']]
 
 # Create the main app without a prefix
 app = FastAPI()
 
+# JSON responses
+# orjson writes datetimes itself and ObjectIds through json_default, so response shapes
+# can carry raw document values. Endpoints on hot paths return FastJSONResponse directly
+# (via json_response), which also skips FastAPI's jsonable_encoder pass over the result.
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=json_default)
+
+def json_response(content: Any, response: Optional[Response] = None) -> FastJSONResponse:
+    """Render content as-is, keeping any headers set on the endpoint's injected Response"""
+    result = FastJSONResponse(content)
+    if response is not None:
+        for name, value in response.headers.items():
+            result.headers[name] = value
+    return result
+
 # Create a router with the /api prefix
-api_router = APIRouter(prefix="/api")
+api_router = APIRouter(prefix="/api", default_response_class=FastJSONResponse)
+
+# Socket.IO client managers
+# With more than one worker, emits must reach sockets held by other processes. The
+# mongo manager relays them through a capped collection tailed by every worker; the
+# memory manager keeps everything in-process, for single-worker runs and tests.
+# Messages carry a sequence number from a shared counter rather than relying on
+# ObjectId order, which is only roughly monotonic across processes. A listener that
+# has to re-open its cursor rewinds SOCKETIO_RESUME_WINDOW sequence numbers, so
+# messages committed slightly out of order are not lost, and drops repeats it has seen.
+class MongoPubSubManager(AsyncPubSubManager):
+    """Socket.IO pub/sub manager backed by a tailable cursor on a capped collection"""
+    name = 'mongopubsub'
+
+    def __init__(self, database, channel='socketio', collection_bytes=SOCKETIO_COLLECTION_BYTES,
+                 resume_window=SOCKETIO_RESUME_WINDOW, write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.database = database
+        self.collection = database[f"{channel}_messages"]
+        self.collection_bytes = collection_bytes
+        self.resume_window = resume_window
+        self.listening = False
+        self._collection_ready = False
+
+    async def _ensure_collection(self):
+        if self._collection_ready:
+            return
+        try:
+            await self.database.create_collection(
+                self.collection.name, capped=True, size=self.collection_bytes
+            )
+        except CollectionInvalid:
+            pass  # created by another worker
+        self._collection_ready = True
+
+    async def _next_seq(self) -> int:
+        counter = await self.database.sequences.find_one_and_update(
+            {"_id": self.collection.name}, {"$inc": {"seq": 1}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return counter["seq"]
+
+    async def _insert(self, payload: Optional[str]) -> int:
+        seq = await self._next_seq()
+        await self.collection.insert_one({
+            "channel": self.channel,
+            "seq": seq,
+            "payload": payload,
+            "created_at": datetime.now(timezone.utc)
+        })
+        return seq
+
+    async def _publish(self, data):
+        await self._ensure_collection()
+        # JSON rather than pickle: anyone able to write to the collection could otherwise run code in every worker
+        await self._insert(orjson.dumps(data, default=json_default).decode("utf-8"))
+
+    async def _listen(self):
+        await self._ensure_collection()
+        # A tailable cursor that matches nothing is closed at once, so tail from the newest
+        # message (inclusive) and seed an empty collection with a marker that is never relayed
+        newest = await self.collection.find_one({"channel": self.channel}, {"seq": 1}, sort=[("$natural", -1)])
+        start = newest["seq"] if newest else await self._insert(None)
+        seen = deque([start], maxlen=self.resume_window)
+        seen_set = {start}
+        while True:
+            cursor = self.collection.find(
+                {"channel": self.channel, "seq": {"$gte": start}},
+                cursor_type=CursorType.TAILABLE_AWAIT
+            )
+            self.listening = True
+            try:
+                async for message in cursor:
+                    seq = message["seq"]
+                    if seq in seen_set:
+                        continue
+                    if len(seen) == seen.maxlen:
+                        seen_set.discard(seen[0])
+                    seen.append(seq)
+                    seen_set.add(seq)
+                    if message["payload"] is not None:
+                        yield message["payload"]
+            finally:
+                self.listening = False
+            # The cursor dies if capped rollover overtakes it; resume after a short pause,
+            # rewinding over the window of sequence numbers already deduplicated
+            start = max(max(seen) - self.resume_window + 1, min(seen))
+            await asyncio.sleep(0.1)
+
+SOCKETIO_MANAGERS = {
+    "memory": lambda: socketio.AsyncManager(),
+    "mongo": lambda: MongoPubSubManager(db, channel=SOCKETIO_CHANNEL),
+}
 
 # Socket.IO setup for real-time features
 sio = socketio.AsyncServer(
     async_mode='asgi',
+    client_manager=SOCKETIO_MANAGERS[SOCKETIO_MANAGER](),
     cors_allowed_origins="*",
     logger=True
 )
@@ -70,7 +539,9 @@ class User(BaseModel):
     username: str
     password_hash: str
     name: str
-    avatar: Optional[str] = ""  # base64 encoded image
+    avatar: Optional[str] = ""  # legacy or external avatar URL; stored avatars only set avatar_id
+    avatar_id: Optional[str] = ""  # SHA-256 media ID
+    avatar_renditions: Dict[str, str] = {}  # rendition name -> media ID
     bio: Optional[str] = ""
     external_link: Optional[str] = ""
     follower_count: int = 0
@@ -78,12 +549,34 @@ class User(BaseModel):
     rooms: List[PyObjectId] = []
     is_active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # search sync watermark
+
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str}
+
+class Principal(BaseModel):
+    """The authenticated user as seen by request handlers: no password hash or room list"""
+    id: PyObjectId = Field(alias="_id")
+    email: str
+    username: str
+    name: str
+    avatar: Optional[str] = ""
+    avatar_id: Optional[str] = ""
+    avatar_renditions: Dict[str, str] = {}
+    bio: Optional[str] = ""
+    external_link: Optional[str] = ""
+    follower_count: int = 0
+    following_count: int = 0
 
     class Config:
         populate_by_name = True
         arbitrary_types_allowed = True
         json_encoders = {ObjectId: str}
 
+PRINCIPAL_PROJECTION = {field.alias or name: 1 for name, field in Principal.model_fields.items()}
+
 class UserRegister(BaseModel):
     email: str
     username: str
@@ -103,7 +596,8 @@ class UserUpdate(BaseModel):
     username: Optional[str] = None
     bio: Optional[str] = None
     external_link: Optional[str] = None
-    avatar: Optional[str] = None
+    avatar: Optional[str] = None  # legacy base64 upload, stored as media on write
+    avatar_id: Optional[str] = None
 
 class Room(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
@@ -112,6 +606,7 @@ class Room(BaseModel):
     color: str
     post_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # search sync watermark
 
     class Config:
         populate_by_name = True
@@ -128,7 +623,9 @@ class Post(BaseModel):
     room_id: PyObjectId
     title: str
     description: str
-    media: Optional[str] = ""  # base64 encoded
+    media: Optional[str] = ""  # legacy or external media URL; stored media only sets media_id
+    media_id: Optional[str] = ""  # SHA-256 media ID
+    media_renditions: Dict[str, str] = {}  # rendition name -> media ID
     media_type: Optional[str] = "image"  # "image" or "video"
     tags: List[str] = []
     external_link: Optional[str] = ""
@@ -138,6 +635,7 @@ class Post(BaseModel):
     comment_count: int = 0
     repost_count: int = 0
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # search sync watermark
 
     class Config:
         populate_by_name = True
@@ -148,7 +646,8 @@ class PostCreate(BaseModel):
     room_id: str
     title: str
     description: str
-    media: Optional[str] = ""
+    media: Optional[str] = ""  # legacy base64 upload, stored as media on write
+    media_id: Optional[str] = ""
     media_type: Optional[str] = "image"
     tags: List[str] = []
     external_link: Optional[str] = ""
@@ -195,101 +694,2637 @@ class CommentCreate(BaseModel):
 
 class Message(BaseModel):
     id: Optional[PyObjectId] = Field(default_factory=PyObjectId, alias="_id")
+    conversation_key: str  # "<lower user id>:<higher user id>"
     sender_id: PyObjectId
     receiver_id: PyObjectId
     content: str
-    media: Optional[str] = ""
+    media: Optional[str] = ""  # legacy or external media URL; stored media only sets media_id
+    media_id: Optional[str] = ""  # SHA-256 media ID
+    media_renditions: Dict[str, str] = {}  # rendition name -> media ID
     message_type: str = "text"  # "text" or "image"
     read: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
-    class Config:
-        populate_by_name = True
-        arbitrary_types_allowed = True
-        json_encoders = {ObjectId: str}
+    class Config:
+        populate_by_name = True
+        arbitrary_types_allowed = True
+        json_encoders = {ObjectId: str}
+
+class MessageCreate(BaseModel):
+    receiver_id: str
+    content: str
+    media: Optional[str] = ""  # legacy base64 upload, stored as media on write
+    media_id: Optional[str] = ""
+    message_type: str = "text"
+
+class PostIdsRequest(BaseModel):
+    post_ids: List[str] = Field(max_length=BATCH_MAX_IDS)
+
+class UsernamesRequest(BaseModel):
+    usernames: List[str] = Field(max_length=BATCH_MAX_IDS)
+
+# Authentication helper functions
+def hash_password(password: str, rounds: int = BCRYPT_ROUNDS) -> str:
+    """Hash a password using bcrypt"""
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+def verify_password(password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash"""
+    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Check whether a bcrypt hash was made with a different cost factor than configured"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded worker pool so a login burst never blocks the event loop"""
+    def __init__(self, workers: int, pool: str):
+        self.workers = workers
+        if pool == "process":
+            self._executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bcrypt")
+        self._slots = asyncio.Semaphore(workers)
+        self.queue_depth = 0  # calls waiting for a free worker
+        self.active = 0
+
+    async def _run(self, fn, *args):
+        self.queue_depth += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth -= 1
+        self.active += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.active -= 1
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password, BCRYPT_ROUNDS)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self._run(verify_password, password, hashed_password)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+password_hasher = PasswordHasher(PASSWORD_HASH_WORKERS, PASSWORD_HASH_POOL)
+
+def create_access_token(data: dict):
+    """Create a JWT access token"""
+    to_encode = data.copy()
+    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    to_encode.update({"exp": expire})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+def verify_token(token: str):
+    """Verify and decode a JWT token"""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        return payload
+    except JWTError:
+        return None
+
+class PrincipalCache:
+    """TTL + LRU cache of principals keyed by user id, with hit/miss counters"""
+    def __init__(self, max_size: int, ttl: float):
+        self._entries = TTLCache(maxsize=max_size, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: str) -> Optional[Principal]:
+        principal = self._entries.get(user_id)
+        if principal is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return principal
+
+    def set(self, user_id: str, principal: Principal):
+        self._entries[user_id] = principal
+
+    def invalidate(self, *user_ids):
+        """Drop cached principals; call after any write to these user documents"""
+        for user_id in user_ids:
+            self._entries.pop(str(user_id), None)
+
+    def __len__(self):
+        return len(self._entries)
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+# Security scheme for FastAPI
+security = HTTPBearer()
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Principal:
+    """Get current user from JWT token, served from the principal cache when possible"""
+    credentials_exception = HTTPException(
+        status_code=401,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    
+    try:
+        token = credentials.credentials
+        payload = verify_token(token)
+        if payload is None:
+            raise credentials_exception
+        
+        user_id = payload.get("sub")
+        if user_id is None or not ObjectId.is_valid(user_id):
+            raise credentials_exception
+            
+    except Exception:
+        raise credentials_exception
+    
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    
+    # Find user in database
+    user_doc = await db.users.find_one({"_id": ObjectId(user_id)}, PRINCIPAL_PROJECTION)
+    if user_doc is None:
+        raise credentials_exception
+    
+    principal = Principal(**user_doc)
+    principal_cache.set(user_id, principal)
+    return principal
+
+# Endpoints that only personalize their response accept a missing or invalid token
+optional_security = HTTPBearer(auto_error=False)
+
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)) -> Optional[Principal]:
+    """Get the current user if a valid token was sent, otherwise None"""
+    if credentials is None:
+        return None
+    try:
+        return await get_current_user(credentials)
+    except HTTPException:
+        return None
+
+async def get_admin_user(current_user: Principal = Depends(get_current_user)) -> Principal:
+    """Require one of the users listed in ADMIN_USER_IDS"""
+    if str(current_user.id) not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+# Background tasks
+# Strong references keep fire-and-forget tasks alive until they finish.
+background_tasks = set()
+
+def run_in_background(coro):
+    """Schedule a coroutine without awaiting it, logging any failure"""
+    task = asyncio.create_task(coro)
+    background_tasks.add(task)
+
+    def _done(task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task failed", exc_info=task.exception())
+
+    task.add_done_callback(_done)
+    return task
+
+# Response compression
+# CompressionMiddleware picks zstd, br or gzip from Accept-Encoding and compresses complete
+# JSON and text bodies of at least COMPRESSION_MIN_SIZE bytes; bodies past
+# COMPRESSION_OFFLOAD_SIZE compress on a worker thread (zlib, brotli and zstd release the
+# GIL). Streamed responses (NDJSON exports, media) pass through unbuffered. Compressed
+# responses get a weak ETag, as the bytes differ per encoding.
+COMPRESSIBLE_TYPES = re.compile(r"^(application/json|text/)")
+COMPRESSORS: Dict[str, Callable[[bytes], bytes]] = {
+    "gzip": lambda body: gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL, mtime=0),
+}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda body: brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+if zstandard is not None:
+    COMPRESSORS["zstd"] = lambda body: zstandard.ZstdCompressor(level=COMPRESSION_ZSTD_LEVEL).compress(body)
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """The content coding to answer with, or None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        quality = 1.0
+        params = params.replace(" ", "")
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        weights[coding.strip().lower()] = quality
+    wildcard = weights.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for coding in COMPRESSION_ENCODINGS:
+        quality = weights.get(coding, wildcard)
+        if coding in COMPRESSORS and quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+def compress_body(encoding: str, body: bytes) -> Tuple[bytes, float]:
+    """Compress body, returning it with the CPU time this thread spent"""
+    started = time.thread_time()
+    compressed = COMPRESSORS[encoding](body)
+    return compressed, time.thread_time() - started
+
+def add_vary(headers: MutableHeaders, name: str):
+    vary = headers.get("vary")
+    if vary is None:
+        headers["Vary"] = name
+    elif name.lower() not in vary.lower():
+        headers["Vary"] = f"{vary}, {name}"
+
+class ResponseCompressor:
+    """Compresses bodies, large ones on a thread pool, and counts bytes saved and CPU time"""
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compress")
+        # Keyed by (encoding, source); source is "middleware" or "cache"
+        self.responses = Counter()
+        self.bytes_saved = Counter()
+        self.cpu_seconds = defaultdict(float)
+
+    async def compress(self, encoding: str, body: bytes, source: str) -> bytes:
+        if len(body) >= COMPRESSION_OFFLOAD_SIZE:
+            compressed, cpu_seconds = await asyncio.get_running_loop().run_in_executor(
+                self._executor, compress_body, encoding, body
+            )
+        else:
+            compressed, cpu_seconds = compress_body(encoding, body)
+        self.cpu_seconds[(encoding, source)] += cpu_seconds
+        return compressed
+
+    def record(self, encoding: str, source: str, size: int, compressed_size: int):
+        self.responses[(encoding, source)] += 1
+        self.bytes_saved[(encoding, source)] += size - compressed_size
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+response_compressor = ResponseCompressor(COMPRESSION_WORKERS)
+
+class CompressionMiddleware:
+    """ASGI middleware compressing complete JSON and text responses for clients that accept it"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = next((value.decode("latin-1") for name, value in scope["headers"]
+                                if name == b"accept-encoding"), None)
+        encoding = negotiate_encoding(accept_encoding)
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                if COMPRESSIBLE_TYPES.match(headers.get("content-type", "")) and "content-encoding" not in headers:
+                    add_vary(headers, "Accept-Encoding")
+                    declined = scope.get("state", {}).get("compression_declined")
+                    if encoding is not None and "content-range" not in headers and not declined:
+                        # Hold the start until the body shows whether it is worth compressing
+                        start_message = message
+                        return
+            elif message["type"] == "http.response.body" and start_message is not None:
+                held, start_message = start_message, None
+                body = message.get("body", b"")
+                if not message.get("more_body") and len(body) >= COMPRESSION_MIN_SIZE:
+                    compressed = await response_compressor.compress(encoding, body, "middleware")
+                    if len(compressed) < len(body):
+                        response_compressor.record(encoding, "middleware", len(body), len(compressed))
+                        headers = MutableHeaders(scope=held)
+                        headers["Content-Encoding"] = encoding
+                        headers["Content-Length"] = str(len(compressed))
+                        etag = headers.get("etag")
+                        if etag and not etag.startswith("W/"):
+                            headers["ETag"] = f"W/{etag}"
+                        message = {**message, "body": compressed}
+                await send(held)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+# Response cache
+# Public GET endpoints store their rendered body under the path and query, with a strong
+# ETag (SHA-256 of the body) so clients revalidate with If-None-Match and get a 304.
+# Entries carry tags (post:<id>, user:<id>, rooms:<user id>, posts) that write paths
+# invalidate. Buffered counters invalidate their documents' tags when flushed, so a count
+# is stale for at most COUNTER_FLUSH_SECONDS in this worker. The memory store is per
+# worker, so writes on other workers show up within RESPONSE_CACHE_TTL; the mongo store
+# shares entries and invalidations across workers. Entries keep each compressed variant
+# once it has been asked for, or an empty one when compression did not pay off, so hits
+# are not recompressed.
+class InMemoryResponseStore:
+    """LRU + TTL entries held by this worker, with a tag -> keys index for invalidation"""
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self._entries = TTLCache(maxsize=max_size, ttl=ttl)
+        self._tags: Dict[str, set] = defaultdict(set)
+        self._links = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        return self._entries.get(key)
+
+    async def set(self, key: str, entry: dict):
+        self._entries[key] = entry
+        for tag in entry["tags"]:
+            self._tags[tag].add(key)
+        self._links += len(entry["tags"])
+        if self._links > 4 * self.max_size:
+            # Evicted and expired entries leave keys behind in the tag index; rebuild it
+            self._tags = defaultdict(set)
+            self._links = 0
+            for live_key, live_entry in list(self._entries.items()):
+                for tag in live_entry["tags"]:
+                    self._tags[tag].add(live_key)
+                self._links += len(live_entry["tags"])
+
+    async def add_variant(self, key: str, entry: dict, encoding: str, body: bytes):
+        entry.setdefault("encoded", {})[encoding] = body
+
+    def invalidate(self, tags):
+        for tag in tags:
+            for key in self._tags.pop(tag, ()):
+                self._entries.pop(key, None)
+
+class MongoResponseStore:
+    """Entries in the response_cache collection, shared by all workers"""
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[dict]:
+        return await db.response_cache.find_one(
+            {"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}},
+            {"body": 1, "etag": 1, "headers": 1, "tags": 1, "encoded": 1, "context": 1}
+        )
+
+    async def set(self, key: str, entry: dict):
+        await db.response_cache.replace_one(
+            {"_id": key},
+            {**entry, "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)},
+            upsert=True
+        )
+
+    async def add_variant(self, key: str, entry: dict, encoding: str, body: bytes):
+        entry.setdefault("encoded", {})[encoding] = body
+        # No upsert: an entry invalidated meanwhile stays deleted
+        run_in_background(db.response_cache.update_one({"_id": key}, {"$set": {f"encoded.{encoding}": body}}))
+
+    def invalidate(self, tags):
+        run_in_background(db.response_cache.delete_many({"tags": {"$in": list(tags)}}))
+
+RESPONSE_CACHE_STORES = {
+    "memory": lambda: InMemoryResponseStore(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL),
+    "mongo": lambda: MongoResponseStore(RESPONSE_CACHE_TTL),
+}
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+class ResponseCache:
+    """Rendered JSON responses for public endpoints, answered with 304 when the client's ETag matches"""
+    def __init__(self, store):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        # Bumped by every invalidation; a response built across one is not stored, since it
+        # may have read data from before the write
+        self.generation = 0
+
+    @staticmethod
+    def key(request: Request, exclude: Set[str] = frozenset()) -> str:
+        """Cache key from the path and sorted query parameters, leaving out those named in exclude"""
+        params = [param for param in request.url.query.split("&") if param.partition("=")[0] not in exclude]
+        return f"{request.url.path}?{'&'.join(sorted(params))}"
+
+    async def fetch(self, request: Request, key: str) -> Optional[dict]:
+        """Return the cached entry under key, or None to build it and call save"""
+        request.state.response_cache_generation = self.generation
+        try:
+            entry = await self.store.get(key)
+        except Exception:
+            logger.exception("Response cache unavailable")
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    async def lookup(self, request: Request) -> Optional[Response]:
+        """Return the cached response for this request, or None to build it and call store_response"""
+        entry = await self.fetch(request, self.key(request))
+        return await self.respond(request, entry) if entry is not None else None
+
+    async def save(self, request: Request, key: str, content: Any, tags, response: Optional[Response] = None,
+                   context: Any = None) -> dict:
+        """Render content and cache it under tags; context is kept alongside for callers that extend the body"""
+        body = orjson.dumps(content, default=json_default)
+        entry = {
+            "body": body,
+            "etag": f'"{hashlib.sha256(body).hexdigest()}"',
+            "headers": {name: value for name, value in response.headers.items()
+                        if name not in ("content-length", "content-type")} if response is not None else {},
+            "tags": sorted(set(tags)),
+        }
+        if context is not None:
+            entry["context"] = context
+        if getattr(request.state, "response_cache_generation", None) == self.generation:
+            try:
+                await self.store.set(key, entry)
+            except Exception:
+                logger.exception("Response cache unavailable")
+        return entry
+
+    async def store_response(self, request: Request, content: Any, tags, response: Optional[Response] = None) -> Response:
+        """Render content, cache it under tags and answer the request"""
+        return await self.respond(request, await self.save(request, self.key(request), content, tags, response))
+
+    async def respond(self, request: Request, entry: dict) -> Response:
+        body = entry["body"]
+        encoding = negotiate_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESSION_MIN_SIZE else None
+        headers = {
+            **entry["headers"],
+            "ETag": f"W/{entry['etag']}" if encoding else entry["etag"],
+            "Cache-Control": f"public, max-age={RESPONSE_CACHE_MAX_AGE}",
+            "Vary": "Accept-Encoding",
+        }
+        if etag_matches(request, entry["etag"]):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            compressed = (entry.get("encoded") or {}).get(encoding)
+            if compressed is None:
+                compressed = await response_compressor.compress(encoding, body, "cache")
+                if len(compressed) >= len(body):
+                    compressed = b""  # not worth compressing; the empty variant records that
+                await self.store.add_variant(self.key(request), entry, encoding, compressed)
+            if compressed:
+                response_compressor.record(encoding, "cache", len(body), len(compressed))
+                headers["Content-Encoding"] = encoding
+                body = compressed
+            else:
+                # Already tried; tell CompressionMiddleware not to compress it again
+                request.state.compression_declined = True
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying one of these tags; call after the write that affects them"""
+        if tags:
+            self.generation += 1
+            self.store.invalidate(tags)
+
+response_cache = ResponseCache(RESPONSE_CACHE_STORES[RESPONSE_CACHE_BACKEND]())
+
+# Counters
+# like_count, comment_count, follower_count and following_count are write-behind: write
+# paths add deltas here and a background flush applies them as $inc bulk_write batches,
+# so a hot post costs one update per flush rather than one per tap. Responses report
+# stored value + pending delta. Buffered deltas are per worker, so other workers' taps
+# show up after their next flush; reconcile_counters repairs any drift from the source
+# collections.
+class CounterBuffer:
+    """Per-document $inc deltas, merged in memory and flushed in periodic bulk batches"""
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self._pending: Dict[str, Dict[ObjectId, Counter]] = defaultdict(lambda: defaultdict(Counter))
+        self._in_flight: Dict[str, Dict[ObjectId, Counter]] = {}
+
+    def add(self, collection_name: str, _id: ObjectId, field: str, delta: int) -> int:
+        """Buffer a delta and return the total not yet visible in the stored document"""
+        self._pending[collection_name][_id][field] += delta
+        return self.pending(collection_name, _id, field)
+
+    def pending(self, collection_name: str, _id: ObjectId, field: str) -> int:
+        total = 0
+        for deltas in (self._pending, self._in_flight):
+            fields = deltas.get(collection_name, {}).get(_id)
+            if fields:
+                total += fields[field]
+        return total
+
+    async def flush(self):
+        """Write every buffered delta; failed batches go back into the buffer"""
+        if not self._pending:
+            return
+        self._in_flight, self._pending = self._pending, defaultdict(lambda: defaultdict(Counter))
+        try:
+            for collection_name, documents in self._in_flight.items():
+                updates = [
+                    (_id, {field: delta for field, delta in fields.items() if delta})
+                    for _id, fields in documents.items()
+                ]
+                updates = [(_id, increments) for _id, increments in updates if increments]
+                for start in range(0, len(updates), self.batch_size):
+                    batch = updates[start:start + self.batch_size]
+                    try:
+                        await db[collection_name].bulk_write(
+                            [UpdateOne({"_id": _id}, {"$inc": increments}) for _id, increments in batch],
+                            ordered=False
+                        )
+                        failed = []
+                    except BulkWriteError as e:
+                        # Unordered, so every operation not listed in writeErrors was applied
+                        failed = [batch[error["index"]] for error in e.details["writeErrors"]]
+                        logger.error("Counter flush failed for %d of %d %s documents; retrying them next flush",
+                                     len(failed), len(batch), collection_name)
+                    except Exception:
+                        logger.exception("Counter flush failed for %s; retrying next flush", collection_name)
+                        failed = batch
+                    # Written deltas are in the stored documents now and failed ones are pending
+                    # again, so stop counting either here
+                    for _id, _ in batch:
+                        documents.pop(_id, None)
+                    for _id, increments in failed:
+                        for field, delta in increments.items():
+                            self._pending[collection_name][_id][field] += delta
+                    failed_ids = {_id for _id, _ in failed}
+                    written = [_id for _id, _ in batch if _id not in failed_ids]
+                    if not written:
+                        continue
+                    if collection_name == "users":
+                        principal_cache.invalidate(*written)
+                    response_cache.invalidate(*(f"{COUNTER_CACHE_TAGS[collection_name]}:{_id}" for _id in written))
+        finally:
+            self._in_flight = {}
+
+    async def flush_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+
+counters = CounterBuffer(COUNTER_FLUSH_BATCH)
+
+# Response cache tag prefix for each counted collection
+COUNTER_CACHE_TAGS = {"posts": "post", "users": "user"}
+
+COUNTER_SOURCES = [
+    # (collection, field, source collection, source field)
+    ("posts", "like_count", "likes", "post_id"),
+    ("posts", "comment_count", "comments", "post_id"),
+    ("users", "follower_count", "follows", "following_id"),
+    ("users", "following_count", "follows", "follower_id"),
+]
+
+async def reconcile_counters(batch_size: int = 1000) -> Dict[str, int]:
+    """Recompute every counter from its source collection and fix the documents that drifted"""
+    await counters.flush()
+    corrected = {}
+    for collection_name, field, source, key in COUNTER_SOURCES:
+        actual = {
+            row["_id"]: row["count"]
+            for row in await db[source].aggregate([{"$group": {"_id": f"${key}", "count": {"$sum": 1}}}]).to_list(None)
+        }
+        fixes = []
+        async for doc in db[collection_name].find({}, {field: 1}):
+            count = actual.get(doc["_id"], 0)
+            if doc.get(field) != count:
+                fixes.append((doc["_id"], count))
+        for start in range(0, len(fixes), batch_size):
+            await db[collection_name].bulk_write([
+                UpdateOne({"_id": _id}, {"$set": {field: count}}) for _id, count in fixes[start:start + batch_size]
+            ], ordered=False)
+        if collection_name == "users":
+            principal_cache.invalidate(*(_id for _id, _ in fixes))
+        response_cache.invalidate(*(f"{COUNTER_CACHE_TAGS[collection_name]}:{_id}" for _id, _ in fixes))
+        corrected[f"{collection_name}.{field}"] = len(fixes)
+    return corrected
+
+# Admission control
+# Every /api request passes a token bucket for its route class, keyed by the JWT subject
+# or, for anonymous requests and auth routes, the client IP. Buckets live in this worker
+# (memory) or in the rate_limits collection (mongo) so limits hold across workers. A
+# global cap on in-flight requests sheds excess load with 503 before the event loop
+# saturates. Health checks (readiness included) and metrics are exempt from both.
+def parse_rate(value: str) -> Tuple[float, float]:
+    """'<requests>/<seconds>' as (bucket capacity, tokens refilled per second)"""
+    requests_allowed, seconds = value.split("/")
+    return float(requests_allowed), float(requests_allowed) / float(seconds)
+
+RATE_LIMIT_RULES = {
+    "auth": parse_rate(RATE_LIMIT_AUTH),
+    "write": parse_rate(RATE_LIMIT_WRITE),
+    "toggle": parse_rate(RATE_LIMIT_TOGGLE),
+    "default": parse_rate(RATE_LIMIT_DEFAULT),
+}
+ROUTE_CLASSES = [
+    ("POST", re.compile(r"^/api/auth/(login|register)$"), "auth"),
+    ("POST", re.compile(r"^/api/(posts|media|messages)$"), "write"),
+    ("POST", re.compile(r"^/api/posts/[^/]+/comments$"), "write"),
+    ("POST", re.compile(r"^/api/(posts/[^/]+/like|users/[^/]+/follow)$"), "toggle"),
+]
+# Probes and scrapes must keep answering while clients are throttled or the worker is saturated
+ADMISSION_EXEMPT_PATHS = re.compile(r"^/api/(health|metrics)(/|$)")
+
+def route_class(method: str, path: str) -> str:
+    for route_method, pattern, name in ROUTE_CLASSES:
+        if method == route_method and pattern.match(path):
+            return name
+    return "default"
+
+class InMemoryRateLimiter:
+    """Token buckets held by this worker"""
+    def __init__(self, max_keys: int = 100000):
+        self._buckets = TTLCache(maxsize=max_keys, ttl=3600)
+
+    async def acquire(self, key: str, capacity: float, rate: float) -> float:
+        """Take a token; returns 0 if allowed, otherwise seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return 0.0
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / rate
+
+class MongoRateLimiter:
+    """Token buckets shared by all workers, refilled and debited in one atomic update"""
+    async def acquire(self, key: str, capacity: float, rate: float) -> float:
+        now = time.time()
+        bucket = await db.rate_limits.find_one_and_update({"_id": key}, [
+            {"$set": {"tokens": {"$min": [capacity, {"$add": [
+                {"$ifNull": ["$tokens", capacity]},
+                {"$multiply": [{"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}]}, rate]}
+            ]}]}}},
+            {"$set": {
+                "allowed": {"$gte": ["$tokens", 1]},
+                "updated_at": now,
+                # An idle bucket is full again after capacity / rate seconds and can be dropped
+                "expires_at": datetime.now(timezone.utc) + timedelta(seconds=capacity / rate)
+            }},
+            {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+        ], projection={"tokens": 1, "allowed": 1}, upsert=True, return_document=ReturnDocument.AFTER)
+        if bucket["allowed"]:
+            return 0.0
+        return (1 - bucket["tokens"]) / rate
+
+RATE_LIMITERS = {
+    "memory": InMemoryRateLimiter,
+    "mongo": MongoRateLimiter,
+}
+
+rate_limiter = RATE_LIMITERS[RATE_LIMIT_BACKEND]()
+
+def client_key(scope: dict) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        for name, value in scope["headers"]:
+            if name == b"x-forwarded-for":
+                return f"ip:{value.decode('latin-1').split(',')[0].strip()}"
+    client_address = scope.get("client")
+    return f"ip:{client_address[0] if client_address else 'unknown'}"
+
+def rate_limit_key(scope: dict, name: str) -> str:
+    """Bucket key for a request: the JWT subject when signed in, else the client IP"""
+    if name != "auth":
+        for header, value in scope["headers"]:
+            if header == b"authorization":
+                value = value.decode("latin-1")
+                payload = verify_token(value[7:]) if value.lower().startswith("bearer ") else None
+                if payload and payload.get("sub"):
+                    return f"{name}:user:{payload['sub']}"
+                break
+    return f"{name}:{client_key(scope)}"
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying per-route-class rate limits and a global concurrency cap"""
+    def __init__(self, app, max_concurrent: int = ADMISSION_MAX_CONCURRENT):
+        self.app = app
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.rejected = Counter()
+        admission_controllers.append(self)
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path", "")
+        if scope["type"] != "http" or not path.startswith("/api") or ADMISSION_EXEMPT_PATHS.match(path):
+            await self.app(scope, receive, send)
+            return
+
+        name = route_class(scope["method"], path)
+        capacity, rate = RATE_LIMIT_RULES[name]
+        try:
+            retry_after = await rate_limiter.acquire(rate_limit_key(scope, name), capacity, rate)
+        except Exception:
+            logger.exception("Rate limiter unavailable; admitting request")
+            retry_after = 0.0
+        if retry_after:
+            self.rejected[f"rate_limited:{name}"] += 1
+            await self.reject(scope, receive, send, 429, "Too many requests", retry_after)
+            return
+
+        if self.in_flight >= self.max_concurrent:
+            self.rejected["overloaded"] += 1
+            await self.reject(scope, receive, send, 503, "Server is busy, try again shortly", 1)
+            return
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+    @staticmethod
+    async def reject(scope, receive, send, status_code: int, detail: str, retry_after: float):
+        response = JSONResponse(
+            status_code=status_code,
+            content={"detail": detail},
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+        )
+        await response(scope, receive, send)
+
+# Starlette builds the middleware stack lazily, so instances register themselves here
+admission_controllers: List[AdmissionControlMiddleware] = []
+
+def admission_stats() -> dict:
+    return {
+        "in_flight": sum(controller.in_flight for controller in admission_controllers),
+        "max_concurrent": ADMISSION_MAX_CONCURRENT,
+        "rejected": dict(sum((controller.rejected for controller in admission_controllers), Counter())),
+    }
+
+# Media storage
+# Blobs are content-addressed: the media ID is the hex SHA-256 of the stored bytes, so
+# every URL is immutable. Still images are decoded once on a process pool and
+# re-encoded without EXIF at MEDIA_RENDITIONS widths, each rendition a blob of its own.
+# media_sources maps an upload's SHA-256 to the ID of its stored full rendition, so
+# identical uploads are processed and stored once. The content type is always sniffed
+# from the bytes, never taken from the client: videos in MEDIA_ALLOWED_TYPES are stored
+# as uploaded, everything else must decode as an image, and animations Pillow does not
+# re-encode are kept only in MEDIA_ALLOWED_TYPES. A blob is never served as HTML or script.
+MEDIA_ID_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+DATA_URI_PATTERN = re.compile(r"^data:(?P<content_type>[\w.+-]+/[\w.+-]+)?(;[\w-]+=[\w.-]+)*;base64,", re.IGNORECASE)
+MEDIA_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF8", "image/gif"),
+    (b"\x1a\x45\xdf\xa3", "video/webm"),
+]
+MEDIA_ALLOWED_TYPES = {"image/jpeg", "image/png", "image/gif", "image/webp", "video/mp4", "video/quicktime", "video/webm"}
+
+# EXIF orientation -> transpose that displays the image upright
+EXIF_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+def render_image(data: bytes, widths: Dict[str, int], image_format: str, quality: int,
+                 max_pixels: int) -> Optional[List[Tuple[str, bytes, str, int, int]]]:
+    """Decode an image once and encode it at each width; None for animations, which are kept as uploaded"""
+    with Image.open(io.BytesIO(data)) as image:
+        if image.width * image.height > max_pixels:
+            raise Image.DecompressionBombError(f"Image is larger than {max_pixels} pixels")
+        if getattr(image, "is_animated", False):
+            return None
+        icc_profile = image.info.get("icc_profile")
+        transpose = EXIF_TRANSPOSE.get(image.getexif().get(ExifTags.Base.Orientation))
+        # Widths are in display orientation; orientations 5-8 swap the stored axes
+        swapped = transpose in (Image.Transpose.TRANSPOSE, Image.Transpose.TRANSVERSE,
+                                Image.Transpose.ROTATE_90, Image.Transpose.ROTATE_270)
+        scale = min(1.0, max(widths.values()) / (image.height if swapped else image.width))
+        # JPEGs can be decoded straight at a reduced scale, which bounds memory for camera-sized uploads
+        image.draft("RGB", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+        mode = "RGBA" if has_alpha and image_format == "webp" else "RGB"
+        if image.mode != mode:
+            image = image.convert(mode)
+        else:
+            image.load()
+
+    renditions = []
+    # Largest first, so each smaller rendition is resized from the previous one; rotating after the
+    # first resize keeps the full-size decode as the only large buffer
+    for name, width in sorted(widths.items(), key=lambda item: -item[1]):
+        display_width = image.height if swapped else image.width
+        if display_width > width:
+            ratio = width / display_width
+            image = image.resize((max(1, round(image.width * ratio)), max(1, round(image.height * ratio))),
+                                 Image.Resampling.LANCZOS, reducing_gap=3.0)
+        if transpose is not None:
+            image = image.transpose(transpose)
+            transpose, swapped = None, False
+        buffer = io.BytesIO()
+        # No exif argument, so the metadata (location included) is dropped; the colour profile is kept
+        if image_format == "webp":
+            image.save(buffer, "WEBP", quality=quality, method=4, icc_profile=icc_profile)
+        else:
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True, icc_profile=icc_profile)
+        renditions.append((name, buffer.getvalue(), f"image/{image_format}", image.width, image.height))
+    return renditions
+
+class MediaProcessor:
+    """Runs Pillow on a bounded process pool so decoding and resizing never block the event loop"""
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ProcessPoolExecutor(max_workers=workers)
+        self._slots = asyncio.Semaphore(workers)
+        self.queue_depth = 0  # images waiting for a free worker
+
+    async def render(self, data: bytes) -> Optional[List[Tuple[str, bytes, str, int, int]]]:
+        self.queue_depth += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queue_depth -= 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, render_image, data, MEDIA_RENDITIONS, MEDIA_IMAGE_FORMAT,
+                MEDIA_IMAGE_QUALITY, MEDIA_MAX_PIXELS
+            )
+        except Image.DecompressionBombError as e:
+            raise HTTPException(status_code=413, detail=str(e))
+        except (UnidentifiedImageError, OSError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid image")
+        except BrokenProcessPool:
+            # A worker died (e.g. killed for memory); start a fresh pool for later uploads
+            logger.error("Media processing pool broke; restarting it")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            raise HTTPException(status_code=503, detail="Media processing unavailable, try again")
+        finally:
+            self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+media_processor = MediaProcessor(MEDIA_PROCESS_WORKERS)
+
+class GridFSMediaStore:
+    """Stores media bytes in a GridFS bucket keyed by media ID"""
+    def __init__(self, database):
+        self.bucket = AsyncIOMotorGridFSBucket(database, bucket_name="media")
+
+    async def put(self, media_id: str, data: bytes, content_type: str):
+        try:
+            await self.bucket.upload_from_stream_with_id(
+                media_id, media_id, data, chunk_size_bytes=MEDIA_CHUNK_SIZE,
+                metadata={"content_type": content_type}
+            )
+        except DuplicateKeyError:
+            # A concurrent upload of the same bytes already stored this blob
+            pass
+
+    async def stream(self, media_id: str, start: int, end: int) -> AsyncIterator[bytes]:
+        grid_out = await self.bucket.open_download_stream(media_id)
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await grid_out.read(min(MEDIA_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+class LocalMediaStore:
+    """Stores media bytes on the local filesystem under MEDIA_ROOT"""
+    def __init__(self, root: Path):
+        self.root = root
+
+    def _path(self, media_id: str) -> Path:
+        return self.root / media_id[:2] / media_id
+
+    def _write(self, media_id: str, data: bytes):
+        path = self._path(media_id)
+        if path.exists():
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{media_id}.{uuid.uuid4().hex}.tmp")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _read(self, media_id: str, offset: int, size: int) -> bytes:
+        with open(self._path(media_id), "rb") as f:
+            f.seek(offset)
+            return f.read(size)
+
+    async def put(self, media_id: str, data: bytes, content_type: str):
+        await asyncio.to_thread(self._write, media_id, data)
+
+    async def stream(self, media_id: str, start: int, end: int) -> AsyncIterator[bytes]:
+        offset = start
+        while offset <= end:
+            chunk = await asyncio.to_thread(self._read, media_id, offset, min(MEDIA_CHUNK_SIZE, end - offset + 1))
+            if not chunk:
+                break
+            offset += len(chunk)
+            yield chunk
+
+_media_store = None
+
+def get_media_store():
+    """Return the configured media store, creating it on first use"""
+    global _media_store
+    if _media_store is None:
+        if MEDIA_BACKEND == "local":
+            _media_store = LocalMediaStore(MEDIA_ROOT)
+        else:
+            _media_store = GridFSMediaStore(db)
+    return _media_store
+
+# Documents store media IDs only and URLs are built when a response is rendered, so a
+# change of MEDIA_BASE_URL (or domain) applies to existing posts, avatars and messages.
+# Without MEDIA_BASE_URL the URLs are server-relative; clients resolve them against the
+# API origin. Nothing is derived from the request's Host header, which is client input.
+def media_url(media_id: str) -> str:
+    """Public URL for a stored media blob"""
+    return f"{MEDIA_BASE_URL}/api/media/{media_id}" if media_id else ""
+
+def media_reference(value: Optional[str]) -> Optional[str]:
+    """The media ID a stored value refers to: an ID, or a URL saved before IDs were stored"""
+    # Only the tail is inspected, so legacy inline base64 values cost no more than IDs
+    media_id = (value or "")[-64:]
+    if MEDIA_ID_PATTERN.match(media_id) and (len(value) == 64 or value[:-64].endswith("/api/media/")):
+        return media_id
+    return None
+
+def stored_media_url(doc: dict, rendition: Optional[str] = None, prefix: str = "media") -> str:
+    """URL of a document's media (the named rendition if it has one); external URLs pass through"""
+    media_id = (media_reference((doc.get(f"{prefix}_renditions") or {}).get(rendition))
+                or media_reference(doc.get(f"{prefix}_id"))
+                or media_reference(doc.get(prefix)))
+    return media_url(media_id) if media_id else doc.get(prefix) or ""
+
+def avatar_url(user: dict) -> str:
+    return stored_media_url(user, "thumb", "avatar")
+
+def stored_rendition_urls(doc: dict, prefix: str = "media") -> Dict[str, str]:
+    return {
+        name: media_url(media_reference(value)) if media_reference(value) else value
+        for name, value in (doc.get(f"{prefix}_renditions") or {}).items()
+    }
+
+def sniff_content_type(data: bytes) -> str:
+    """Guess a content type from the leading bytes of a blob"""
+    for signature, content_type in MEDIA_SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[4:8] == b"ftyp":
+        return "video/quicktime" if data[8:12] == b"qt  " else "video/mp4"
+    return "application/octet-stream"
+
+def decode_inline_media(value: str) -> Optional[bytes]:
+    """Decode a base64 payload or data URI; returns None for values that are already URLs"""
+    if not value or value.startswith(("http://", "https://", "/api/media/")):
+        return None
+
+    # The declared type is ignored; store_media sniffs the bytes
+    match = DATA_URI_PATTERN.match(value)
+    if match:
+        value = value[match.end():]
+
+    try:
+        return base64.b64decode(value, validate=False)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid base64 media payload")
+
+def rendition_ids(media: dict) -> Dict[str, str]:
+    return {name: rendition["id"] for name, rendition in media.get("renditions", {}).items()}
+
+def serialize_media(media: dict) -> dict:
+    return {
+        "id": media["_id"],
+        "url": media_url(media["_id"]),
+        "content_type": media["content_type"],
+        "length": media["length"],
+        "renditions": {name: media_url(media_id) for name, media_id in rendition_ids(media).items()}
+    }
+
+async def put_media_blob(media_id: str, data: bytes, content_type: str, **fields) -> dict:
+    """Store a blob under media_id unless it already exists, returning its media document"""
+    existing = await db.media.find_one({"_id": media_id})
+    if existing is None:
+        await get_media_store().put(media_id, data, content_type)
+        existing = {
+            "_id": media_id,
+            "content_type": content_type,
+            "length": len(data),
+            **fields,
+            "created_at": datetime.now(timezone.utc)
+        }
+        await db.media.update_one({"_id": media_id}, {"$setOnInsert": existing}, upsert=True)
+    return existing
+
+def unsupported_media_type() -> HTTPException:
+    return HTTPException(status_code=415, detail="Unsupported media type; upload an image, MP4, MOV or WebM file")
+
+async def store_media(data: bytes) -> dict:
+    """Store an upload once per SHA-256 digest, with renditions for still images, and return its media document"""
+    if len(data) > MEDIA_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Media file too large")
+    content_type = sniff_content_type(data)
+    if not content_type.startswith(("image/", "video/")):
+        content_type = None  # possibly an image Pillow can decode; rendering decides
+
+    source_id = hashlib.sha256(data).hexdigest()
+    source = await db.media_sources.find_one({"_id": source_id})
+    media_id = source["media_id"] if source else source_id
+    existing = await db.media.find_one({"_id": media_id})
+    if existing is None:
+        fields = {}
+        rendered = None
+        if content_type is None or content_type.startswith("image/"):
+            # Every non-video upload is decoded and re-encoded whatever it claims to be, so
+            # EXIF (GPS included) is stripped from anything Pillow can read
+            try:
+                rendered = await media_processor.render(data)
+            except HTTPException as e:
+                if content_type is None and e.status_code == 400:
+                    raise unsupported_media_type()
+                raise
+        if content_type not in MEDIA_ALLOWED_TYPES and not rendered:
+            raise unsupported_media_type()
+        if rendered:
+            renditions = {}
+            for name, rendition_data, rendition_type, width, height in rendered:
+                renditions[name] = {"id": hashlib.sha256(rendition_data).hexdigest(), "width": width, "height": height}
+                if name == "full":
+                    data, content_type, media_id = rendition_data, rendition_type, renditions[name]["id"]
+                    fields.update(width=width, height=height)
+            for name, rendition_data, rendition_type, width, height in rendered:
+                # A smaller rendition can be byte-identical to the full one; that blob is stored below
+                if renditions[name]["id"] != media_id:
+                    await put_media_blob(renditions[name]["id"], rendition_data, rendition_type, width=width, height=height)
+            fields["renditions"] = renditions
+        existing = await put_media_blob(media_id, data, content_type, **fields)
+        if fields and "renditions" not in existing:
+            # The blob was already stored as another upload's rendition; make it a full rendition too
+            await db.media.update_one({"_id": media_id}, {"$set": fields})
+            existing = {**existing, **fields}
+        if media_id != source_id:
+            await db.media_sources.update_one(
+                {"_id": source_id}, {"$setOnInsert": {"media_id": media_id}}, upsert=True
+            )
+
+    return existing
+
+async def resolve_media(media_id: Optional[str], inline_value: Optional[str]) -> Tuple[str, str, Dict[str, str]]:
+    """Resolve (media_id, external URL, rendition IDs) from a media ID, legacy base64 payload or URL"""
+    if media_id:
+        media = await db.media.find_one({"_id": media_id}, {"renditions": 1}) if MEDIA_ID_PATTERN.match(media_id) else None
+        if not media:
+            raise HTTPException(status_code=400, detail="Unknown media ID")
+        return media_id, "", rendition_ids(media)
+
+    decoded = decode_inline_media(inline_value or "")
+    if decoded is None:
+        return "", inline_value or "", {}
+
+    stored = await store_media(decoded)
+    return stored["_id"], "", rendition_ids(stored)
+
+def parse_range_header(range_header: str, length: int) -> Optional[Tuple[int, int]]:
+    """Parse a single-range 'bytes=' header into inclusive offsets; None if unsatisfiable"""
+    match = re.match(r"^bytes=(\d*)-(\d*)$", range_header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else length - 1
+    else:
+        start = max(0, length - int(match.group(2)))
+        end = length - 1
+
+    end = min(end, length - 1)
+    if start > end:
+        return None
+    return start, end
+
+async def migrate_inline_media(batch_size: int = 100) -> Dict[str, int]:
+    """Move base64 post media and user avatars into the media store"""
+    migrated = {}
+    targets = [(db.posts, "media"), (db.users, "avatar")]
+    for collection, url_field in targets:
+        id_field = f"{url_field}_id"
+        query = {
+            url_field: {"$nin": ["", None], "$not": re.compile(r"^(https?://|/api/media/)")},
+            id_field: {"$in": ["", None]}
+        }
+        count = 0
+        cursor = collection.find(query, {url_field: 1}).batch_size(batch_size)
+        async for doc in cursor:
+            decoded = decode_inline_media(doc[url_field])
+            if decoded is None:
+                continue
+            try:
+                stored = await store_media(decoded)
+            except HTTPException as e:
+                logger.warning(f"Skipping inline {url_field} of {collection.name} {doc['_id']}: {e.detail}")
+                continue
+            update = {id_field: stored["_id"], url_field: "", f"{url_field}_renditions": rendition_ids(stored)}
+            await collection.update_one({"_id": doc["_id"]}, {"$set": update})
+            count += 1
+        migrated[collection.name] = count
+        logger.info(f"Migrated {count} inline {url_field} values in {collection.name}")
+    return migrated
+
+# Response hydration helpers
+# Response shapes are declared once as {response key: document key, (document key,
+# default) or Computed} and turned into dict-building closures over (key, source,
+# default) tuples. The same declarations give the projections, so only the fields
+# embedded in responses are fetched.
+class Computed(NamedTuple):
+    """A response field built from several document fields, such as a media URL"""
+    build: Callable[[dict], Any]
+    sources: Tuple[str, ...]
+
+REQUIRED_FIELD = object()
+COMPUTED_FIELD = object()
+
+def compile_shape(fields: Dict[str, Any]) -> Callable[[dict], dict]:
+    """Build a function that copies the declared fields out of a document"""
+    items = []
+    for key, source in fields.items():
+        if isinstance(source, Computed):
+            items.append((key, source.build, COMPUTED_FIELD))
+        elif isinstance(source, tuple):
+            items.append((key, *source))
+        else:
+            items.append((key, source, REQUIRED_FIELD))
+
+    def shape(doc: dict) -> dict:
+        result = {}
+        for key, source, default in items:
+            if default is COMPUTED_FIELD:
+                result[key] = source(doc)
+            elif default is REQUIRED_FIELD or source in doc:
+                result[key] = doc[source]
+            else:
+                # Copy mutable defaults so responses never share them
+                result[key] = copy.copy(default)
+        return result
+    return shape
+
+def shape_projection(fields: Dict[str, Any]) -> dict:
+    projection = {}
+    for source in fields.values():
+        if isinstance(source, Computed):
+            projection.update(dict.fromkeys(source.sources, 1))
+        else:
+            projection[source[0] if isinstance(source, tuple) else source] = 1
+    return projection
+
+def media_url_field(prefix: str, rendition: str) -> Computed:
+    """Response field holding the URL of a document's media, at the named rendition if stored"""
+    return Computed(lambda doc: stored_media_url(doc, rendition, prefix),
+                    (prefix, f"{prefix}_id", f"{prefix}_renditions"))
+
+USER_SUMMARY_FIELDS = {"id": "_id", "name": "name", "username": "username", "avatar": media_url_field("avatar", "thumb")}
+ROOM_SUMMARY_FIELDS = {"id": "_id", "name": "name", "color": "color"}
+ROOM_FIELDS = {**ROOM_SUMMARY_FIELDS, "post_count": "post_count", "created_at": "created_at"}
+POST_FIELDS = {
+    "id": "_id",
+    "title": "title",
+    "description": "description",
+    "media": media_url_field("media", "feed"),  # other sizes are in media_renditions
+    "media_id": ("media_id", ""),
+    "media_renditions": Computed(stored_rendition_urls, ("media_renditions",)),
+    "media_type": "media_type",
+    "tags": "tags",
+    "external_link": "external_link",
+    "recommendation_type": "recommendation_type",
+    "action_type": "action_type",
+    "like_count": "like_count",
+    "comment_count": "comment_count",
+    "repost_count": "repost_count",
+    "created_at": "created_at",
+}
+COMMENT_FIELDS = {"id": "_id", "content": "content", "created_at": "created_at"}
+
+user_summary_shape = compile_shape(USER_SUMMARY_FIELDS)
+room_summary_shape = compile_shape(ROOM_SUMMARY_FIELDS)
+room_shape = compile_shape(ROOM_FIELDS)
+post_shape = compile_shape(POST_FIELDS)
+comment_shape = compile_shape(COMMENT_FIELDS)
+
+USER_SUMMARY_PROJECTION = shape_projection(USER_SUMMARY_FIELDS)
+ROOM_SUMMARY_PROJECTION = shape_projection(ROOM_SUMMARY_FIELDS)
+ROOM_PROJECTION = shape_projection(ROOM_FIELDS)
+
+async def fetch_by_ids(collection, ids, projection: Optional[dict] = None) -> Dict[ObjectId, dict]:
+    """Fetch documents for a set of ids with a single $in query, keyed by _id"""
+    unique_ids = list({_id for _id in ids if _id is not None})
+    if not unique_ids:
+        return {}
+
+    docs = await collection.find({"_id": {"$in": unique_ids}}, projection).to_list(len(unique_ids))
+    return {doc["_id"]: doc for doc in docs}
+
+def serialize_user_summary(user_info: Optional[dict]) -> Optional[dict]:
+    """Build the author object embedded in posts and comments"""
+    if user_info is None:
+        return None
+    return user_summary_shape(user_info)
+
+def serialize_room_summary(room_info: Optional[dict]) -> Optional[dict]:
+    """Build the room object embedded in posts"""
+    if room_info is None:
+        return None
+    return room_summary_shape(room_info)
+
+def serialize_post(post: dict, user_info: Optional[dict], room_info: Optional[dict]) -> dict:
+    """Build the post response shape from a post document and its author and room"""
+    result = post_shape(post)
+    result["user"] = serialize_user_summary(user_info)
+    result["room"] = serialize_room_summary(room_info)
+    return result
+
+def serialize_comment(comment: dict, user_info: Optional[dict]) -> dict:
+    """Build the comment response shape from a comment document and its author"""
+    result = comment_shape(comment)
+    result["user"] = serialize_user_summary(user_info)
+    return result
+
+async def hydrate_posts(posts: List[dict]) -> List[dict]:
+    """Attach authors and rooms to a page of posts with one query per collection"""
+    users, rooms = await asyncio.gather(
+        fetch_by_ids(db.users, [post["user_id"] for post in posts], USER_SUMMARY_PROJECTION),
+        fetch_by_ids(db.rooms, [post["room_id"] for post in posts], ROOM_SUMMARY_PROJECTION)
+    )
+    return [
+        serialize_post(post, users.get(post["user_id"]), rooms.get(post["room_id"]))
+        for post in posts
+    ]
+
+async def hydrate_comments(comments: List[dict]) -> List[dict]:
+    """Attach authors to a page of comments with a single users query"""
+    users = await fetch_by_ids(db.users, [comment["user_id"] for comment in comments], USER_SUMMARY_PROJECTION)
+    return [serialize_comment(comment, users.get(comment["user_id"])) for comment in comments]
+
+# Sparse fields and compact listings
+# fields=id,title,user.username selects post fields and author/room fields by response
+# key; each distinct selection is compiled once into shapes and a posts projection, so
+# unselected fields (notably inline media) are never read. compact=true replaces the
+# repeated author and room objects with user_id/room_id and "users"/"rooms" side tables.
+POST_EMBEDS = {
+    # response key: (collection, reference field on the post, summary fields)
+    "user": ("users", "user_id", USER_SUMMARY_FIELDS),
+    "room": ("rooms", "room_id", ROOM_SUMMARY_FIELDS),
+}
+# Always read: the cursor, cache tags and embeds depend on these
+POST_SELECTION_REQUIRED = {"_id": 1, "created_at": 1, "user_id": 1, "room_id": 1}
+
+class PostSelection:
+    """Compiled response shapes and posts projection for one fields= selection"""
+    def __init__(self, fields: Optional[str] = None):
+        if fields is None:
+            post_fields = POST_FIELDS
+            embeds = {name: dict(summary) for name, (_, _, summary) in POST_EMBEDS.items()}
+        else:
+            names = [name.strip() for name in fields.split(",") if name.strip()]
+            unknown = [name for name in names if not self._known(name)]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown field: {', '.join(unknown)}")
+            post_fields = {key: source for key, source in POST_FIELDS.items() if key in names}
+            embeds = {}
+            for name, (_, _, summary) in POST_EMBEDS.items():
+                if name in names:
+                    embeds[name] = dict(summary)
+                else:
+                    selected = {key: source for key, source in summary.items() if f"{name}.{key}" in names}
+                    if selected:
+                        embeds[name] = selected
+        self.shape = compile_shape(post_fields)
+        self.projection = {**shape_projection(post_fields), **POST_SELECTION_REQUIRED}
+        self.embeds = {
+            name: (compile_shape(summary), shape_projection(summary))
+            for name, summary in embeds.items()
+        }
+
+    @staticmethod
+    def _known(name: str) -> bool:
+        embed, _, key = name.partition(".")
+        if embed in POST_EMBEDS:
+            return not key or key in POST_EMBEDS[embed][2]
+        return name in POST_FIELDS
+
+    async def hydrate(self, posts: List[dict], compact: bool = False) -> Any:
+        """Shape posts and their selected embeds with one query per embedded collection"""
+        names = list(self.embeds)
+        lookups = await asyncio.gather(*(
+            fetch_by_ids(db[POST_EMBEDS[name][0]], [post[POST_EMBEDS[name][1]] for post in posts], self.embeds[name][1])
+            for name in names
+        ))
+        docs = dict(zip(names, lookups))
+        results = []
+        for post in posts:
+            result = self.shape(post)
+            for name in names:
+                reference = post[POST_EMBEDS[name][1]]
+                if compact:
+                    result[f"{name}_id"] = reference
+                else:
+                    doc = docs[name].get(reference)
+                    result[name] = self.embeds[name][0](doc) if doc is not None else None
+            results.append(result)
+        if not compact:
+            return results
+        content = {"posts": results}
+        for name in names:
+            content[POST_EMBEDS[name][0]] = {str(_id): self.embeds[name][0](doc) for _id, doc in docs[name].items()}
+        return content
+
+DEFAULT_POST_SELECTION = PostSelection()
+post_selections = LRUCache(maxsize=256)
+
+def post_selection(fields: str) -> PostSelection:
+    """The compiled selection for a fields= parameter"""
+    selection = post_selections.get(fields)
+    if selection is None:
+        selection = post_selections[fields] = PostSelection(fields)
+    return selection
+
+async def fetch_viewer_state(viewer_id: ObjectId, posts: List[dict]) -> List[dict]:
+    """Whether the viewer likes each post and follows its author, with one query per collection"""
+    if not posts:
+        return []
+    author_ids = list({post["user_id"] for post in posts} - {viewer_id})
+    liked, following = await asyncio.gather(
+        db.likes.distinct("post_id", {"user_id": viewer_id, "post_id": {"$in": [post["_id"] for post in posts]}}),
+        db.follows.distinct("following_id", {"follower_id": viewer_id, "following_id": {"$in": author_ids}})
+    )
+    liked, following = set(liked), set(following)
+    return [
+        {
+            "liked": post["_id"] in liked,
+            "following_author": post["user_id"] in following,
+            "is_author": post["user_id"] == viewer_id,
+        }
+        for post in posts
+    ]
+
+async def hydrate_posts_for(viewer: Optional[Principal], posts: List[dict], include: Set[str],
+                            selection: Optional[PostSelection] = None, compact: bool = False) -> Any:
+    """hydrate_posts with a field selection, compact side tables and the optional parts named in include"""
+    check_includes_allowed(viewer, include)
+    if selection is None and not compact:
+        hydrating = hydrate_posts(posts)
+    else:
+        hydrating = (selection or DEFAULT_POST_SELECTION).hydrate(posts, compact)
+    if "viewer_state" not in include:
+        return await hydrating
+    hydrated, states = await asyncio.gather(hydrating, fetch_viewer_state(viewer.id, posts))
+    return with_viewer_state(hydrated, states, compact)
+
+def check_includes_allowed(viewer: Optional[Principal], include: Set[str]):
+    if "viewer_state" in include and viewer is None:
+        raise HTTPException(status_code=401, detail="include=viewer_state requires authentication",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+def with_viewer_state(content: Any, states: List[dict], compact: bool) -> Any:
+    """Attach fetch_viewer_state results to hydrated posts, in order"""
+    for result, state in zip(content["posts"] if compact else content, states):
+        result["viewer_state"] = state
+    return content
+
+POST_INCLUDES = {"viewer_state"}
+
+def parse_include(include: Optional[str], allowed: Set[str]) -> Set[str]:
+    """Split a comma-separated include parameter, rejecting unknown names"""
+    names = {name.strip() for name in include.split(",") if name.strip()} if include else set()
+    unknown = names - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(sorted(unknown))}")
+    return names
+
+def parse_object_ids(ids: List[str], label: str) -> List[ObjectId]:
+    """Parse a batch of ids, dropping duplicates but keeping request order"""
+    if not all(ObjectId.is_valid(_id) for _id in ids):
+        raise HTTPException(status_code=400, detail=f"Invalid {label} ID")
+    return list(dict.fromkeys(ObjectId(_id) for _id in ids))
+
+def post_cache_tags(posts: List[dict]) -> List[str]:
+    """Response cache tags for responses embedding these posts and their authors"""
+    return [f"post:{post['_id']}" for post in posts] + [f"user:{post['user_id']}" for post in posts]
+
+# Cursor pagination helpers
+# Cursors encode the (created_at, _id) of the last item on a page, so the next page
+# is a range scan on a compound index instead of skipping every earlier document.
+# Listings ordered by another timestamp (e.g. conversations by updated_at) pass field.
+POST_SORT = [("created_at", -1), ("_id", -1)]
+COMMENT_SORT = [("created_at", 1), ("_id", 1)]
+
+def encode_cursor(doc: dict, field: str = "created_at") -> str:
+    """Build an opaque cursor pointing after the given document"""
+    raw = f"{doc[field].isoformat()}|{doc['_id']}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decode a cursor produced by encode_cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, _id = raw.split("|")
+        return datetime.fromisoformat(created_at), ObjectId(_id)
+    except (ValueError, binascii.Error, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def keyset_filter(cursor: str, descending: bool, field: str = "created_at") -> dict:
+    """Mongo filter selecting documents strictly after the cursor position"""
+    value, _id = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, "_id": {op: _id}}
+    ]}
+
+def set_next_cursor(response: Response, page: List[dict], limit: int, field: str = "created_at"):
+    """Expose the cursor for the following page, if there may be one"""
+    if page and len(page) >= limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(page[-1], field)
+
+# Index registry
+# Every filter and sort the API issues is backed by one of these indexes. The unique
+# ones also make register, like_post and follow_user safe without check-then-insert.
+# SEARCH_COLLATION makes autocomplete case-insensitive; U+FFFF sorts after every
+# character under ICU collations, so prefix + U+FFFF bounds a prefix range.
+SEARCH_COLLATION = Collation(locale="en", strength=CollationStrength.SECONDARY)
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("username", ASCENDING)], name="username_unique", unique=True),
+        IndexModel([("username", "text"), ("name", "text")], name="text_search", weights={"username": 2, "name": 1}),
+        IndexModel([("username", ASCENDING)], name="username_ci", collation=SEARCH_COLLATION),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "rooms": [
+        IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING)], name="user_created"),
+        IndexModel([("name", "text")], name="text_search"),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "posts": [
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)], name="created_desc"),
+        IndexModel([("room_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="room_created_desc"),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="user_created_desc"),
+        IndexModel([("tags", ASCENDING)], name="tags"),
+        IndexModel([("title", "text"), ("description", "text"), ("tags", "text")], name="text_search",
+                   weights={"title": 2, "tags": 2, "description": 1}),
+        IndexModel([("tags", ASCENDING)], name="tags_ci", collation=SEARCH_COLLATION),
+        IndexModel([("updated_at", ASCENDING)], name="updated_at"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "response_cache": [
+        IndexModel([("tags", ASCENDING)], name="tags"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "likes": [
+        IndexModel([("user_id", ASCENDING), ("post_id", ASCENDING)], name="user_post_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_created_desc"),
+        IndexModel([("post_id", ASCENDING), ("created_at", DESCENDING)], name="post_created_desc"),
+    ],
+    "comments": [
+        IndexModel([("post_id", ASCENDING), ("created_at", ASCENDING), ("_id", ASCENDING)], name="post_created"),
+    ],
+    "follows": [
+        IndexModel([("follower_id", ASCENDING), ("following_id", ASCENDING)], name="follower_following_unique", unique=True),
+        IndexModel([("following_id", ASCENDING), ("follower_id", ASCENDING)], name="following_follower"),
+    ],
+    "messages": [
+        IndexModel([("conversation_key", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)], name="conversation_created_desc"),
+    ],
+    "timeline_entries": [
+        IndexModel([("owner_id", ASCENDING), ("post_id", ASCENDING)], name="owner_post_unique", unique=True),
+        IndexModel([("owner_id", ASCENDING), ("created_at", DESCENDING), ("post_id", DESCENDING)], name="owner_created_desc"),
+        IndexModel([("owner_id", ASCENDING), ("author_id", ASCENDING)], name="owner_author"),
+    ],
+    "post_neighbors": [
+        IndexModel([("neighbors.post_id", ASCENDING)], name="neighbor_post"),
+    ],
+    "conversations": [
+        IndexModel([("user_id", ASCENDING), ("peer_id", ASCENDING)], name="user_peer_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("updated_at", DESCENDING), ("_id", DESCENDING)], name="user_updated_desc"),
+    ],
+}
+
+async def ensure_indexes():
+    """Create every declared index; existing indexes with the same spec are left alone"""
+    for collection_name, models in INDEXES.items():
+        try:
+            await db[collection_name].create_indexes(models)
+        except OperationFailure:
+            # Retry one at a time to find the index that failed
+            for model in models:
+                try:
+                    await db[collection_name].create_indexes([model])
+                except OperationFailure as e:
+                    name = model.document["name"]
+                    if model.document.get("unique"):
+                        # Writes rely on these for uniqueness, so serving without one would
+                        # silently accept duplicates (e.g. existing duplicate emails)
+                        raise RuntimeError(
+                            f"Unique index {name} on {collection_name} could not be built: {e}. If existing "
+                            f"documents are duplicates, run `python server.py repair-duplicates` (add --dry-run "
+                            f"to list them first)"
+                        ) from e
+                    # A conflicting spec; keep serving and surface it in the report
+                    logger.error(f"Failed to create index {name} on {collection_name}: {e}")
+
+async def repair_duplicates(dry_run: bool = False) -> Dict[str, int]:
+    """Resolve documents that stop a unique index from building, keeping the oldest of each group"""
+    # Duplicate likes, follows and other link documents are deleted and counters reconciled.
+    # Users are never deleted: newer accounts sharing an email or username get theirs
+    # suffixed with their ID, so they can be merged or contacted by hand.
+    repaired = {}
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            if not model.document.get("unique"):
+                continue
+            keys = list(model.document["key"])
+            groups = await db[collection_name].aggregate([
+                {"$group": {"_id": {key.replace(".", "_"): f"${key}" for key in keys},
+                            "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+                {"$match": {"count": {"$gt": 1}}},
+            ]).to_list(None)
+            newer = [_id for group in groups for _id in sorted(group["ids"])[1:]]
+            repaired[f"{collection_name}.{model.document['name']}"] = len(newer)
+            if dry_run or not newer:
+                continue
+            if collection_name == "users":
+                field = keys[0]
+                async for user in db.users.find({"_id": {"$in": newer}}, {field: 1}):
+                    await db.users.update_one({"_id": user["_id"]},
+                                              {"$set": {field: f"{user.get(field)}-duplicate-{user['_id']}"}})
+                    logger.warning(f"Renamed duplicate {field} of user {user['_id']}")
+                principal_cache.invalidate(*newer)
+            else:
+                await db[collection_name].delete_many({"_id": {"$in": newer}})
+    if not dry_run and any(repaired.values()):
+        await reconcile_counters()
+    return repaired
+
+async def index_report() -> Dict[str, dict]:
+    """Report declared indexes that are missing and existing ones unused since server start"""
+    report = {}
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        declared = [model.document["name"] for model in models]
+        stats = await collection.aggregate([{"$indexStats": {}}]).to_list(None)
+        report[collection_name] = {
+            "missing": [name for name in declared if name not in existing],
+            "unused": sorted(
+                stat["name"] for stat in stats
+                if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0
+            ),
+        }
+    return report
+
+# Real-time events
+# Sockets join user:<id> on connect and may subscribe to room:<id> and post:<id>.
+# Events carry compact deltas; clients fetch full objects over HTTP when needed.
+def user_channel(user_id) -> str:
+    return f"user:{user_id}"
+
+def room_channel(room_id) -> str:
+    return f"room:{room_id}"
+
+def post_channel(post_id) -> str:
+    return f"post:{post_id}"
+
+def emit_event(event: str, data: dict, to):
+    """Emit a Socket.IO event without holding up the HTTP response"""
+    run_in_background(sio.emit(event, data, to=to))
+
+class LikeEventCoalescer:
+    """Collapses like_count changes per post over a short window into a single emit"""
+    def __init__(self, window: float):
+        self.window = window
+        self._pending: Dict[str, Tuple[int, List[str]]] = {}
+        self._flush_task = None
+
+    def publish(self, post_id: str, like_count: int, channels: List[str]):
+        # Only the latest count per post matters, so later updates overwrite earlier ones
+        self._pending[post_id] = (like_count, channels)
+        if self._flush_task is None:
+            self._flush_task = run_in_background(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        pending, self._pending = self._pending, {}
+        self._flush_task = None
+        for post_id, (like_count, channels) in pending.items():
+            await sio.emit("post_liked", {"post_id": post_id, "like_count": like_count}, to=channels)
+
+like_events = LikeEventCoalescer(LIKE_EVENT_WINDOW_SECONDS)
+
+def socket_token(environ: dict, auth: Optional[dict]) -> Optional[str]:
+    """Find the JWT in the Socket.IO auth payload, the token query parameter or the Authorization header"""
+    if isinstance(auth, dict) and auth.get("token"):
+        return auth["token"]
+    query_token = parse_qs(environ.get("QUERY_STRING", "")).get("token")
+    if query_token:
+        return query_token[0]
+    authorization = environ.get("HTTP_AUTHORIZATION", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:]
+    return None
+
+def subscription_channel(data: Any) -> Optional[str]:
+    """Map a subscribe/unsubscribe payload to a channel name"""
+    if not isinstance(data, dict):
+        return None
+    if ObjectId.is_valid(data.get("room_id") or ""):
+        return room_channel(data["room_id"])
+    if ObjectId.is_valid(data.get("post_id") or ""):
+        return post_channel(data["post_id"])
+    return None
+
+# Home timeline
+# Each user's timeline is a set of timeline_entries documents for recent posts from the
+# accounts they follow, pushed on write and capped at TIMELINE_MAX_ENTRIES when read.
+# Entries are upserted under a unique (owner_id, post_id) index, so a post delivered by
+# both fan-out and a concurrent follow backfill lands once. Authors with
+# CELEBRITY_FOLLOWER_THRESHOLD followers or more are not fanned out; their posts are
+# merged in when the timeline is read. Timelines are built on first read, which records
+# a timelines marker document, so writes only reach owners that have one.
+followed_celebrities_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL)
+TIMELINE_SORT = [("created_at", -1), ("post_id", -1)]
+
+def timeline_upsert(owner_id: ObjectId, post: dict) -> UpdateOne:
+    """Idempotent write of one post onto one owner's timeline"""
+    entry = {"author_id": post["user_id"], "created_at": post["created_at"]}
+    return UpdateOne({"owner_id": owner_id, "post_id": post["_id"]}, {"$setOnInsert": entry}, upsert=True)
+
+async def write_timeline_entries(requests: List[UpdateOne]):
+    """Apply timeline upserts, tolerating entries another writer inserted first"""
+    if not requests:
+        return
+    try:
+        await db.timeline_entries.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        # Two upserts of the same entry can race; the unique index keeps one and rejects the other
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+async def with_timelines(owner_ids: List[ObjectId]) -> List[ObjectId]:
+    """The subset of owners whose timeline has been built"""
+    # Documents without built_at hold an old embedded entries array and are rebuilt on read
+    return await db.timelines.distinct("_id", {"_id": {"$in": owner_ids}, "built_at": {"$exists": True}})
+
+async def trim_timeline(user_id: ObjectId):
+    """Drop entries beyond the newest TIMELINE_MAX_ENTRIES"""
+    oldest_kept = await db.timeline_entries.find(
+        {"owner_id": user_id}, {"created_at": 1, "post_id": 1}
+    ).sort(TIMELINE_SORT).skip(TIMELINE_MAX_ENTRIES - 1).limit(1).to_list(1)
+    if oldest_kept:
+        created_at, post_id = oldest_kept[0]["created_at"], oldest_kept[0]["post_id"]
+        await db.timeline_entries.delete_many({"owner_id": user_id, "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "post_id": {"$lt": post_id}}
+        ]})
+
+async def fan_out_post(post: dict, author_follower_count: int):
+    """Push a new post onto the author's timeline and, for non-celebrities, every follower's"""
+    if await with_timelines([post["user_id"]]):
+        await write_timeline_entries([timeline_upsert(post["user_id"], post)])
+    if author_follower_count >= CELEBRITY_FOLLOWER_THRESHOLD:
+        return
+
+    event = {"post_id": str(post["_id"]), "user_id": str(post["user_id"])}
+
+    async def deliver(follower_ids):
+        owner_ids = await with_timelines(follower_ids)
+        await write_timeline_entries([timeline_upsert(_id, post) for _id in owner_ids])
+        await sio.emit("feed_post", event, to=[user_channel(_id) for _id in follower_ids])
+
+    batch = []
+    async for follow in db.follows.find({"following_id": post["user_id"]}, {"follower_id": 1}):
+        batch.append(follow["follower_id"])
+        if len(batch) >= TIMELINE_FANOUT_BATCH:
+            await deliver(batch)
+            batch = []
+    if batch:
+        await deliver(batch)
+
+async def backfill_timeline(user_id: ObjectId, author_id: ObjectId):
+    """Merge a newly followed author's recent posts into the follower's timeline"""
+    if not await with_timelines([user_id]):
+        return
+    posts = await db.posts.find(
+        {"user_id": author_id}, {"user_id": 1, "created_at": 1}
+    ).sort(POST_SORT).limit(TIMELINE_BACKFILL_POSTS).to_list(TIMELINE_BACKFILL_POSTS)
+    if posts:
+        await write_timeline_entries([timeline_upsert(user_id, post) for post in posts])
+        await trim_timeline(user_id)
+
+async def prune_timeline(user_id: ObjectId, author_id: ObjectId):
+    """Remove an unfollowed author's posts from the follower's timeline"""
+    await db.timeline_entries.delete_many({"owner_id": user_id, "author_id": author_id})
+
+async def rebuild_timeline(user_id: ObjectId):
+    """Build a timeline from scratch for a user who has none yet"""
+    following_ids = [user_id] + await db.follows.distinct("following_id", {"follower_id": user_id})
+    posts = await db.posts.find(
+        {"user_id": {"$in": following_ids}}, {"user_id": 1, "created_at": 1}
+    ).sort(POST_SORT).limit(TIMELINE_MAX_ENTRIES).to_list(TIMELINE_MAX_ENTRIES)
+    await write_timeline_entries([timeline_upsert(user_id, post) for post in posts])
+    # Mark the timeline built only once its entries are in, so readers never see it half-filled
+    await db.timelines.update_one(
+        {"_id": user_id},
+        {"$set": {"built_at": datetime.now(timezone.utc)}, "$unset": {"entries": ""}},
+        upsert=True
+    )
+
+async def get_followed_celebrities(user_id: ObjectId) -> List[ObjectId]:
+    """Followed accounts above the fan-out threshold, cached briefly per user"""
+    cached = followed_celebrities_cache.get(user_id)
+    if cached is not None:
+        return cached
+
+    following_ids = await db.follows.distinct("following_id", {"follower_id": user_id})
+    celebrities = []
+    if following_ids:
+        celebrities = await db.users.distinct("_id", {
+            "_id": {"$in": following_ids},
+            "follower_count": {"$gte": CELEBRITY_FOLLOWER_THRESHOLD}
+        })
+    followed_celebrities_cache[user_id] = celebrities
+    return celebrities
+
+async def read_home_timeline(user_id: ObjectId, limit: int, cursor: Optional[str]) -> List[dict]:
+    """Return up to limit post documents for the home feed, newest first"""
+    if not await with_timelines([user_id]):
+        await rebuild_timeline(user_id)
+
+    query = {"owner_id": user_id}
+    if cursor:
+        created_at, post_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "post_id": {"$lt": post_id}}
+        ]
+    else:
+        run_in_background(trim_timeline(user_id))
+    entries = await db.timeline_entries.find(query, {"post_id": 1}).sort(TIMELINE_SORT).limit(limit).to_list(limit)
+    post_ids = [entry["post_id"] for entry in entries]
+
+    posts, celebrities = await asyncio.gather(
+        fetch_by_ids(db.posts, post_ids),
+        get_followed_celebrities(user_id)
+    )
+
+    if celebrities:
+        query = {"user_id": {"$in": celebrities}}
+        if cursor:
+            query.update(keyset_filter(cursor, descending=True))
+        for post in await db.posts.find(query).sort(POST_SORT).limit(limit).to_list(limit):
+            posts[post["_id"]] = post
+
+    merged = sorted(posts.values(), key=lambda post: (post["created_at"], post["_id"]), reverse=True)
+    return merged[:limit]
+
+# Trending
+# Scores use forward decay: an event at time t adds weight * 2^((t - epoch) / half_life),
+# so older scores never need touching and every score decays at the same rate. Each
+# slice (all posts, action:<type>, tag:<tag>) keeps a bounded top-K board in memory,
+# updated from the like and comment paths. A periodic rebuild from the trending window
+# rebases the epoch and corrects drift, including across workers, which each hold their
+# own boards; events landing while a rebuild runs may be missed until the next one.
+TRENDING_POST_PROJECTION = {"action_type": 1, "tags": 1, "repost_count": 1, "created_at": 1}
+
+def decay_weight(at: datetime, epoch: datetime) -> float:
+    if at.tzinfo is None:
+        at = at.replace(tzinfo=timezone.utc)  # Mongo hands back naive UTC datetimes
+    return 2 ** ((at - epoch) / timedelta(hours=TRENDING_HALF_LIFE_HOURS))
+
+def stored_time(at: datetime) -> datetime:
+    """Truncate to the millisecond precision Mongo stores, so an event and its removal cancel exactly"""
+    return at.replace(microsecond=at.microsecond // 1000 * 1000)
+
+def trending_keys(post: dict) -> List[str]:
+    """The boards a post is ranked on"""
+    keys = ["all"]
+    if post.get("action_type"):
+        keys.append(f"action:{post['action_type']}")
+    keys.extend(f"tag:{tag}" for tag in {tag.lower() for tag in post.get("tags") or []})
+    return keys
+
+class TrendingBoard:
+    """Top-K post scores for one slice; holds up to twice K so near-misses can climb back"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.scores: Dict[ObjectId, float] = {}
+        self._ranking: Optional[List[Tuple[ObjectId, float]]] = None
+
+    def add(self, post_id: ObjectId, delta: float):
+        score = self.scores.get(post_id, 0.0) + delta
+        if score > 1e-9:
+            self.scores[post_id] = score
+        else:
+            self.scores.pop(post_id, None)
+        if len(self.scores) > 2 * self.capacity:
+            self.scores = dict(heapq.nlargest(self.capacity, self.scores.items(), key=lambda item: item[1]))
+        self._ranking = None
+
+    def top(self, limit: int) -> List[Tuple[ObjectId, float]]:
+        # The ranking is rebuilt at most once per change, so reads are a slice of K entries
+        if self._ranking is None:
+            self._ranking = heapq.nlargest(self.capacity, self.scores.items(), key=lambda item: item[1])
+        return self._ranking[:limit]
+
+class TrendingEngine:
+    """Incrementally maintained trending boards with a periodic full rebuild"""
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.epoch = datetime.now(timezone.utc)
+        self.boards: Dict[str, TrendingBoard] = {}
+        self.recomputed_at: Optional[datetime] = None
+
+    def record(self, post: dict, kind: str, at: Optional[datetime] = None, count: int = 1):
+        """Add (or, with a negative count, remove) an engagement event on a post"""
+        delta = TRENDING_WEIGHTS[kind] * count * decay_weight(at or datetime.now(timezone.utc), self.epoch)
+        for key in trending_keys(post):
+            self.boards.setdefault(key, TrendingBoard(self.capacity)).add(post["_id"], delta)
+
+    def top(self, key: str, limit: int) -> List[Tuple[ObjectId, float]]:
+        """Highest scoring posts on a board, with scores decayed to the present"""
+        board = self.boards.get(key)
+        if board is None:
+            return []
+        present = 1 / decay_weight(datetime.now(timezone.utc), self.epoch)
+        return [(post_id, score * present) for post_id, score in board.top(limit)]
+
+    async def recompute(self):
+        """Rebuild every board from the likes, comments and reposts inside the trending window"""
+        epoch = datetime.now(timezone.utc)
+        since = epoch - timedelta(hours=TRENDING_WINDOW_HOURS)
+        half_life_ms = TRENDING_HALF_LIFE_HOURS * 3600 * 1000
+
+        def decayed_events(weight):
+            return [
+                {"$match": {"created_at": {"$gte": since}}},
+                {"$group": {"_id": "$post_id", "score": {"$sum": {"$multiply": [weight, {"$pow": [
+                    2, {"$divide": [{"$subtract": ["$created_at", epoch]}, half_life_ms]}
+                ]}]}}}}
+            ]
+
+        likes, comments, reposted = await asyncio.gather(
+            db.likes.aggregate(decayed_events(TRENDING_WEIGHTS["like"])).to_list(None),
+            db.comments.aggregate(decayed_events(TRENDING_WEIGHTS["comment"])).to_list(None),
+            db.posts.find(
+                {"created_at": {"$gte": since}, "repost_count": {"$gt": 0}}, TRENDING_POST_PROJECTION
+            ).to_list(None)
+        )
+        scores = defaultdict(float)
+        for row in likes + comments:
+            scores[row["_id"]] += row["score"]
+        # Reposts are only counted, so they are weighted at the post's creation time
+        for post in reposted:
+            scores[post["_id"]] += TRENDING_WEIGHTS["repost"] * post["repost_count"] * decay_weight(post["created_at"], epoch)
+
+        posts = await fetch_by_ids(db.posts, list(scores), TRENDING_POST_PROJECTION)
+        boards: Dict[str, TrendingBoard] = {}
+        for post_id, score in scores.items():
+            post = posts.get(post_id)
+            if post is None:
+                continue  # deleted since the event
+            for key in trending_keys(post):
+                boards.setdefault(key, TrendingBoard(self.capacity)).add(post_id, score)
+
+        self.epoch, self.boards, self.recomputed_at = epoch, boards, epoch
+
+    async def recompute_forever(self, interval: float):
+        while True:
+            try:
+                await self.recompute()
+            except Exception:
+                logger.exception("Trending recompute failed")
+            await asyncio.sleep(interval)
+
+trending = TrendingEngine(TRENDING_TOP_K)
+
+def trending_entries(key: str, limit: int) -> List[dict]:
+    return [{"post_id": post_id, "score": round(score, 4)}
+            for post_id, score in trending.top(key, min(limit, TRENDING_TOP_K))]
+
+# Recommendations
+# Item-to-item collaborative filtering over likes. post_neighbors holds the top
+# RECOMMENDATION_NEIGHBORS posts by cosine similarity of their liker sets, and
+# user_recommendations holds each user's top posts scored by summing the neighbours
+# of what they liked, so both endpoints are a single _id lookup. build_recommendations
+# recomputes everything from a sparse user x post matrix; between builds, each like
+# refreshes the touched post's neighbours and the liker's recommendations.
+def compute_item_neighbors(user_index, post_index, shape: Tuple[int, int], top_n: int,
+                           block_size: int = RECOMMENDATION_BLOCK_SIZE):
+    """Top-n cosine neighbours per post as a sparse post x post matrix, plus the binary likes matrix"""
+    import numpy as np
+    from scipy import sparse
+
+    likes = sparse.csr_matrix(
+        (np.ones(len(user_index), dtype=np.float32), (user_index, post_index)), shape=shape
+    )
+    likes.data[:] = 1  # collapse any duplicate (user, post) pairs
+    norms = np.sqrt(np.asarray(likes.sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    normalized = (likes @ sparse.diags(1 / norms)).tocsc()
+    normalized_t = normalized.T.tocsr()
+
+    # Similarities are computed a block of posts at a time so only block_size rows are ever dense
+    rows, cols, values = [], [], []
+    for start in range(0, shape[1], block_size):
+        similarity = (normalized_t[start:start + block_size] @ normalized).tocsr()
+        for offset in range(similarity.shape[0]):
+            lo, hi = similarity.indptr[offset], similarity.indptr[offset + 1]
+            neighbors, scores = similarity.indices[lo:hi], similarity.data[lo:hi]
+            keep = neighbors != start + offset
+            neighbors, scores = neighbors[keep], scores[keep]
+            if len(scores) > top_n:
+                best = np.argpartition(-scores, top_n)[:top_n]
+                neighbors, scores = neighbors[best], scores[best]
+            rows.append(np.full(len(neighbors), start + offset, dtype=np.int32))
+            cols.append(neighbors)
+            values.append(scores)
+
+    neighbors = sparse.csr_matrix(
+        (np.concatenate(values), (np.concatenate(rows), np.concatenate(cols))), shape=(shape[1], shape[1])
+    ) if rows else sparse.csr_matrix((shape[1], shape[1]), dtype=np.float32)
+    return likes, neighbors
+
+def top_entries(matrix, top_n: int):
+    """Yield (row, [(column, score), ...]) with each row's top_n entries, best first"""
+    import numpy as np
+
+    for row in range(matrix.shape[0]):
+        lo, hi = matrix.indptr[row], matrix.indptr[row + 1]
+        if lo == hi:
+            continue
+        columns, scores = matrix.indices[lo:hi], matrix.data[lo:hi]
+        if len(scores) > top_n:
+            best = np.argpartition(-scores, top_n)[:top_n]
+            columns, scores = columns[best], scores[best]
+        order = np.argsort(-scores)
+        yield row, [(int(columns[i]), float(scores[i])) for i in order]
+
+def compute_recommendations(likes, neighbors, top_n: int, block_size: int = RECOMMENDATION_BLOCK_SIZE):
+    """Score unseen posts for every user as likes x neighbours, a block of users at a time"""
+    for start in range(0, likes.shape[0], block_size):
+        block = likes[start:start + block_size]
+        scores = (block @ neighbors).tocsr()
+        scores = (scores - scores.multiply(block)).tocsr()  # drop posts the user already liked
+        scores.eliminate_zeros()
+        for row, entries in top_entries(scores, top_n):
+            yield start + row, entries
+
+def neighbor_entries(entries) -> List[dict]:
+    return [{"post_id": post_id, "score": round(score, 6)} for post_id, score in entries]
+
+async def write_documents(collection, documents: List[Tuple[ObjectId, dict]], batch_size: int = 1000):
+    """Upsert {_id: fields} documents in unordered bulk batches"""
+    for start in range(0, len(documents), batch_size):
+        await collection.bulk_write([
+            UpdateOne({"_id": _id}, {"$set": fields}, upsert=True)
+            for _id, fields in documents[start:start + batch_size]
+        ], ordered=False)
+
+async def build_recommendations() -> Dict[str, int]:
+    """Recompute every post's neighbours and every user's recommendations from the likes collection"""
+    started = datetime.now(timezone.utc)
+    user_ids, post_ids = {}, {}
+    user_index, post_index = [], []
+    async for like in db.likes.find({}, {"_id": 0, "user_id": 1, "post_id": 1}).batch_size(10000):
+        user_index.append(user_ids.setdefault(like["user_id"], len(user_ids)))
+        post_index.append(post_ids.setdefault(like["post_id"], len(post_ids)))
+    if not user_index:
+        return {"likes": 0, "posts": 0, "users": 0}
+    users, posts = list(user_ids), list(post_ids)
+
+    def compute():
+        likes, neighbors = compute_item_neighbors(user_index, post_index, (len(users), len(posts)),
+                                                  RECOMMENDATION_NEIGHBORS)
+        post_docs = [
+            (posts[row], {"neighbors": neighbor_entries((posts[col], score) for col, score in entries),
+                          "updated_at": started})
+            for row, entries in top_entries(neighbors, RECOMMENDATION_NEIGHBORS)
+        ]
+        user_docs = [
+            (users[row], {"posts": neighbor_entries((posts[col], score) for col, score in entries),
+                          "updated_at": started})
+            for row, entries in compute_recommendations(likes, neighbors, RECOMMENDATION_RESULTS)
+        ]
+        return post_docs, user_docs
+
+    post_docs, user_docs = await asyncio.get_running_loop().run_in_executor(None, compute)
+    await write_documents(db.post_neighbors, post_docs)
+    await write_documents(db.user_recommendations, user_docs)
+    # Anything the build did not touch (and no like refreshed since) is stale
+    await db.post_neighbors.delete_many({"updated_at": {"$lt": started}})
+    await db.user_recommendations.delete_many({"updated_at": {"$lt": started}})
+    return {"likes": len(user_index), "posts": len(post_docs), "users": len(user_docs)}
+
+async def refresh_post_neighbors(post_id: ObjectId):
+    """Recompute one post's neighbours from its most recent likers and merge it into theirs"""
+    likers = await db.likes.find({"post_id": post_id}, {"user_id": 1}).sort("created_at", -1) \
+        .limit(RECOMMENDATION_SAMPLE_LIKERS).to_list(RECOMMENDATION_SAMPLE_LIKERS)
+    co_likes = await db.likes.aggregate([
+        {"$match": {"user_id": {"$in": [like["user_id"] for like in likers]}, "post_id": {"$ne": post_id}}},
+        {"$group": {"_id": "$post_id", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    stored = await fetch_by_ids(db.posts, [post_id] + [row["_id"] for row in co_likes], {"like_count": 1})
+
+    def like_count(_id):
+        return stored.get(_id, {}).get("like_count", 0) + counters.pending("posts", _id, "like_count")
+
+    own_count = like_count(post_id)
+    scores = []
+    for row in co_likes:
+        other_count = like_count(row["_id"])
+        if own_count > 0 and other_count > 0:
+            scores.append((row["_id"], row["count"] / (own_count * other_count) ** 0.5))
+    entries = neighbor_entries(heapq.nlargest(RECOMMENDATION_NEIGHBORS, scores, key=lambda item: item[1]))
+    now = datetime.now(timezone.utc)
+    await db.post_neighbors.update_one(
+        {"_id": post_id}, {"$set": {"neighbors": entries, "updated_at": now}}, upsert=True
+    )
+
+    # Similarity is symmetric, so replace this post's entry in each neighbour's list too,
+    # and rescore or drop it in lists that still hold it from an earlier refresh or build
+    rescored = {entry["post_id"]: entry["score"] for entry in neighbor_entries(scores)}
+    holders = await db.post_neighbors.distinct("_id", {"neighbors.post_id": post_id})
+    updates = []
+    for target in {entry["post_id"] for entry in entries}.union(holders):
+        updates.append(UpdateOne({"_id": target}, {"$pull": {"neighbors": {"post_id": post_id}}}))
+        if target in rescored:
+            updates.append(UpdateOne({"_id": target}, {
+                "$push": {"neighbors": {
+                    "$each": [{"post_id": post_id, "score": rescored[target]}],
+                    "$sort": {"score": -1},
+                    "$slice": RECOMMENDATION_NEIGHBORS
+                }},
+                "$set": {"updated_at": now}
+            }, upsert=True))
+    if updates:
+        await db.post_neighbors.bulk_write(updates)
+
+async def refresh_user_recommendations(user_id: ObjectId) -> List[dict]:
+    """Rescore a user's recommendations from the neighbours of their recent likes"""
+    liked = await db.likes.find({"user_id": user_id}, {"post_id": 1}).sort("created_at", -1) \
+        .limit(RECOMMENDATION_PROFILE_LIKES).to_list(RECOMMENDATION_PROFILE_LIKES)
+    neighbor_docs = await fetch_by_ids(db.post_neighbors, [like["post_id"] for like in liked])
+
+    scores = defaultdict(float)
+    for doc in neighbor_docs.values():
+        for entry in doc["neighbors"]:
+            scores[entry["post_id"]] += entry["score"]
+    # Older likes fall outside the profile, so check every candidate against the unique index
+    already_liked = await db.likes.distinct("post_id", {"user_id": user_id, "post_id": {"$in": list(scores)}})
+    for post_id in already_liked:
+        scores.pop(post_id, None)
+
+    entries = neighbor_entries(heapq.nlargest(RECOMMENDATION_RESULTS, scores.items(), key=lambda item: item[1]))
+    await db.user_recommendations.update_one(
+        {"_id": user_id}, {"$set": {"posts": entries, "updated_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    return entries
+
+class RecommendationUpdater:
+    """Batches the posts and users touched by likes and refreshes each once per window"""
+    def __init__(self, window: float):
+        self.window = window
+        self._posts = set()
+        self._users = set()
+        self._flush_task = None
+
+    def touch(self, post_id: ObjectId, user_id: ObjectId):
+        self._posts.add(post_id)
+        self._users.add(user_id)
+        if self._flush_task is None:
+            self._flush_task = run_in_background(self._flush_after_window())
+
+    async def _flush_after_window(self):
+        await asyncio.sleep(self.window)
+        posts, self._posts = self._posts, set()
+        users, self._users = self._users, set()
+        self._flush_task = None
+        # Users are rescored after posts so they see the refreshed neighbour lists
+        for post_id in posts:
+            await refresh_post_neighbors(post_id)
+        for user_id in users:
+            await refresh_user_recommendations(user_id)
+
+recommendation_updates = RecommendationUpdater(RECOMMENDATION_UPDATE_SECONDS)
+
+async def serialize_ranked_posts(entries: List[dict], limit: int, score_field: str) -> List[dict]:
+    """Hydrate stored {post_id, score} entries in order, skipping deleted posts"""
+    entries = entries[:limit]
+    posts = await fetch_by_ids(db.posts, [entry["post_id"] for entry in entries])
+    ranked = [(posts[entry["post_id"]], entry["score"]) for entry in entries if entry["post_id"] in posts]
+    hydrated = await hydrate_posts([post for post, _ in ranked])
+    for (_, score), result in zip(ranked, hydrated):
+        result[score_field] = score
+    return hydrated
+
+# Search
+# GET /api/search goes through a pluggable backend. The mongo backend uses the
+# text_search indexes and needs no upkeep. The memory backend keeps a BM25 inverted
+# index per collection in each worker for low-latency typeahead: write paths index
+# their own documents and a periodic sync picks up documents created elsewhere
+# or edited elsewhere. Sync follows updated_at, rewinding SEARCH_SYNC_OVERLAP_SECONDS
+# so writes that commit late or come from a worker with a lagging clock are not
+# skipped; documents already indexed at the same updated_at are not re-added.
+# Autocomplete is case-insensitive in both backends.
+SEARCH_FIELDS = {
+    "posts": {"title": 2.0, "tags": 2.0, "description": 1.0},
+    "users": {"username": 2.0, "name": 1.0},
+    "rooms": {"name": 1.0},
+}
+SEARCH_FILTER_FIELDS = {"posts": ["action_type", "recommendation_type", "tags"]}
+SEARCH_TOKEN_PATTERN = re.compile(r"\w+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+def search_tokens(value) -> List[str]:
+    if isinstance(value, list):
+        value = " ".join(value)
+    return SEARCH_TOKEN_PATTERN.findall((value or "").lower())
+
+def search_projection(kind: str) -> dict:
+    return {field: 1 for field in [*SEARCH_FIELDS[kind], *SEARCH_FILTER_FIELDS.get(kind, [])]}
+
+class InvertedIndex:
+    """Field-weighted BM25 index over one collection, with a lazily sorted vocabulary for prefixes"""
+    def __init__(self, fields: Dict[str, float], filter_fields: List[str]):
+        self.fields = fields
+        self.filter_fields = filter_fields
+        self.postings: Dict[str, Dict[ObjectId, float]] = defaultdict(dict)
+        self.documents: Dict[ObjectId, Tuple[Dict[str, float], float, dict]] = {}
+        self.total_length = 0.0
+        self._vocabulary: Optional[List[str]] = None
+
+    def add(self, doc: dict):
+        self.remove(doc["_id"])
+        terms = defaultdict(float)
+        for field, weight in self.fields.items():
+            for token in search_tokens(doc.get(field)):
+                terms[token] += weight
+        length = sum(terms.values())
+        for term, frequency in terms.items():
+            if term not in self.postings:
+                self._vocabulary = None
+            self.postings[term][doc["_id"]] = frequency
+        self.documents[doc["_id"]] = (terms, length, {field: doc.get(field) for field in self.filter_fields})
+        self.total_length += length
+
+    def remove(self, doc_id: ObjectId):
+        entry = self.documents.pop(doc_id, None)
+        if entry is None:
+            return
+        terms, length, _ = entry
+        for term in terms:
+            postings = self.postings[term]
+            postings.pop(doc_id, None)
+            if not postings:
+                del self.postings[term]
+                self._vocabulary = None
+        self.total_length -= length
+
+    def matches(self, doc_id: ObjectId, filters: dict) -> bool:
+        meta = self.documents[doc_id][2]
+        for field, value in filters.items():
+            stored = meta.get(field)
+            if stored != value and not (isinstance(stored, list) and value in stored):
+                return False
+        return True
+
+    def search(self, query: str, limit: int, filters: dict) -> List[Tuple[ObjectId, float]]:
+        if not self.documents:
+            return []
+        count = len(self.documents)
+        average_length = self.total_length / count or 1.0
+        scores = defaultdict(float)
+        for term in set(search_tokens(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, frequency in postings.items():
+                length = self.documents[doc_id][1]
+                scores[doc_id] += idf * frequency * (BM25_K1 + 1) / (
+                    frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length)
+                )
+        if filters:
+            scores = {doc_id: score for doc_id, score in scores.items() if self.matches(doc_id, filters)}
+        return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def completions(self, prefix: str, scan_limit: int = 1000) -> List[Tuple[str, int]]:
+        """Terms starting with prefix and their document frequencies"""
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.postings)
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        results = []
+        for term in self._vocabulary[start:start + scan_limit]:
+            if not term.startswith(prefix):
+                break
+            results.append((term, len(self.postings[term])))
+        return results
+
+class InMemorySearchBackend:
+    """BM25 search and prefix autocomplete served from per-worker inverted indexes"""
+    def __init__(self):
+        self.indexes = {
+            kind: InvertedIndex(fields, SEARCH_FILTER_FIELDS.get(kind, [])) for kind, fields in SEARCH_FIELDS.items()
+        }
+        self._synced_until: Dict[str, Optional[datetime]] = {kind: None for kind in SEARCH_FIELDS}
+        self._synced: Dict[str, Dict[ObjectId, datetime]] = {kind: {} for kind in SEARCH_FIELDS}
+
+    def index(self, kind: str, doc: dict):
+        self.indexes[kind].add(doc)
+
+    async def sync(self):
+        """Index every document created or edited since the last sync"""
+        overlap = timedelta(seconds=SEARCH_SYNC_OVERLAP_SECONDS)
+        for kind in SEARCH_FIELDS:
+            since, synced = self._synced_until[kind], self._synced[kind]
+            query = {"updated_at": {"$gte": since - overlap}} if since else {}
+            projection = {**search_projection(kind), "updated_at": 1}
+            async for doc in db[kind].find(query, projection):
+                updated_at = doc.get("updated_at")
+                if updated_at is not None and synced.get(doc["_id"]) == updated_at:
+                    continue
+                self.indexes[kind].add(doc)
+                if updated_at is not None:
+                    synced[doc["_id"]] = updated_at
+                    since = max(since, updated_at) if since else updated_at
+            if since:
+                # Only documents inside the next overlap window can be seen again
+                self._synced[kind] = {_id: at for _id, at in synced.items() if at >= since - overlap}
+            self._synced_until[kind] = since
+
+    async def sync_forever(self, interval: float):
+        while True:
+            try:
+                await self.sync()
+            except Exception:
+                logger.exception("Search index sync failed")
+            await asyncio.sleep(interval)
+
+    async def search(self, kind: str, query: str, limit: int, filters: dict) -> List[Tuple[ObjectId, float]]:
+        return self.indexes[kind].search(query, limit, filters)
+
+    async def autocomplete(self, prefix: str, limit: int) -> List[dict]:
+        counts = Counter()
+        for index in self.indexes.values():
+            for term, frequency in index.completions(prefix.lower()):
+                counts[term] += frequency
+        return [{"text": term, "count": count} for term, count in counts.most_common(limit)]
+
+class MongoSearchBackend:
+    """Search through the text_search indexes; Mongo keeps them current on every write"""
+    def index(self, kind: str, doc: dict):
+        pass
+
+    async def sync(self):
+        pass
+
+    async def sync_forever(self, interval: float):
+        pass
+
+    async def search(self, kind: str, query: str, limit: int, filters: dict) -> List[Tuple[ObjectId, float]]:
+        score = {"$meta": "textScore"}
+        docs = await db[kind].find(
+            {"$text": {"$search": query}, **filters}, {"score": score}
+        ).sort([("score", score)]).limit(limit).to_list(limit)
+        return [(doc["_id"], doc["score"]) for doc in docs]
+
+    async def autocomplete(self, prefix: str, limit: int) -> List[dict]:
+        # Prefix ranges under SEARCH_COLLATION are range scans on the username_ci and tags_ci indexes
+        pattern = {"$gte": prefix, "$lt": prefix + "\uffff"}
+        users, tags = await asyncio.gather(
+            db.users.find({"username": pattern}, {"username": 1, "follower_count": 1},
+                          collation=SEARCH_COLLATION).limit(limit).to_list(limit),
+            db.posts.aggregate([
+                {"$match": {"tags": pattern}},
+                {"$unwind": "$tags"},
+                {"$match": {"tags": pattern}},
+                {"$group": {"_id": {"$toLower": "$tags"}, "count": {"$sum": 1}}},
+                {"$sort": {"count": -1}},
+                {"$limit": limit},
+            ], collation=SEARCH_COLLATION).to_list(limit)
+        )
+        suggestions = [{"text": user["username"], "count": user.get("follower_count", 0)} for user in users]
+        suggestions += [{"text": tag["_id"], "count": tag["count"]} for tag in tags]
+        return sorted(suggestions, key=lambda suggestion: -suggestion["count"])[:limit]
+
+SEARCH_BACKENDS = {
+    "mongo": MongoSearchBackend,
+    "memory": InMemorySearchBackend,
+}
+
+search_backend = SEARCH_BACKENDS[SEARCH_BACKEND]()
+
+# Direct messaging helpers
+# Messages between two users share a conversation_key, so history is one index range
+# scan. Each participant also has a conversations document holding the latest message
+# and their unread count, which keeps the inbox listing independent of message volume.
+CONVERSATION_SORT = [("updated_at", -1), ("_id", -1)]
+MESSAGE_PREVIEW_LENGTH = 140
+
+def conversation_key(user_a: ObjectId, user_b: ObjectId) -> str:
+    return ":".join(sorted([str(user_a), str(user_b)]))
+
+def serialize_message(message: dict) -> dict:
+    return {
+        "id": str(message["_id"]),
+        "sender_id": str(message["sender_id"]),
+        "receiver_id": str(message["receiver_id"]),
+        "content": message["content"],
+        "media": stored_media_url(message, "feed"),
+        "message_type": message.get("message_type", "text"),
+        "read": message.get("read", False),
+        "created_at": message["created_at"].isoformat()
+    }
+
+def message_preview(message: dict) -> dict:
+    """The slice of a message stored on conversations documents"""
+    return {
+        "id": message["_id"],
+        "sender_id": message["sender_id"],
+        "content": message["content"][:MESSAGE_PREVIEW_LENGTH],
+        "message_type": message["message_type"],
+        "created_at": message["created_at"]
+    }
+
+def serialize_conversation(conversation: dict, peer: Optional[dict]) -> dict:
+    last_message = conversation["last_message"]
+    return {
+        "peer": serialize_user_summary(peer),
+        "last_message": {
+            "id": str(last_message["id"]),
+            "sender_id": str(last_message["sender_id"]),
+            "content": last_message["content"],
+            "message_type": last_message["message_type"],
+            "created_at": last_message["created_at"].isoformat()
+        },
+        "unread_count": conversation.get("unread_count", 0),
+        "updated_at": conversation["updated_at"].isoformat()
+    }
+
+# Export and import
+# Exports stream NDJSON straight from Motor cursors, one {"collection", "document"} line
+# per document in MongoDB extended JSON (bson.json_util), so ObjectIds and datetimes
+# round-trip and memory stays at one cursor batch. Imports parse the stream line by line
+# and write unordered batches per collection, a few in flight at once. Counters, the
+# trending boards and the memory search index are not rebuilt; run reconcile-counters
+# after importing likes, comments or follows on their own.
+EXPORT_COLLECTIONS = ("users", "rooms", "posts", "comments", "likes", "follows")
+IMPORT_MODES = ("insert", "upsert")  # insert skips documents whose _id already exists
+
+def user_export_plan(user_id: ObjectId) -> List[Tuple[str, dict]]:
+    """(collection, filter) pairs covering a user's profile, content and social graph"""
+    return [
+        ("users", {"_id": user_id}),
+        ("rooms", {"user_id": user_id}),
+        ("posts", {"user_id": user_id}),
+        ("comments", {"user_id": user_id}),
+        ("likes", {"user_id": user_id}),
+        ("follows", {"follower_id": user_id}),
+        ("follows", {"following_id": user_id}),
+    ]
+
+async def export_ndjson(plan: List[Tuple[str, dict]], chunk_size: int = 64 * 1024) -> AsyncIterator[bytes]:
+    """Yield NDJSON for each (collection, filter) pair in chunks of about chunk_size bytes"""
+    buffer = bytearray()
+    for collection_name, query in plan:
+        async for doc in db[collection_name].find(query).batch_size(EXPORT_BATCH_SIZE):
+            buffer += json_util.dumps({"collection": collection_name, "document": doc},
+                                      json_options=json_util.RELAXED_JSON_OPTIONS).encode()
+            buffer += b"\n"
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+def import_cache_tags(collection_name: str, docs: List[dict]) -> List[str]:
+    if collection_name == "users":
+        return [f"user:{doc['_id']}" for doc in docs]
+    if collection_name == "posts":
+        return ["posts"] + [f"post:{doc['_id']}" for doc in docs]
+    if collection_name == "rooms":
+        return [f"rooms:{doc.get('user_id')}" for doc in docs]
+    return []
+
+class NDJSONImporter:
+    """Parses exported NDJSON lines and writes them in unordered batches per collection"""
+    def __init__(self, mode: str, batch_size: int = IMPORT_BATCH_SIZE, concurrency: int = IMPORT_CONCURRENCY):
+        self.mode = mode
+        self.batch_size = batch_size
+        self.stats: Dict[str, Counter] = defaultdict(Counter)
+        self.invalid_lines = 0
+        self.errors: List[str] = []  # first IMPORT_MAX_ERRORS write error messages
+        self._batches: Dict[str, List[dict]] = defaultdict(list)
+        self._writes = set()
+        self._slots = asyncio.Semaphore(concurrency)
+
+    async def add_line(self, line: bytes):
+        try:
+            record = json_util.loads(line)
+            collection_name, doc = record["collection"], record["document"]
+        except (ValueError, KeyError, TypeError):
+            self.invalid_lines += 1
+            return
+        if collection_name not in EXPORT_COLLECTIONS or not isinstance(doc, dict):
+            self.invalid_lines += 1
+            return
+        batch = self._batches[collection_name]
+        batch.append(doc)
+        if len(batch) >= self.batch_size:
+            await self._submit(collection_name, self._batches.pop(collection_name))
+
+    async def _submit(self, collection_name: str, docs: List[dict]):
+        await self._slots.acquire()
+        task = asyncio.create_task(self._write(collection_name, docs))
+        self._writes.add(task)
+        task.add_done_callback(self._writes.discard)
+
+    async def _write(self, collection_name: str, docs: List[dict]):
+        stats = self.stats[collection_name]
+        errors = []
+        try:
+            if self.mode == "upsert":
+                result = await db[collection_name].bulk_write([
+                    ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) if "_id" in doc else InsertOne(doc)
+                    for doc in docs
+                ], ordered=False)
+                stats["inserted"] += result.inserted_count + result.upserted_count
+                stats["replaced"] += result.matched_count
+            else:
+                result = await db[collection_name].insert_many(docs, ordered=False)
+                stats["inserted"] += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details["writeErrors"]
+            stats["inserted"] += e.details["nInserted"] + e.details.get("nUpserted", 0)
+            if self.mode == "upsert":
+                stats["replaced"] += e.details["nMatched"]
+        except Exception as e:
+            # Not a per-document error, so nothing in the batch is known to be written
+            logger.exception("Import batch into %s failed", collection_name)
+            stats["failed"] += len(docs)
+            self._record_error(f"{collection_name}: {e}")
+            return
+        finally:
+            self._slots.release()
+        # Existing documents are expected when inserting; any other write error is a failure
+        failures = [error for error in errors if error["code"] != 11000] if self.mode == "insert" else errors
+        stats["skipped"] += len(errors) - len(failures)
+        stats["failed"] += len(failures)
+        if failures:
+            logger.warning("Import into %s: %s", collection_name, failures[0].get("errmsg"))
+            self._record_error(f"{collection_name}: {failures[0].get('errmsg')}")
+        if collection_name == "users":
+            principal_cache.invalidate(*(doc["_id"] for doc in docs))
+        response_cache.invalidate(*import_cache_tags(collection_name, docs))
+
+    def _record_error(self, message: str):
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append(message)
+
+    async def finish(self):
+        for collection_name in list(self._batches):
+            await self._submit(collection_name, self._batches.pop(collection_name))
+        # _write counts its own failures, so every batch is accounted for in stats and errors
+        await asyncio.gather(*list(self._writes))
+
+async def import_ndjson(chunks: AsyncIterator[bytes], mode: str = "insert") -> dict:
+    """Import an NDJSON export read as arbitrary byte chunks; returns per-collection counts and throughput"""
+    importer = NDJSONImporter(mode)
+    started = time.perf_counter()
+    pending = b""
+    async for chunk in chunks:
+        lines = (pending + chunk).split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                await importer.add_line(line)
+    if pending.strip():
+        await importer.add_line(pending)
+    await importer.finish()
+
+    elapsed = time.perf_counter() - started
+    documents = sum(sum(stats.values()) for stats in importer.stats.values())
+    return {
+        "collections": {name: dict(stats) for name, stats in importer.stats.items()},
+        "invalid_lines": importer.invalid_lines,
+        "errors": importer.errors,
+        "documents": documents,
+        "seconds": round(elapsed, 3),
+        "documents_per_second": round(documents / elapsed, 1) if elapsed else 0.0,
+    }
+
+# Health checks
+# Liveness only says the process is serving requests. Readiness pings Mongo and looks at
+# pool utilization, event-loop lag and the Socket.IO manager; each check is ok, degraded
+# (over a HEALTH_MAX_* threshold) or unhealthy. Results are cached for
+# HEALTH_CACHE_SECONDS and concurrent probes share one check.
+class EventLoopLagMonitor:
+    """Measures how late a periodic timer fires, which is how long the loop was blocked"""
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = 0.0
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
 
-class MessageCreate(BaseModel):
-    receiver_id: str
-    content: str
-    media: Optional[str] = ""
-    message_type: str = "text"
+loop_lag = EventLoopLagMonitor()
 
-# Authentication helper functions
-def hash_password(password: str) -> str:
-    """Hash a password using bcrypt"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+def threshold_status(value: float, limit: float) -> str:
+    return "degraded" if value > limit else "ok"
 
-def verify_password(password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return bcrypt.checkpw(password.encode('utf-8'), hashed_password.encode('utf-8'))
+class ReadinessProbe:
+    """Runs the readiness checks at most once per cache interval"""
+    STATUS_ORDER = ["ok", "degraded", "unhealthy"]
 
-def create_access_token(data: dict):
-    """Create a JWT access token"""
-    to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
+    def __init__(self, cache_seconds: float):
+        self.cache_seconds = cache_seconds
+        self._result: Optional[dict] = None
+        self._checked_at = 0.0
+        self._lock = asyncio.Lock()
 
-def verify_token(token: str):
-    """Verify and decode a JWT token"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
-    except JWTError:
-        return None
+    async def check_mongo(self) -> dict:
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(db.command("ping"), HEALTH_MONGO_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            return {"status": "unhealthy", "error": f"ping timed out after {HEALTH_MONGO_TIMEOUT_SECONDS}s"}
+        except Exception as e:
+            return {"status": "unhealthy", "error": str(e)}
+        latency_ms = (time.perf_counter() - start) * 1000
+        return {"status": threshold_status(latency_ms, HEALTH_MAX_PING_MS), "latency_ms": round(latency_ms, 2)}
 
-# Security scheme for FastAPI
-security = HTTPBearer()
+    def check_pool(self) -> dict:
+        max_size = client.options.pool_options.max_pool_size
+        in_use = max(connection_pools.in_use.values(), default=0)
+        utilization = in_use / max_size if max_size else 0.0
+        return {"status": threshold_status(utilization, HEALTH_MAX_POOL_UTILIZATION),
+                "in_use": in_use, "max_size": max_size, "utilization": round(utilization, 3)}
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> User:
-    """Get current user from JWT token"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        token = credentials.credentials
-        payload = verify_token(token)
-        if payload is None:
-            raise credentials_exception
-        
-        user_id = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
-            
-    except Exception:
-        raise credentials_exception
-    
-    # Find user in database
-    user_doc = await db.users.find_one({"_id": ObjectId(user_id)})
-    if user_doc is None:
-        raise credentials_exception
-    
-    return User(**user_doc)
+    def check_event_loop(self) -> dict:
+        lag_ms = loop_lag.lag * 1000
+        return {"status": threshold_status(lag_ms, HEALTH_MAX_LOOP_LAG_MS), "lag_ms": round(lag_ms, 2)}
+
+    def check_socketio(self) -> dict:
+        # The memory manager has no connection; a pub/sub manager starts listening when
+        # the first socket connects and must still be listening after that
+        listening = getattr(sio.manager, "listening", None)
+        status = "degraded" if listening is False and sio.manager_initialized else "ok"
+        return {"status": status, "manager": SOCKETIO_MANAGER, "listening": listening}
+
+    async def run_checks(self) -> dict:
+        checks = {
+            "mongo": await self.check_mongo(),
+            "mongo_pool": self.check_pool(),
+            "event_loop": self.check_event_loop(),
+            "socketio": self.check_socketio(),
+        }
+        status = max((check["status"] for check in checks.values()), key=self.STATUS_ORDER.index)
+        return {"status": status, "checked_at": datetime.now(timezone.utc).isoformat(), "checks": checks}
+
+    async def result(self) -> dict:
+        async with self._lock:
+            if self._result is None or time.monotonic() - self._checked_at >= self.cache_seconds:
+                self._result = await self.run_checks()
+                self._checked_at = time.monotonic()
+            return self._result
+
+readiness = ReadinessProbe(HEALTH_CACHE_SECONDS)
 
 # Authentication endpoints
 @api_router.post("/auth/register")
 async def register(user_data: UserRegister):
     """Register a new user"""
-    # Check if email already exists
-    existing_user = await db.users.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Check if username already exists
-    existing_username = await db.users.find_one({"username": user_data.username})
-    if existing_username:
-        raise HTTPException(status_code=400, detail="Username already taken")
-    
     # Validate password strength (basic validation)
     if len(user_data.password) < 6:
         raise HTTPException(status_code=400, detail="Password must be at least 6 characters long")
     
     # Create new user
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await password_hasher.hash(user_data.password)
     new_user = User(
         email=user_data.email,
         username=user_data.username,
@@ -297,8 +3332,15 @@ async def register(user_data: UserRegister):
         name=user_data.name
     )
     
-    result = await db.users.insert_one(new_user.dict(by_alias=True, exclude={"id"}))
+    # Email and username uniqueness is enforced by the users indexes
+    try:
+        result = await db.users.insert_one(new_user.dict(by_alias=True, exclude={"id"}))
+    except DuplicateKeyError as e:
+        if "email" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise HTTPException(status_code=400, detail="Username already taken")
     new_user.id = result.inserted_id
+    search_backend.index("users", new_user.dict(by_alias=True))
     
     # Create access token
     access_token = create_access_token(data={"sub": str(new_user.id)})
@@ -311,7 +3353,7 @@ async def register(user_data: UserRegister):
             "email": new_user.email,
             "username": new_user.username,
             "name": new_user.name,
-            "avatar": new_user.avatar,
+            "avatar": avatar_url(new_user.dict()),
             "bio": new_user.bio,
             "external_link": new_user.external_link,
             "follower_count": new_user.follower_count,
@@ -328,9 +3370,16 @@ async def login(user_credentials: UserLogin):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     # Verify password
-    if not verify_password(user_credentials.password, user_doc["password_hash"]):
+    if not await password_hasher.verify(user_credentials.password, user_doc["password_hash"]):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    # Upgrade the stored hash when BCRYPT_ROUNDS has changed since it was created
+    if password_needs_rehash(user_doc["password_hash"]):
+        await db.users.update_one(
+            {"_id": user_doc["_id"]},
+            {"$set": {"password_hash": await password_hasher.hash(user_credentials.password)}}
+        )
+    
     # Create access token
     access_token = create_access_token(data={"sub": str(user_doc["_id"])})
     
@@ -342,7 +3391,7 @@ async def login(user_credentials: UserLogin):
             "email": user_doc["email"],
             "username": user_doc["username"],
             "name": user_doc["name"],
-            "avatar": user_doc.get("avatar", ""),
+            "avatar": avatar_url(user_doc),
             "bio": user_doc.get("bio", ""),
             "external_link": user_doc.get("external_link", ""),
             "follower_count": user_doc.get("follower_count", 0),
@@ -351,14 +3400,14 @@ async def login(user_credentials: UserLogin):
     }
 
 @api_router.get("/auth/me")
-async def get_current_user_info(current_user: User = Depends(get_current_user)):
+async def get_current_user_info(current_user: Principal = Depends(get_current_user)):
     """Get current user information"""
     return {
         "id": str(current_user.id),
         "email": current_user.email,
         "username": current_user.username,
         "name": current_user.name,
-        "avatar": current_user.avatar,
+        "avatar": avatar_url(current_user.dict()),
         "bio": current_user.bio,
         "external_link": current_user.external_link,
         "follower_count": current_user.follower_count,
@@ -367,18 +3416,11 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
 
 # User endpoints
 @api_router.put("/users/profile")
-async def update_profile(user_update: UserUpdate, current_user: User = Depends(get_current_user)):
+async def update_profile(user_update: UserUpdate, current_user: Principal = Depends(get_current_user)):
     """Update current user's profile"""
     update_data = {}
     
     if user_update.username:
-        # Check if username is already taken
-        existing = await db.users.find_one({
-            "username": user_update.username,
-            "_id": {"$ne": current_user.id}
-        })
-        if existing:
-            raise HTTPException(status_code=400, detail="Username already taken")
         update_data["username"] = user_update.username
     
     if user_update.bio is not None:
@@ -387,23 +3429,31 @@ async def update_profile(user_update: UserUpdate, current_user: User = Depends(g
     if user_update.external_link is not None:
         update_data["external_link"] = user_update.external_link
     
-    if user_update.avatar is not None:
-        update_data["avatar"] = user_update.avatar
+    if user_update.avatar_id is not None or user_update.avatar is not None:
+        avatar_id, avatar, avatar_renditions = await resolve_media(user_update.avatar_id, user_update.avatar)
+        update_data.update(avatar_id=avatar_id, avatar=avatar, avatar_renditions=avatar_renditions)
     
     if update_data:
-        await db.users.update_one(
-            {"_id": current_user.id},
-            {"$set": update_data}
-        )
+        update_data["updated_at"] = datetime.now(timezone.utc)
+        try:
+            await db.users.update_one(
+                {"_id": current_user.id},
+                {"$set": update_data}
+            )
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Username already taken")
+        principal_cache.invalidate(current_user.id)
+        response_cache.invalidate(f"user:{current_user.id}")
     
     # Return updated user
     updated_user = await db.users.find_one({"_id": current_user.id})
+    search_backend.index("users", updated_user)
     return {
         "id": str(updated_user["_id"]),
         "email": updated_user["email"],
         "name": updated_user["name"],
         "username": updated_user["username"],
-        "avatar": updated_user["avatar"],
+        "avatar": avatar_url(updated_user),
         "bio": updated_user["bio"],
         "external_link": updated_user["external_link"],
         "follower_count": updated_user["follower_count"],
@@ -411,26 +3461,30 @@ async def update_profile(user_update: UserUpdate, current_user: User = Depends(g
     }
 
 @api_router.get("/users/{username}")
-async def get_user_by_username(username: str):
+async def get_user_by_username(username: str, request: Request):
     """Get user by username"""
+    cached = await response_cache.lookup(request)
+    if cached:
+        return cached
+    
     user = await db.users.find_one({"username": username})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    return {
+    return await response_cache.store_response(request, {
         "id": str(user["_id"]),
         "name": user["name"],
         "username": user["username"],
-        "avatar": user["avatar"],
+        "avatar": avatar_url(user),
         "bio": user["bio"],
         "external_link": user["external_link"],
         "follower_count": user["follower_count"],
         "following_count": user["following_count"]
-    }
+    }, [f"user:{user['_id']}"])
 
 # Room endpoints
 @api_router.post("/rooms")
-async def create_room(room_data: RoomCreate, current_user: User = Depends(get_current_user)):
+async def create_room(room_data: RoomCreate, current_user: Principal = Depends(get_current_user)):
     """Create a new room"""
     room = Room(
         user_id=current_user.id,
@@ -440,60 +3494,44 @@ async def create_room(room_data: RoomCreate, current_user: User = Depends(get_cu
     
     result = await db.rooms.insert_one(room.dict(by_alias=True, exclude={"id"}))
     room.id = result.inserted_id
+    search_backend.index("rooms", room.dict(by_alias=True))
     
     # Add room to user's rooms list
     await db.users.update_one(
         {"_id": current_user.id},
         {"$push": {"rooms": room.id}}
     )
+    principal_cache.invalidate(current_user.id)
+    response_cache.invalidate(f"rooms:{current_user.id}")
     
-    return {
-        "id": str(room.id),
-        "name": room.name,
-        "color": room.color,
-        "post_count": room.post_count,
-        "created_at": room.created_at.isoformat()
-    }
+    return json_response(room_shape(room.dict(by_alias=True)))
 
 @api_router.get("/rooms/my")
-async def get_my_rooms(current_user: User = Depends(get_current_user)):
+async def get_my_rooms(current_user: Principal = Depends(get_current_user)):
     """Get current user's rooms"""
-    rooms = await db.rooms.find({"user_id": current_user.id}).to_list(100)
+    rooms = await db.rooms.find({"user_id": current_user.id}, ROOM_PROJECTION).to_list(100)
     
-    return [
-        {
-            "id": str(room["_id"]),
-            "name": room["name"],
-            "color": room["color"],
-            "post_count": room["post_count"],
-            "created_at": room["created_at"].isoformat()
-        }
-        for room in rooms
-    ]
+    return json_response([room_shape(room) for room in rooms])
 
 @api_router.get("/users/{username}/rooms")
-async def get_user_rooms(username: str):
+async def get_user_rooms(username: str, request: Request):
     """Get rooms for a specific user"""
+    cached = await response_cache.lookup(request)
+    if cached:
+        return cached
+    
     user = await db.users.find_one({"username": username})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    rooms = await db.rooms.find({"user_id": user["_id"]}).to_list(100)
+    rooms = await db.rooms.find({"user_id": user["_id"]}, ROOM_PROJECTION).to_list(100)
     
-    return [
-        {
-            "id": str(room["_id"]),
-            "name": room["name"],
-            "color": room["color"],
-            "post_count": room["post_count"],
-            "created_at": room["created_at"].isoformat()
-        }
-        for room in rooms
-    ]
+    return await response_cache.store_response(request, [room_shape(room) for room in rooms],
+                                               [f"user:{user['_id']}", f"rooms:{user['_id']}"])
 
 # Post endpoints
 @api_router.post("/posts")
-async def create_post(post_data: PostCreate, current_user: User = Depends(get_current_user)):
+async def create_post(post_data: PostCreate, current_user: Principal = Depends(get_current_user)):
     """Create a new post"""
     # Validate room exists and belongs to user
     room = await db.rooms.find_one({
@@ -509,12 +3547,16 @@ async def create_post(post_data: PostCreate, current_user: User = Depends(get_cu
     if len(post_data.description) > 280:
         raise HTTPException(status_code=400, detail="Description must be 280 characters or less")
     
+    media_id, media, media_renditions = await resolve_media(post_data.media_id, post_data.media)
+    
     post = Post(
         user_id=current_user.id,
         room_id=ObjectId(post_data.room_id),
         title=post_data.title,
         description=post_data.description,
-        media=post_data.media,
+        media=media,
+        media_id=media_id,
+        media_renditions=media_renditions,
         media_type=post_data.media_type,
         tags=post_data.tags,
         external_link=post_data.external_link,
@@ -524,88 +3566,83 @@ async def create_post(post_data: PostCreate, current_user: User = Depends(get_cu
     
     result = await db.posts.insert_one(post.dict(by_alias=True, exclude={"id"}))
     post.id = result.inserted_id
+    search_backend.index("posts", post.dict(by_alias=True))
     
     # Update room post count
     await db.rooms.update_one(
         {"_id": ObjectId(post_data.room_id)},
         {"$inc": {"post_count": 1}}
     )
+    response_cache.invalidate("posts", f"rooms:{current_user.id}")
     
-    # Get user info for response
-    user_info = await db.users.find_one({"_id": current_user.id})
+    # Deliver to followers' home timelines without holding up the response
+    run_in_background(fan_out_post(
+        {"_id": post.id, "user_id": post.user_id, "created_at": post.created_at},
+        current_user.follower_count
+    ))
+    emit_event("post_created", {
+        "post_id": str(post.id),
+        "room_id": str(post.room_id),
+        "user_id": str(post.user_id)
+    }, to=room_channel(post.room_id))
     
-    return {
-        "id": str(post.id),
-        "title": post.title,
-        "description": post.description,
-        "media": post.media,
-        "media_type": post.media_type,
-        "tags": post.tags,
-        "external_link": post.external_link,
-        "recommendation_type": post.recommendation_type,
-        "action_type": post.action_type,
-        "like_count": post.like_count,
-        "comment_count": post.comment_count,
-        "repost_count": post.repost_count,
-        "created_at": post.created_at.isoformat(),
-        "user": {
-            "id": str(user_info["_id"]),
-            "name": user_info["name"],
-            "username": user_info["username"],
-            "avatar": user_info["avatar"]
-        },
-        "room": {
-            "id": str(room["_id"]),
-            "name": room["name"],
-            "color": room["color"]
-        }
-    }
+    return json_response(serialize_post(post.dict(by_alias=True), current_user.dict(by_alias=True), room))
+
+@api_router.get("/posts/trending")
+async def get_trending_posts(limit: int = 20, action_type: Optional[str] = None, tag: Optional[str] = None):
+    """Get the highest scoring posts right now, optionally for one action type or tag"""
+    if action_type and tag:
+        raise HTTPException(status_code=400, detail="Filter by action_type or tag, not both")
+    key = f"action:{action_type}" if action_type else f"tag:{tag.lower()}" if tag else "all"
+    
+    return json_response(await serialize_ranked_posts(trending_entries(key, limit), limit, "trending_score"))
 
 @api_router.get("/posts/{post_id}")
-async def get_post(post_id: str):
+async def get_post(post_id: str, request: Request):
     """Get a specific post by ID"""
     if not ObjectId.is_valid(post_id):
         raise HTTPException(status_code=400, detail="Invalid post ID")
     
+    cached = await response_cache.lookup(request)
+    if cached:
+        return cached
+    
     post = await db.posts.find_one({"_id": ObjectId(post_id)})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    # Get user and room info
-    user_info = await db.users.find_one({"_id": post["user_id"]})
-    room_info = await db.rooms.find_one({"_id": post["room_id"]})
-    
-    return {
-        "id": str(post["_id"]),
-        "title": post["title"],
-        "description": post["description"],
-        "media": post["media"],
-        "media_type": post["media_type"],
-        "tags": post["tags"],
-        "external_link": post["external_link"],
-        "recommendation_type": post["recommendation_type"],
-        "action_type": post["action_type"],
-        "like_count": post["like_count"],
-        "comment_count": post["comment_count"],
-        "repost_count": post["repost_count"],
-        "created_at": post["created_at"].isoformat(),
-        "user": {
-            "id": str(user_info["_id"]),
-            "name": user_info["name"],
-            "username": user_info["username"],
-            "avatar": user_info["avatar"]
-        },
-        "room": {
-            "id": str(room_info["_id"]),
-            "name": room_info["name"],
-            "color": room_info["color"]
-        }
-    }
+    hydrated = await hydrate_posts([post])
+    return await response_cache.store_response(request, hydrated[0], post_cache_tags([post]))
 
 @api_router.get("/posts")
-async def get_posts(skip: int = 0, limit: int = 20, room_id: Optional[str] = None, username: Optional[str] = None):
-    """Get posts with optional filters"""
+async def get_posts(request: Request, response: Response, skip: int = 0, limit: int = 20, room_id: Optional[str] = None,
+                    username: Optional[str] = None, cursor: Optional[str] = None, include: Optional[str] = None,
+                    fields: Optional[str] = None, compact: bool = False,
+                    viewer: Optional[Principal] = Depends(get_optional_user)):
+    """Get posts with optional filters; pass the X-Next-Cursor header back as cursor for the next page"""
+    includes = parse_include(include, POST_INCLUDES)
+    check_includes_allowed(viewer, includes)
+    selection = post_selection(fields) if fields else None
+    # Viewer state is per user, so the shared cache holds the page without it and it is
+    # attached per request from the post and author IDs kept with the entry
+    key = response_cache.key(request, exclude={"include"})
+    entry = await response_cache.fetch(request, key)
+    if entry is None:
+        entry = await build_posts_page(request, response, skip, limit, room_id, username, cursor, selection, compact, key)
+    if not includes:
+        return await response_cache.respond(request, entry)
+    
+    states = await fetch_viewer_state(viewer.id, entry["context"])
+    for name, value in entry["headers"].items():
+        response.headers[name] = value
+    return json_response(with_viewer_state(orjson.loads(entry["body"]), states, compact), response)
+
+async def build_posts_page(request: Request, response: Response, skip: int, limit: int, room_id: Optional[str],
+                           username: Optional[str], cursor: Optional[str], selection: Optional[PostSelection],
+                           compact: bool, key: str) -> dict:
+    """Query and hydrate a get_posts page and cache it, returning the cache entry"""
     query = {}
+    tags = ["posts"]
     
     if room_id:
         if not ObjectId.is_valid(room_id):
@@ -613,100 +3650,110 @@ async def get_posts(skip: int = 0, limit: int = 20, room_id: Optional[str] = Non
         query["room_id"] = ObjectId(room_id)
     
     if username:
-        user = await db.users.find_one({"username": username})
+        user = await db.users.find_one({"username": username}, {"_id": 1})
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         query["user_id"] = user["_id"]
+        tags.append(f"user:{user['_id']}")
     
-    posts = await db.posts.find(query).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+    if cursor:
+        query.update(keyset_filter(cursor, descending=True))
+        skip = 0
     
-    # Get user and room info for each post
-    result = []
-    for post in posts:
-        user_info = await db.users.find_one({"_id": post["user_id"]})
-        room_info = await db.rooms.find_one({"_id": post["room_id"]})
-        
-        result.append({
-            "id": str(post["_id"]),
-            "title": post["title"],
-            "description": post["description"],
-            "media": post["media"],
-            "media_type": post["media_type"],
-            "tags": post["tags"],
-            "external_link": post["external_link"],
-            "recommendation_type": post["recommendation_type"],
-            "action_type": post["action_type"],
-            "like_count": post["like_count"],
-            "comment_count": post["comment_count"],
-            "repost_count": post["repost_count"],
-            "created_at": post["created_at"].isoformat(),
-            "user": {
-                "id": str(user_info["_id"]),
-                "name": user_info["name"],
-                "username": user_info["username"],
-                "avatar": user_info["avatar"]
-            },
-            "room": {
-                "id": str(room_info["_id"]),
-                "name": room_info["name"],
-                "color": room_info["color"]
-            }
-        })
+    projection = selection.projection if selection else None
+    posts = await db.posts.find(query, projection).sort(POST_SORT).skip(skip).limit(limit).to_list(limit)
+    set_next_cursor(response, posts, limit)
     
-    return result
+    content = await hydrate_posts_for(None, posts, set(), selection, compact)
+    context = [{"_id": post["_id"], "user_id": post["user_id"]} for post in posts]
+    return await response_cache.save(request, key, content, tags + post_cache_tags(posts), response, context)
+
+@api_router.post("/posts/batch")
+async def get_posts_batch(batch: PostIdsRequest, include: Optional[str] = None, fields: Optional[str] = None,
+                          compact: bool = False, viewer: Optional[Principal] = Depends(get_optional_user)):
+    """Get many posts by ID in request order; IDs that do not exist are left out"""
+    includes = parse_include(include, POST_INCLUDES)
+    selection = post_selection(fields) if fields else None
+    post_ids = parse_object_ids(batch.post_ids, "post")
+    
+    posts = await fetch_by_ids(db.posts, post_ids, selection.projection if selection else None)
+    found = [posts[post_id] for post_id in post_ids if post_id in posts]
+    
+    return json_response(await hydrate_posts_for(viewer, found, includes, selection, compact))
+
+@api_router.post("/posts/liked-status")
+async def get_liked_status(batch: PostIdsRequest, current_user: Principal = Depends(get_current_user)):
+    """Check which of many posts the current user has liked, as a post ID -> bool map"""
+    post_ids = parse_object_ids(batch.post_ids, "post")
+    
+    liked = set(await db.likes.distinct("post_id", {"user_id": current_user.id, "post_id": {"$in": post_ids}}))
+    
+    return {str(post_id): post_id in liked for post_id in post_ids}
 
 @api_router.post("/posts/{post_id}/like")
-async def like_post(post_id: str, current_user: User = Depends(get_current_user)):
+async def like_post(post_id: str, current_user: Principal = Depends(get_current_user)):
     """Like or unlike a post"""
     if not ObjectId.is_valid(post_id):
         raise HTTPException(status_code=400, detail="Invalid post ID")
     
-    post = await db.posts.find_one({"_id": ObjectId(post_id)})
+    post = await db.posts.find_one({"_id": ObjectId(post_id)}, {"user_id": 1, "action_type": 1, "tags": 1, "like_count": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
-    # Check if user already liked the post
-    existing_like = await db.likes.find_one({
-        "user_id": current_user.id,
-        "post_id": ObjectId(post_id)
-    })
-    
-    if existing_like:
-        # Unlike the post
-        await db.likes.delete_one({"_id": existing_like["_id"]})
-        await db.posts.update_one(
-            {"_id": ObjectId(post_id)},
-            {"$inc": {"like_count": -1}}
-        )
-        liked = False
-    else:
-        # Like the post
-        like = Like(
-            user_id=current_user.id,
-            post_id=ObjectId(post_id)
-        )
-        await db.likes.insert_one(like.dict(by_alias=True, exclude={"id"}))
-        await db.posts.update_one(
-            {"_id": ObjectId(post_id)},
-            {"$inc": {"like_count": 1}}
-        )
+    # Like the post with an upsert on the unique (user_id, post_id) key; getting back the
+    # previous document means it was already liked, so unlike instead
+    like = Like(
+        user_id=current_user.id,
+        post_id=post["_id"]
+    )
+    existing = await db.likes.find_one_and_update(
+        {"user_id": like.user_id, "post_id": like.post_id},
+        {"$setOnInsert": {"created_at": like.created_at}},
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if existing is None:
         liked = True
+        delta = 1
+        # Recorded at the stored created_at, which unliking subtracts again
+        trending.record(post, "like", at=stored_time(like.created_at))
+    else:
+        # Only the request that removes the like decrements
+        removed = await db.likes.find_one_and_delete({"_id": existing["_id"]}, projection={"created_at": 1})
+        liked = False
+        delta = -1 if removed else 0
+        if removed:
+            trending.record(post, "like", at=removed["created_at"], count=-1)
     
-    # Get updated like count
-    updated_post = await db.posts.find_one({"_id": ObjectId(post_id)})
+    like_count = post.get("like_count", 0) + counters.add("posts", post["_id"], "like_count", delta)
+    if delta:
+        recommendation_updates.touch(post["_id"], current_user.id)
+    like_events.publish(post_id, like_count, [post_channel(post_id), user_channel(post["user_id"])])
     
     return {
         "liked": liked,
-        "like_count": updated_post["like_count"]
+        "like_count": like_count
     }
 
+@api_router.get("/posts/{post_id}/similar")
+async def get_similar_posts(post_id: str, limit: int = 20):
+    """Get posts liked by the same people as this one, most similar first"""
+    if not ObjectId.is_valid(post_id):
+        raise HTTPException(status_code=400, detail="Invalid post ID")
+    
+    doc = await db.post_neighbors.find_one({"_id": ObjectId(post_id)})
+    if not doc:
+        return []
+    return json_response(await serialize_ranked_posts(doc["neighbors"], limit, "similarity"))
+
 @api_router.post("/posts/{post_id}/comments")
-async def create_comment(post_id: str, comment_data: CommentCreate, current_user: User = Depends(get_current_user)):
+async def create_comment(post_id: str, comment_data: CommentCreate, current_user: Principal = Depends(get_current_user)):
     """Create a comment on a post"""
     if not ObjectId.is_valid(post_id):
         raise HTTPException(status_code=400, detail="Invalid post ID")
     
-    post = await db.posts.find_one({"_id": ObjectId(post_id)})
+    post = await db.posts.find_one({"_id": ObjectId(post_id)}, {"user_id": 1, "comment_count": 1, "action_type": 1, "tags": 1})
     if not post:
         raise HTTPException(status_code=404, detail="Post not found")
     
@@ -720,53 +3767,36 @@ async def create_comment(post_id: str, comment_data: CommentCreate, current_user
     comment.id = result.inserted_id
     
     # Update post comment count
-    await db.posts.update_one(
-        {"_id": ObjectId(post_id)},
-        {"$inc": {"comment_count": 1}}
-    )
+    comment_count = post.get("comment_count", 0) + counters.add("posts", post["_id"], "comment_count", 1)
+    trending.record(post, "comment", at=comment.created_at)
+    emit_event("comment_created", {
+        "post_id": post_id,
+        "comment_id": str(comment.id),
+        "comment_count": comment_count
+    }, to=[post_channel(post_id), user_channel(post["user_id"])])
     
-    return {
-        "id": str(comment.id),
-        "content": comment.content,
-        "created_at": comment.created_at.isoformat(),
-        "user": {
-            "id": str(current_user.id),
-            "name": current_user.name,
-            "username": current_user.username,
-            "avatar": current_user.avatar
-        }
-    }
+    return json_response(serialize_comment(comment.dict(by_alias=True), current_user.dict(by_alias=True)))
 
 @api_router.get("/posts/{post_id}/comments")
-async def get_post_comments(post_id: str, skip: int = 0, limit: int = 50):
-    """Get comments for a post"""
+async def get_post_comments(post_id: str, response: Response, skip: int = 0, limit: int = 50,
+                            cursor: Optional[str] = None):
+    """Get comments for a post, oldest first; supports the same cursor paging as get_posts"""
     if not ObjectId.is_valid(post_id):
         raise HTTPException(status_code=400, detail="Invalid post ID")
     
-    comments = await db.comments.find({
-        "post_id": ObjectId(post_id)
-    }).sort("created_at", 1).skip(skip).limit(limit).to_list(limit)
-    
-    result = []
-    for comment in comments:
-        user_info = await db.users.find_one({"_id": comment["user_id"]})
-        result.append({
-            "id": str(comment["_id"]),
-            "content": comment["content"],
-            "created_at": comment["created_at"].isoformat(),
-            "user": {
-                "id": str(user_info["_id"]),
-                "name": user_info["name"],
-                "username": user_info["username"],
-                "avatar": user_info["avatar"]
-            }
-        })
+    query = {"post_id": ObjectId(post_id)}
+    if cursor:
+        query.update(keyset_filter(cursor, descending=False))
+        skip = 0
     
-    return result
+    comments = await db.comments.find(query).sort(COMMENT_SORT).skip(skip).limit(limit).to_list(limit)
+    set_next_cursor(response, comments, limit)
+    
+    return json_response(await hydrate_comments(comments), response)
 
 # Follow/Unfollow endpoints
 @api_router.post("/users/{username}/follow")
-async def follow_user(username: str, current_user: User = Depends(get_current_user)):
+async def follow_user(username: str, current_user: Principal = Depends(get_current_user)):
     """Follow or unfollow a user"""
     target_user = await db.users.find_one({"username": username})
     if not target_user:
@@ -775,47 +3805,48 @@ async def follow_user(username: str, current_user: User = Depends(get_current_us
     if target_user["_id"] == current_user.id:
         raise HTTPException(status_code=400, detail="Cannot follow yourself")
     
-    # Check if already following
-    existing_follow = await db.follows.find_one({
-        "follower_id": current_user.id,
-        "following_id": target_user["_id"]
-    })
-    
-    if existing_follow:
-        # Unfollow
-        await db.follows.delete_one({"_id": existing_follow["_id"]})
-        # Update counts
-        await db.users.update_one(
-            {"_id": current_user.id},
-            {"$inc": {"following_count": -1}}
-        )
-        await db.users.update_one(
-            {"_id": target_user["_id"]},
-            {"$inc": {"follower_count": -1}}
-        )
-        following = False
-    else:
-        # Follow
-        follow = Follow(
-            follower_id=current_user.id,
-            following_id=target_user["_id"]
-        )
-        await db.follows.insert_one(follow.dict(by_alias=True, exclude={"id"}))
-        # Update counts
-        await db.users.update_one(
-            {"_id": current_user.id},
-            {"$inc": {"following_count": 1}}
-        )
-        await db.users.update_one(
-            {"_id": target_user["_id"]},
-            {"$inc": {"follower_count": 1}}
-        )
+    # Follow with an upsert on the unique (follower_id, following_id) key; getting back the
+    # previous document means it was already followed, so unfollow instead
+    follow = Follow(
+        follower_id=current_user.id,
+        following_id=target_user["_id"]
+    )
+    existing = await db.follows.find_one_and_update(
+        {"follower_id": follow.follower_id, "following_id": follow.following_id},
+        {"$setOnInsert": {"created_at": follow.created_at}},
+        projection={"_id": 1},
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+    if existing is None:
         following = True
+        delta = 1
+    else:
+        # Already following, so unfollow; only the request that removes the follow updates counts
+        result = await db.follows.delete_one({"_id": existing["_id"]})
+        following = False
+        delta = -result.deleted_count
+    
+    if delta:
+        # Update counts; the principal cache is invalidated when they are flushed
+        counters.add("users", current_user.id, "following_count", delta)
+        counters.add("users", target_user["_id"], "follower_count", delta)
+        followed_celebrities_cache.pop(current_user.id, None)
+        emit_event("follow", {
+            "user_id": str(current_user.id),
+            "username": current_user.username,
+            "following": following
+        }, to=user_channel(target_user["_id"]))
+        if following:
+            if target_user.get("follower_count", 0) < CELEBRITY_FOLLOWER_THRESHOLD:
+                run_in_background(backfill_timeline(current_user.id, target_user["_id"]))
+        else:
+            run_in_background(prune_timeline(current_user.id, target_user["_id"]))
     
     return {"following": following}
 
 @api_router.get("/users/{username}/following-status")
-async def get_following_status(username: str, current_user: User = Depends(get_current_user)):
+async def get_following_status(username: str, current_user: Principal = Depends(get_current_user)):
     """Check if current user is following the specified user"""
     target_user = await db.users.find_one({"username": username})
     if not target_user:
@@ -831,6 +3862,296 @@ async def get_following_status(username: str, current_user: User = Depends(get_c
     
     return {"following": bool(follow), "is_self": False}
 
+@api_router.post("/users/following-status")
+async def get_following_status_batch(batch: UsernamesRequest, current_user: Principal = Depends(get_current_user)):
+    """Check which of many users the current user follows; usernames that do not exist are left out"""
+    usernames = list(dict.fromkeys(batch.usernames))
+    users = await db.users.find({"username": {"$in": usernames}}, {"username": 1}).to_list(len(usernames))
+    
+    following = set(await db.follows.distinct("following_id", {
+        "follower_id": current_user.id,
+        "following_id": {"$in": [user["_id"] for user in users]}
+    }))
+    
+    return {
+        user["username"]: {"following": user["_id"] in following, "is_self": user["_id"] == current_user.id}
+        for user in users
+    }
+
+# Direct message endpoints
+@api_router.post("/messages")
+async def send_message(message_data: MessageCreate, current_user: Principal = Depends(get_current_user)):
+    """Send a direct message and deliver it live to the receiver"""
+    if not ObjectId.is_valid(message_data.receiver_id):
+        raise HTTPException(status_code=400, detail="Invalid receiver ID")
+    receiver_id = ObjectId(message_data.receiver_id)
+    
+    if receiver_id == current_user.id:
+        raise HTTPException(status_code=400, detail="Cannot message yourself")
+    if not message_data.content and not (message_data.media or message_data.media_id):
+        raise HTTPException(status_code=400, detail="Message must have content or media")
+    
+    receiver = await db.users.find_one({"_id": receiver_id}, {"_id": 1})
+    if not receiver:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    media_id, media, media_renditions = await resolve_media(message_data.media_id, message_data.media)
+    
+    message = Message(
+        conversation_key=conversation_key(current_user.id, receiver_id),
+        sender_id=current_user.id,
+        receiver_id=receiver_id,
+        content=message_data.content,
+        media=media,
+        media_id=media_id,
+        media_renditions=media_renditions,
+        message_type=message_data.message_type
+    )
+    message_doc = message.dict(by_alias=True)
+    await db.messages.insert_one(message_doc)
+    
+    # Keep both participants' inbox entries current; only the receiver gains an unread message
+    preview = message_preview(message_doc)
+    await db.conversations.bulk_write([
+        UpdateOne(
+            {"user_id": current_user.id, "peer_id": receiver_id},
+            {"$set": {"last_message": preview, "updated_at": message.created_at, "conversation_key": message.conversation_key},
+             "$setOnInsert": {"unread_count": 0}},
+            upsert=True
+        ),
+        UpdateOne(
+            {"user_id": receiver_id, "peer_id": current_user.id},
+            {"$set": {"last_message": preview, "updated_at": message.created_at, "conversation_key": message.conversation_key},
+             "$inc": {"unread_count": 1}},
+            upsert=True
+        ),
+    ], ordered=False)
+    
+    result = serialize_message(message_doc)
+    emit_event("message", result, to=[user_channel(receiver_id), user_channel(current_user.id)])
+    
+    return result
+
+@api_router.get("/conversations")
+async def get_conversations(response: Response, limit: int = 20, cursor: Optional[str] = None,
+                            current_user: Principal = Depends(get_current_user)):
+    """List the current user's conversations, most recently active first"""
+    query = {"user_id": current_user.id}
+    if cursor:
+        query.update(keyset_filter(cursor, descending=True, field="updated_at"))
+    
+    conversations = await db.conversations.find(query).sort(CONVERSATION_SORT).limit(limit).to_list(limit)
+    set_next_cursor(response, conversations, limit, field="updated_at")
+    
+    peers = await fetch_by_ids(db.users, [c["peer_id"] for c in conversations], USER_SUMMARY_PROJECTION)
+    return json_response([serialize_conversation(c, peers.get(c["peer_id"])) for c in conversations], response)
+
+@api_router.get("/conversations/{peer_id}/messages")
+async def get_conversation_messages(peer_id: str, response: Response, limit: int = 50, cursor: Optional[str] = None,
+                                    current_user: Principal = Depends(get_current_user)):
+    """Get message history with another user, newest first"""
+    if not ObjectId.is_valid(peer_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    
+    query = {"conversation_key": conversation_key(current_user.id, ObjectId(peer_id))}
+    if cursor:
+        query.update(keyset_filter(cursor, descending=True))
+    
+    messages = await db.messages.find(query).sort(POST_SORT).limit(limit).to_list(limit)
+    set_next_cursor(response, messages, limit)
+    
+    return [serialize_message(message) for message in messages]
+
+@api_router.post("/conversations/{peer_id}/read")
+async def mark_conversation_read(peer_id: str, current_user: Principal = Depends(get_current_user)):
+    """Mark every unread message from a user as read and notify them"""
+    if not ObjectId.is_valid(peer_id):
+        raise HTTPException(status_code=400, detail="Invalid user ID")
+    peer_id = ObjectId(peer_id)
+    
+    now = datetime.now(timezone.utc)
+    result = await db.messages.update_many(
+        {"conversation_key": conversation_key(current_user.id, peer_id), "receiver_id": current_user.id, "read": False},
+        {"$set": {"read": True, "read_at": now}}
+    )
+    await db.conversations.update_one(
+        {"user_id": current_user.id, "peer_id": peer_id},
+        {"$set": {"unread_count": 0}}
+    )
+    
+    if result.modified_count:
+        emit_event("messages_read", {
+            "user_id": str(current_user.id),
+            "read_at": now.isoformat()
+        }, to=user_channel(peer_id))
+    
+    return {"marked_read": result.modified_count}
+
+# Search endpoints
+@api_router.get("/search")
+async def search(q: str, type: Optional[str] = None, limit: int = 20, action_type: Optional[str] = None,
+                 recommendation_type: Optional[str] = None, tag: Optional[str] = None):
+    """Search posts, users and rooms; post results can be filtered by action, recommendation type and tag"""
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    if type is not None and type not in SEARCH_FIELDS:
+        raise HTTPException(status_code=400, detail=f"type must be one of: {', '.join(SEARCH_FIELDS)}")
+    
+    kinds = [type] if type else list(SEARCH_FIELDS)
+    post_filters = {field: value for field, value in (
+        ("action_type", action_type), ("recommendation_type", recommendation_type), ("tags", tag)
+    ) if value}
+    matches = await asyncio.gather(*[
+        search_backend.search(kind, q, limit, post_filters if kind == "posts" else {}) for kind in kinds
+    ])
+    results = dict(zip(kinds, matches))
+    
+    found = {}
+    if "posts" in results:
+        found["posts"] = await serialize_ranked_posts(
+            [{"post_id": _id, "score": round(score, 4)} for _id, score in results["posts"]], limit, "score"
+        )
+    if "users" in results:
+        users = await fetch_by_ids(db.users, [_id for _id, _ in results["users"]],
+                                   {**USER_SUMMARY_PROJECTION, "bio": 1, "follower_count": 1})
+        found["users"] = [
+            {**serialize_user_summary(users[_id]), "bio": users[_id].get("bio", ""),
+             "follower_count": users[_id].get("follower_count", 0), "score": round(score, 4)}
+            for _id, score in results["users"] if _id in users
+        ]
+    if "rooms" in results:
+        rooms = await fetch_by_ids(db.rooms, [_id for _id, _ in results["rooms"]],
+                                   {**ROOM_SUMMARY_PROJECTION, "user_id": 1, "post_count": 1})
+        owners = await fetch_by_ids(db.users, [room["user_id"] for room in rooms.values()], USER_SUMMARY_PROJECTION)
+        found["rooms"] = [
+            {**serialize_room_summary(rooms[_id]), "post_count": rooms[_id].get("post_count", 0),
+             "user": serialize_user_summary(owners.get(rooms[_id]["user_id"])), "score": round(score, 4)}
+            for _id, score in results["rooms"] if _id in rooms
+        ]
+    return json_response(found)
+
+@api_router.get("/search/autocomplete")
+async def search_autocomplete(q: str, limit: int = 10):
+    """Suggest completions for a partially typed search term"""
+    prefix = q.strip()
+    if not prefix:
+        return []
+    return await search_backend.autocomplete(prefix, limit)
+
+# Recommendation endpoints
+@api_router.get("/recommendations")
+async def get_recommendations(limit: int = 20, current_user: Principal = Depends(get_current_user)):
+    """Get posts recommended from the current user's likes, falling back to trending"""
+    doc = await db.user_recommendations.find_one({"_id": current_user.id})
+    if doc and doc["posts"]:
+        return json_response(await serialize_ranked_posts(doc["posts"], limit, "score"))
+    
+    # No likes to go on yet
+    return json_response(await serialize_ranked_posts(trending_entries("all", limit), limit, "trending_score"))
+
+# Home feed endpoints
+@api_router.get("/feed/home")
+async def get_home_feed(response: Response, limit: int = 20, cursor: Optional[str] = None,
+                        current_user: Principal = Depends(get_current_user)):
+    """Get posts from the current user and the accounts they follow, newest first"""
+    posts = await read_home_timeline(current_user.id, limit, cursor)
+    set_next_cursor(response, posts, limit)
+    
+    return json_response(await hydrate_posts(posts), response)
+
+# Media endpoints
+@api_router.post("/media")
+async def upload_media(file: UploadFile = File(...), current_user: Principal = Depends(get_current_user)):
+    """Upload a media file; identical bytes are stored once"""
+    data = await file.read(MEDIA_MAX_BYTES + 1)
+    if not data:
+        raise HTTPException(status_code=400, detail="Empty media file")
+    
+    return serialize_media(await store_media(data))
+
+@api_router.get("/media/{media_id}")
+async def get_media(media_id: str, request: Request):
+    """Stream a media file with ETag and single-range support"""
+    if not MEDIA_ID_PATTERN.match(media_id):
+        raise HTTPException(status_code=400, detail="Invalid media ID")
+    
+    media = await db.media.find_one({"_id": media_id})
+    if not media:
+        raise HTTPException(status_code=404, detail="Media not found")
+    
+    # Content-addressed blobs never change, so the digest is a strong ETag
+    etag = f'"{media_id}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "X-Content-Type-Options": "nosniff"
+    }
+    
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    
+    length = media["length"]
+    start, end = 0, length - 1
+    status_code = 200
+    
+    range_header = request.headers.get("range")
+    if range_header and length > 0:
+        byte_range = parse_range_header(range_header, length)
+        if byte_range is None:
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                                headers={"Content-Range": f"bytes */{length}"})
+        start, end = byte_range
+        status_code = 206
+        headers["Content-Range"] = f"bytes {start}-{end}/{length}"
+    
+    headers["Content-Length"] = str(end - start + 1)
+    # Blobs stored before types were sniffed may carry a client-supplied type; never serve those inline
+    content_type = media["content_type"]
+    if content_type not in MEDIA_ALLOWED_TYPES:
+        content_type = "application/octet-stream"
+        headers["Content-Disposition"] = "attachment"
+    return StreamingResponse(
+        get_media_store().stream(media_id, start, end),
+        status_code=status_code,
+        media_type=content_type,
+        headers=headers
+    )
+
+# Admin endpoints
+@api_router.get("/admin/export/{collection_name}")
+async def export_collection(collection_name: str, admin: Principal = Depends(get_admin_user)):
+    """Stream a whole collection as NDJSON"""
+    if collection_name not in EXPORT_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"collection must be one of {', '.join(EXPORT_COLLECTIONS)}")
+    
+    return StreamingResponse(
+        export_ndjson([(collection_name, {})]),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{collection_name}.ndjson"'}
+    )
+
+@api_router.get("/admin/export/users/{username}")
+async def export_user(username: str, admin: Principal = Depends(get_admin_user)):
+    """Stream a user's profile, rooms, posts, comments, likes and follows as NDJSON"""
+    user = await db.users.find_one({"username": username}, {"_id": 1})
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return StreamingResponse(
+        export_ndjson(user_export_plan(user["_id"])),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{username}.ndjson"'}
+    )
+
+@api_router.post("/admin/import")
+async def import_documents(request: Request, mode: str = "insert", admin: Principal = Depends(get_admin_user)):
+    """Import an NDJSON export from the request body; mode=upsert replaces documents that already exist"""
+    if mode not in IMPORT_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {', '.join(IMPORT_MODES)}")
+    
+    return await import_ndjson(request.stream(), mode)
+
 # Basic health check
 @api_router.get("/")
 async def root():
@@ -840,9 +4161,56 @@ async def root():
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
 
+@api_router.get("/health/live")
+async def liveness_check():
+    """The process is up and its event loop is serving requests"""
+    return {"status": "ok"}
+
+@api_router.get("/health/ready")
+async def readiness_check(response: Response):
+    """Whether this worker should receive traffic; 503 when a dependency is unhealthy"""
+    result = await readiness.result()
+    if result["status"] == "unhealthy" or (result["status"] == "degraded" and HEALTH_FAIL_WHEN_DEGRADED):
+        response.status_code = 503
+    return result
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Request, Mongo and cache metrics for this worker in Prometheus text format"""
+    gauges = {
+        "irecommend_password_hash_queue_depth": ("Password hashes waiting for a worker", password_hasher.queue_depth),
+        "irecommend_background_tasks": ("Fire-and-forget tasks still running", len(background_tasks)),
+        "irecommend_media_queue_depth": ("Images waiting for a media processing worker", media_processor.queue_depth),
+    }
+    labelled_counters = {
+        "irecommend_admission_rejected_total": ("Requests rejected by rate limits or load shedding", ("reason",),
+                                                {(reason,): count for reason, count in admission_stats()["rejected"].items()}),
+        "irecommend_principal_cache_requests_total": ("Principal cache lookups", ("result",),
+                                                      {("hit",): principal_cache.hits, ("miss",): principal_cache.misses}),
+        "irecommend_response_cache_requests_total": ("Response cache lookups", ("result",),
+                                                     {("hit",): response_cache.hits, ("miss",): response_cache.misses}),
+        "irecommend_response_cache_not_modified_total": ("Responses answered with 304 Not Modified", (),
+                                                         {(): response_cache.not_modified}),
+        "irecommend_compressed_responses_total": ("Responses sent compressed", ("encoding", "source"),
+                                                  response_compressor.responses),
+        "irecommend_compression_bytes_saved_total": ("Body bytes saved by compression", ("encoding", "source"),
+                                                     response_compressor.bytes_saved),
+        "irecommend_compression_cpu_seconds_total": ("CPU time spent compressing bodies", ("encoding", "source"),
+                                                     response_compressor.cpu_seconds),
+    }
+    return PlainTextResponse(metrics.render(gauges, labelled_counters), media_type="text/plain; version=0.0.4")
+
+@api_router.get("/health/admission")
+async def admission_status():
+    """In-flight requests and rejection counters for this worker"""
+    return admission_stats()
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Rate limiting and load shedding; added before CORS so rejections still carry CORS headers
+app.add_middleware(AdmissionControlMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -850,8 +4218,15 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After", "ETag"],
 )
 
+# Response compression; inside metrics, so response sizes are recorded as sent
+app.add_middleware(CompressionMiddleware)
+
+# Request metrics; outermost, so rejected and CORS preflight requests are counted too
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -859,18 +4234,164 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes_on_startup():
+    await ensure_indexes()
+
+@app.on_event("startup")
+async def start_trending_recompute():
+    app.state.trending_task = run_in_background(trending.recompute_forever(TRENDING_RECOMPUTE_SECONDS))
+
+@app.on_event("startup")
+async def start_search_sync():
+    app.state.search_sync_task = run_in_background(search_backend.sync_forever(SEARCH_SYNC_SECONDS))
+
+@app.on_event("shutdown")
+async def stop_search_sync():
+    app.state.search_sync_task.cancel()
+
+@app.on_event("shutdown")
+async def stop_trending_recompute():
+    app.state.trending_task.cancel()
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    app.state.loop_lag_task = run_in_background(loop_lag.run())
+
+@app.on_event("shutdown")
+async def stop_loop_lag_monitor():
+    app.state.loop_lag_task.cancel()
+
+@app.on_event("startup")
+async def start_counter_flush():
+    app.state.counter_flush_task = run_in_background(counters.flush_forever(COUNTER_FLUSH_SECONDS))
+
+@app.on_event("shutdown")
+async def flush_counters():
+    app.state.counter_flush_task.cancel()
+    await counters.flush()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
     client.close()
 
+@app.on_event("shutdown")
+async def shutdown_password_hasher():
+    password_hasher.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_media_processor():
+    media_processor.shutdown()
+
+@app.on_event("shutdown")
+async def shutdown_response_compressor():
+    response_compressor.shutdown()
+
 # Socket.IO events for real-time features (Phase 4)
 @sio.event
-async def connect(sid, environ):
-    logger.info(f"Client {sid} connected")
+async def connect(sid, environ, auth=None):
+    token = socket_token(environ, auth)
+    payload = verify_token(token) if token else None
+    user_id = payload.get("sub") if payload else None
+    if not user_id or not ObjectId.is_valid(user_id):
+        logger.info(f"Client {sid} rejected: invalid credentials")
+        raise socketio.exceptions.ConnectionRefusedError("Could not validate credentials")
+    
+    await sio.save_session(sid, {"user_id": user_id})
+    await sio.enter_room(sid, user_channel(user_id))
+    logger.info(f"Client {sid} connected as user {user_id}")
 
 @sio.event
 async def disconnect(sid):
     logger.info(f"Client {sid} disconnected")
 
+@sio.event
+async def subscribe(sid, data):
+    """Join a room:<id> or post:<id> channel; payload is {"room_id": ...} or {"post_id": ...}"""
+    channel = subscription_channel(data)
+    if channel is None:
+        return {"ok": False, "error": "Expected a valid room_id or post_id"}
+    await sio.enter_room(sid, channel)
+    return {"ok": True, "channel": channel}
+
+@sio.event
+async def unsubscribe(sid, data):
+    """Leave a channel joined with subscribe"""
+    channel = subscription_channel(data)
+    if channel is None:
+        return {"ok": False, "error": "Expected a valid room_id or post_id"}
+    await sio.leave_room(sid, channel)
+    return {"ok": True, "channel": channel}
+
 # Export the ASGI app for uvicorn
-asgi_app = socket_app
\ No newline at end of file
+asgi_app = socket_app
+
+# Maintenance commands: python server.py <command>
+if __name__ == "__main__":
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description="i-Recommend backend maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("migrate-media", help="Move inline base64 media and avatars into the media store")
+    subcommands.add_parser("ensure-indexes", help="Create every declared index")
+    repair_parser = subcommands.add_parser("repair-duplicates",
+                                           help="Resolve duplicates that stop unique indexes from building")
+    repair_parser.add_argument("--dry-run", action="store_true", help="only count the duplicates")
+    subcommands.add_parser("index-report", help="List declared indexes that are missing or unused")
+    subcommands.add_parser("build-recommendations", help="Rebuild similar posts and recommendations from likes")
+    subcommands.add_parser("reconcile-counters", help="Recompute like, comment and follow counters from their sources")
+    export_parser = subcommands.add_parser("export", help="Write a collection or a user's data as NDJSON")
+    export_target = export_parser.add_mutually_exclusive_group(required=True)
+    export_target.add_argument("--collection", choices=EXPORT_COLLECTIONS)
+    export_target.add_argument("--user", metavar="USERNAME")
+    export_parser.add_argument("--output", default="-", help="file to write (default: stdout)")
+    import_parser = subcommands.add_parser("import", help="Load an NDJSON export")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--mode", choices=IMPORT_MODES, default="insert")
+    args = parser.parse_args()
+    
+    async def read_chunks(path: str, chunk_size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+        with open(path, "rb") as f:
+            while chunk := await asyncio.to_thread(f.read, chunk_size):
+                yield chunk
+    
+    async def export_command():
+        if args.user:
+            user = await db.users.find_one({"username": args.user}, {"_id": 1})
+            if not user:
+                raise SystemExit(f"User not found: {args.user}")
+            plan = user_export_plan(user["_id"])
+        else:
+            plan = [(args.collection, {})]
+        output = sys.stdout.buffer if args.output == "-" else open(args.output, "wb")
+        try:
+            async for chunk in export_ndjson(plan):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+    
+    async def run_command():
+        try:
+            if args.command == "migrate-media":
+                print(await migrate_inline_media())
+            elif args.command == "ensure-indexes":
+                await ensure_indexes()
+            elif args.command == "repair-duplicates":
+                print(await repair_duplicates(args.dry_run))
+            elif args.command == "index-report":
+                for collection_name, status in (await index_report()).items():
+                    print(f"{collection_name}: missing={status['missing']} unused={status['unused']}")
+            elif args.command == "build-recommendations":
+                print(await build_recommendations())
+            elif args.command == "reconcile-counters":
+                print(await reconcile_counters())
+            elif args.command == "export":
+                await export_command()
+            elif args.command == "import":
+                print(await import_ndjson(read_chunks(args.path), args.mode))
+        finally:
+            client.close()
+    
+    asyncio.run(run_command())
\ No newline at end of file
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""
+Backend Benchmarks for i-Recommend App
+Measures Mongo round trips and latency of hot API code paths against a local MongoDB
+"""
+
+import asyncio
+import io
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import httpx
+import socketio
+from fastapi.encoders import jsonable_encoder
+from PIL import ExifTags, Image
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from pymongo import monitoring
+from pymongo.errors import BulkWriteError
+
+# Benchmarks run against a throwaway database on a local MongoDB
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ['DB_NAME'] = os.environ.get('BENCH_DB_NAME', f"irecommend_bench_{uuid.uuid4().hex[:8]}")
+# Benchmarks drive single clients far past the per-user limits, so lift them
+for limit in ('RATE_LIMIT_AUTH', 'RATE_LIMIT_WRITE', 'RATE_LIMIT_TOGGLE', 'RATE_LIMIT_DEFAULT'):
+    os.environ.setdefault(limit, '1000000/1')
+
+class CommandCounter(monitoring.CommandListener):
+    """Counts Mongo commands issued by the server module"""
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+# The listener must be registered before the server module creates its client
+counter = CommandCounter()
+monitoring.register(counter)
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+import server  # noqa: E402
+
+db = server.db
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+async def measure(label, fn, iterations):
+    """Run fn repeatedly and print round trips per call plus p50/p99 latency"""
+    await fn()  # warm up connections and caches
+    timings = []
+    counter.count = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    round_trips = counter.count / iterations
+    print(f"  {label:<28} round trips: {round_trips:>6.1f}   "
+          f"p50: {statistics.median(timings):>8.2f} ms   p99: {percentile(timings, 99):>8.2f} ms")
+
+async def seed_feed(num_users=50, num_rooms=100, num_posts=1000):
+    """Seed users, rooms and posts for feed benchmarks"""
+    now = datetime.now(timezone.utc)
+    users = [
+        {"_id": server.ObjectId(), "email": f"bench{i}@example.com", "username": f"bench{i}",
+         "password_hash": "", "name": f"Bench User {i}", "avatar": "", "bio": "", "external_link": "",
+         "follower_count": 0, "following_count": 0, "rooms": [], "is_active": True, "created_at": now}
+        for i in range(num_users)
+    ]
+    await db.users.insert_many(users)
+
+    rooms = [
+        {"_id": server.ObjectId(), "user_id": users[i % num_users]["_id"], "name": f"Room {i}",
+         "color": "#FF5733", "post_count": 0, "created_at": now}
+        for i in range(num_rooms)
+    ]
+    await db.rooms.insert_many(rooms)
+
+    posts = []
+    for i in range(num_posts):
+        room = rooms[i % num_rooms]
+        posts.append({
+            "user_id": room["user_id"], "room_id": room["_id"], "title": f"Post {i}",
+            "description": "Benchmark post", "media": "", "media_type": "image", "tags": ["bench"],
+            "external_link": "", "recommendation_type": "recommend", "action_type": "buy",
+            "like_count": 0, "comment_count": 0, "repost_count": 0,
+            "created_at": now - timedelta(seconds=i)
+        })
+    await db.posts.insert_many(posts)
+
+def get_posts(**params):
+    """Call the get_posts endpoint directly, past the response cache"""
+    server.response_cache.invalidate("posts")
+    request = Request({"type": "http", "method": "GET", "path": "/api/posts", "query_string": b"", "headers": []})
+    return server.get_posts(request, server.Response(), **params)
+
+async def legacy_get_posts(limit):
+    """The original get_posts loop: one users and one rooms find_one per post"""
+    posts = await db.posts.find({}).sort("created_at", -1).limit(limit).to_list(limit)
+    result = []
+    for post in posts:
+        user_info = await db.users.find_one({"_id": post["user_id"]})
+        room_info = await db.rooms.find_one({"_id": post["room_id"]})
+        result.append(server.serialize_post(post, user_info, room_info))
+    return result
+
+async def bench_feed_hydration(iterations=200):
+    """Compare per-post find_one hydration with batched $in hydration"""
+    print("\n📊 Feed hydration (GET /api/posts)")
+    for limit in (20, 50, 100):
+        await measure(f"before: limit={limit}", lambda: legacy_get_posts(limit), iterations)
+        await measure(f"after:  limit={limit}", lambda: get_posts(limit=limit), iterations)
+
+async def bench_sparse_fields(limit=200, iterations=100):
+    """Payload size and latency of a profile-grid listing, full vs fields= vs compact"""
+    print(f"\n📊 Sparse fields (GET /api/posts?username=bench0&limit={limit})")
+    grid_fields = "id,title,media_renditions,like_count,comment_count,user,room"
+    variants = [
+        ("full", {}),
+        ("fields", {"fields": grid_fields}),
+        ("fields + compact", {"fields": grid_fields, "compact": True}),
+    ]
+    for label, params in variants:
+        response = await get_posts(username="bench0", limit=limit, **params)
+        print(f"  {label:<28} payload: {len(response.body) / 1024:>7.1f} KiB")
+        await measure(label, lambda: get_posts(username="bench0", limit=limit, **params), iterations)
+
+async def bench_compression(limit=200, iterations=20):
+    """Ratio and throughput of each available encoding on a full GET /api/posts body"""
+    print(f"\n📊 Response compression (GET /api/posts?limit={limit})")
+    body = (await get_posts(limit=limit)).body
+    print(f"  identity                     size: {len(body) / 1024:>8.1f} KiB")
+    for encoding in server.COMPRESSORS:
+        cpu_seconds = 0.0
+        for _ in range(iterations):
+            compressed, spent = server.compress_body(encoding, body)
+            cpu_seconds += spent
+        print(f"  {encoding:<28} size: {len(compressed) / 1024:>8.1f} KiB   ratio: {len(body) / len(compressed):>5.1f}x   "
+              f"cpu: {cpu_seconds / iterations * 1000:>6.2f} ms   {len(body) * iterations / cpu_seconds / 1e6:>6.1f} MB/s")
+
+async def bench_like_toggle(iterations=500):
+    """Round trips and latency of like_post with write-behind counters, and the cost of a flush"""
+    print("\n📊 Like toggle (POST /api/posts/{id}/like)")
+    user = await db.users.find_one({})
+    post = await db.posts.find_one({})
+    principal = server.Principal(**user)
+    await measure("like/unlike", lambda: server.like_post(str(post["_id"]), current_user=principal), iterations)
+    counter.count = 0
+    await server.counters.flush()
+    print(f"  counter flush round trips: {counter.count}")
+
+async def bench_trending(num_likes=100_000, iterations=200):
+    """Compare sorting posts by like_count with serving the precomputed trending board"""
+    print(f"\n📊 Trending ({num_likes:,} likes)")
+    posts = await db.posts.find({}, {"_id": 1}).to_list(None)
+    now = datetime.now(timezone.utc)
+    await db.likes.insert_many([
+        {"user_id": server.ObjectId(), "post_id": posts[(i * i) % len(posts)]["_id"],
+         "created_at": now - timedelta(minutes=i % (3 * 24 * 60))}
+        for i in range(num_likes)
+    ], ordered=False)
+
+    start = time.perf_counter()
+    await server.trending.recompute()
+    print(f"  full recompute: {(time.perf_counter() - start) * 1000:.0f} ms "
+          f"({len(server.trending.boards)} boards)")
+
+    async def sort_by_like_count():
+        top = await db.posts.find({}).sort("like_count", -1).limit(20).to_list(20)
+        return await server.hydrate_posts(top)
+
+    await measure("before: sort by like_count", sort_by_like_count, iterations)
+    await measure("after:  trending board", lambda: server.get_trending_posts(limit=20), iterations)
+
+async def bench_recommendations(num_likes=1_000_000, num_users=50_000, num_posts=20_000, iterations=200):
+    """Time and measure a full recommendation build, then the similar/recommendations reads"""
+    print(f"\n📊 Recommendations ({num_likes:,} likes, {num_users:,} users, {num_posts:,} posts)")
+    import numpy as np
+
+    await seed_posts(num_posts)
+    post_ids = [post["_id"] for post in await db.posts.find({}, {"_id": 1}).limit(num_posts).to_list(num_posts)]
+    user_ids = [server.ObjectId() for _ in range(num_users)]
+    # Zipf-like post popularity; duplicate (user, post) pairs are dropped by the unique index
+    rng = np.random.default_rng(42)
+    popularity = 1 / np.arange(1, len(post_ids) + 1) ** 0.8
+    users = rng.integers(0, num_users, num_likes)
+    posts = rng.choice(len(post_ids), num_likes, p=popularity / popularity.sum())
+    await server.ensure_indexes()
+    now = datetime.now(timezone.utc)
+    for start in range(0, num_likes, 10000):
+        try:
+            await db.likes.insert_many([
+                {"user_id": user_ids[u], "post_id": post_ids[p], "created_at": now}
+                for u, p in zip(users[start:start + 10000], posts[start:start + 10000])
+            ], ordered=False)
+        except BulkWriteError:
+            pass
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    stats = await server.build_recommendations()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"  full build: {elapsed:.1f} s   peak memory: {peak / 2**20:.0f} MiB   {stats}")
+
+    start = time.perf_counter()
+    await server.refresh_post_neighbors(post_ids[0])
+    await server.refresh_user_recommendations(user_ids[0])
+    print(f"  incremental refresh (most liked post + one user): {(time.perf_counter() - start) * 1000:.0f} ms")
+
+    principal = server.Principal(_id=user_ids[0], email="", username="", name="")
+    await measure("similar posts", lambda: server.get_similar_posts(str(post_ids[0])), iterations)
+    await measure("recommendations", lambda: server.get_recommendations(current_user=principal), iterations)
+
+def legacy_serialize_post(post, user_info, room_info):
+    """The hand-built post shape that preceded the compiled shapes"""
+    return {
+        "id": str(post["_id"]), "title": post["title"], "description": post["description"],
+        "media": post["media"], "media_id": post.get("media_id", ""), "media_type": post["media_type"],
+        "tags": post["tags"], "external_link": post["external_link"],
+        "recommendation_type": post["recommendation_type"], "action_type": post["action_type"],
+        "like_count": post["like_count"], "comment_count": post["comment_count"],
+        "repost_count": post["repost_count"], "created_at": post["created_at"].isoformat(),
+        "user": {"id": str(user_info["_id"]), "name": user_info["name"], "username": user_info["username"],
+                 "avatar": user_info.get("avatar", "")},
+        "room": {"id": str(room_info["_id"]), "name": room_info["name"], "color": room_info["color"]}
+    }
+
+def time_call(fn, iterations):
+    """p50 of a synchronous call, in ms"""
+    fn()
+    timings = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+def bench_serialization(iterations=200):
+    """Serialize a page of posts: hand-built dicts + jsonable_encoder + json vs compiled shapes + orjson"""
+    print("\n📊 Post page serialization (CPU only)")
+    now = datetime.now(timezone.utc)
+    user = {"_id": server.ObjectId(), "name": "Bench User", "username": "bench", "avatar": "/api/media/" + "a" * 64}
+    room = {"_id": server.ObjectId(), "name": "Room", "color": "#FF5733"}
+    for label, media in (("media URL", "/api/media/" + "b" * 64), ("inline 64 KB media", "data:image/jpeg;base64," + "A" * 65536)):
+        for page_size in (20, 50, 100):
+            posts = [
+                {"_id": server.ObjectId(), "user_id": user["_id"], "room_id": room["_id"], "title": f"Post {i}",
+                 "description": "Benchmark post " * 10, "media": media, "media_id": "", "media_type": "image",
+                 "tags": ["bench", "tags"], "external_link": "", "recommendation_type": "recommend",
+                 "action_type": "buy", "like_count": i, "comment_count": 0, "repost_count": 0,
+                 "created_at": now - timedelta(seconds=i)}
+                for i in range(page_size)
+            ]
+            before = time_call(lambda: JSONResponse(jsonable_encoder(
+                [legacy_serialize_post(post, user, room) for post in posts])), iterations)
+            after = time_call(lambda: server.FastJSONResponse(
+                [server.serialize_post(post, user, room) for post in posts]), iterations)
+            print(f"  {label:<19} {page_size:>3} posts   before: {before:>7.3f} ms   after: {after:>7.3f} ms   "
+                  f"({before / after:.1f}x)")
+
+def synthetic_photo(width, height, image_format="JPEG"):
+    """A camera-sized image with gradients, sensor-like noise and EXIF orientation/location tags"""
+    gradient = Image.linear_gradient("L").resize((width, height))
+    noise = Image.effect_noise((width, height), 24)
+    image = Image.merge("RGB", (gradient, noise, gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT)))
+    exif = Image.Exif()
+    exif[ExifTags.Base.Orientation] = 6
+    exif[ExifTags.Base.Make] = "Benchmark"
+    exif[ExifTags.Base.GPSInfo] = {ExifTags.GPS.GPSLatitudeRef: "N", ExifTags.GPS.GPSLatitude: (51.0, 30.0, 0.0)}
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, exif=exif.tobytes(), **({"quality": 92} if image_format == "JPEG" else {}))
+    return buffer.getvalue()
+
+def render_job(data):
+    """Render one upload in a pool worker; returns peak RSS growth in MiB (exact for a fresh worker)"""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    server.render_image(data, server.MEDIA_RENDITIONS, server.MEDIA_IMAGE_FORMAT,
+                        server.MEDIA_IMAGE_QUALITY, server.MEDIA_MAX_PIXELS)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) / 1024
+
+def bench_image_pipeline(jobs_per_worker=8):
+    """Rendition throughput per core and peak memory per job for camera-sized uploads"""
+    workers = os.cpu_count() or 1
+    print(f"\n📊 Image renditions ({', '.join(f'{name} {width}px' for name, width in server.MEDIA_RENDITIONS.items())}, "
+          f"{server.MEDIA_IMAGE_FORMAT}, {workers} workers)")
+    for label, width, height, image_format in (("12 MP JPEG", 4032, 3024, "JPEG"), ("24 MP JPEG", 6000, 4000, "JPEG"),
+                                               ("12 MP PNG", 4032, 3024, "PNG")):
+        data = synthetic_photo(width, height, image_format)
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            peak = pool.submit(render_job, data).result()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(render_job, [data] * workers))  # warm up every worker
+            start = time.perf_counter()
+            list(pool.map(render_job, [data] * (workers * jobs_per_worker)))
+            elapsed = time.perf_counter() - start
+        renditions = {name: rendition for name, rendition, *_ in server.render_image(
+            data, server.MEDIA_RENDITIONS, server.MEDIA_IMAGE_FORMAT, server.MEDIA_IMAGE_QUALITY, server.MEDIA_MAX_PIXELS)}
+        print(f"  {label:<11} {workers * jobs_per_worker / elapsed / workers:>6.2f} images/s per core   "
+              f"peak: {peak:>5.0f} MiB/job   upload: {len(data) / 1024:>6.0f} KiB -> feed: "
+              f"{len(renditions['feed']) / 1024:>5.0f} KiB, thumb: {len(renditions['thumb']) / 1024:>4.0f} KiB")
+
+async def seed_posts(total_posts, batch_size=10000):
+    """Top the posts collection up to total_posts documents"""
+    existing = await db.posts.count_documents({})
+    room = await db.rooms.find_one({})
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    for offset in range(existing, total_posts, batch_size):
+        await db.posts.insert_many([
+            {
+                "user_id": room["user_id"], "room_id": room["_id"], "title": f"Post {i}",
+                "description": "Benchmark post", "media": "", "media_type": "image", "tags": [],
+                "external_link": "", "recommendation_type": "recommend", "action_type": "read",
+                "like_count": 0, "comment_count": 0, "repost_count": 0,
+                "created_at": start + timedelta(seconds=i)
+            }
+            for i in range(offset, min(offset + batch_size, total_posts))
+        ], ordered=False)
+
+async def bench_deep_pagination(total_posts=1_000_000, page=500, limit=20, iterations=50):
+    """Compare skip/limit and cursor paging for the first and a deep page"""
+    print(f"\n📊 Deep pagination (GET /api/posts, {total_posts:,} posts, page {page})")
+    await seed_posts(total_posts)
+    await server.ensure_indexes()
+
+    # Find the cursor that precedes the deep page once, outside the timed section
+    before_page = await db.posts.find({}).sort(server.POST_SORT).skip((page - 1) * limit - 1).limit(1).to_list(1)
+    deep_cursor = server.encode_cursor(before_page[0])
+
+    await measure("skip:   page 1", lambda: get_posts(limit=limit), iterations)
+    await measure(f"skip:   page {page}",
+                  lambda: get_posts(skip=(page - 1) * limit, limit=limit), iterations)
+    await measure(f"cursor: page {page}",
+                  lambda: get_posts(limit=limit, cursor=deep_cursor), iterations)
+
+async def bench_ndjson_round_trip(total_posts=1_000_000):
+    """Export the posts collection to an NDJSON file, then drop and re-import it"""
+    print(f"\n📊 NDJSON export/import ({total_posts:,} posts)")
+    await seed_posts(total_posts)
+    with tempfile.TemporaryFile() as dump:
+        start = time.perf_counter()
+        async for chunk in server.export_ndjson([("posts", {})]):
+            dump.write(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"  export  {total_posts / elapsed:>10,.0f} docs/s   {dump.tell() / 1024 / 1024:>7.1f} MiB in {elapsed:.1f}s")
+
+        await db.posts.drop()
+        dump.seek(0)
+
+        async def chunks():
+            while chunk := dump.read(1024 * 1024):
+                yield chunk
+
+        result = await server.import_ndjson(chunks())
+        print(f"  import  {result['documents_per_second']:>10,.0f} docs/s   "
+              f"{result['documents']:,} docs in {result['seconds']:.1f}s")
+    await server.ensure_indexes()
+
+async def probe_endpoint(http, path, samples, stop):
+    """Request path in a loop, recording latency in ms, until stop is set"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        await http.get(path)
+        samples.append((time.perf_counter() - start) * 1000)
+        await asyncio.sleep(0)  # let the workload and other probes run between requests
+
+async def probe_while(http, paths, workload, duration=1.0):
+    """Probe paths while workload runs (or for duration seconds when workload is None)"""
+    stop = asyncio.Event()
+    samples = {path: [] for path in paths}
+    probes = [asyncio.create_task(probe_endpoint(http, path, samples[path], stop)) for path in paths]
+    if workload is None:
+        await asyncio.sleep(duration)
+    else:
+        await workload
+    stop.set()
+    await asyncio.gather(*probes)
+    return samples
+
+async def bench_login_burst(concurrency=50):
+    """Measure /api/health and /api/posts latency while a burst of logins is in flight"""
+    print(f"\n📊 Login burst ({concurrency} concurrent logins, {server.PASSWORD_HASH_WORKERS} bcrypt workers)")
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as http:
+        credentials = {"email": "burst@example.com", "password": "burst-password"}
+        await http.post("/api/auth/register", json={**credentials, "username": "burst", "name": "Burst"})
+
+        paths = ["/api/health", "/api/posts"]
+        idle = await probe_while(http, paths, None)
+
+        async def login_burst():
+            start = time.perf_counter()
+            responses = await asyncio.gather(*[
+                http.post("/api/auth/login", json=credentials) for _ in range(concurrency)
+            ])
+            elapsed = time.perf_counter() - start
+            failures = sum(1 for response in responses if response.status_code != 200)
+            print(f"  logins: {concurrency / elapsed:.1f}/s, {failures} failed")
+
+        burst = await probe_while(http, paths, login_burst())
+
+    for path in paths:
+        for label, samples in (("idle", idle[path]), ("during burst", burst[path])):
+            if samples:
+                print(f"  {path:<14} {label:<13} p50: {statistics.median(samples):>8.2f} ms   "
+                      f"p99: {percentile(samples, 99):>8.2f} ms   max: {max(samples):>8.2f} ms")
+
+async def start_workers(manager, count, base_port):
+    """Start count uvicorn workers sharing the benchmark database and wait until they answer"""
+    env = {**os.environ, "SOCKETIO_MANAGER": manager}
+    workers = [
+        subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "server:asgi_app", "--port", str(base_port + i), "--log-level", "warning"],
+            cwd=BACKEND_DIR, env=env
+        )
+        for i in range(count)
+    ]
+    async with httpx.AsyncClient() as http:
+        for i in range(count):
+            for _ in range(100):
+                try:
+                    await http.get(f"http://127.0.0.1:{base_port + i}/api/health")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+    return workers
+
+async def bench_socket_fanout(manager, workers=3, events=50, base_port=18100):
+    """Emit from worker 0 and measure delivery latency to sockets held by every worker"""
+    print(f"\n📊 Socket.IO fan-out across {workers} workers (SOCKETIO_MANAGER={manager})")
+    user = await db.users.find_one({})
+    post = await db.posts.find_one({})
+    token = server.create_access_token(data={"sub": str(user["_id"])})
+    processes = await start_workers(manager, workers, base_port)
+    clients = []
+    try:
+        received = [dict() for _ in range(workers)]
+        for i in range(workers):
+            sio_client = socketio.AsyncClient()
+
+            def on_comment(data, inbox=received[i]):
+                inbox[data["comment_id"]] = time.perf_counter()
+
+            sio_client.on("comment_created", on_comment)
+            await sio_client.connect(f"http://127.0.0.1:{base_port + i}", auth={"token": token}, transports=["websocket"])
+            await sio_client.call("subscribe", {"post_id": str(post["_id"])})
+            clients.append(sio_client)
+
+        sent = {}
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{base_port}") as http:
+            for n in range(events):
+                start = time.perf_counter()
+                response = await http.post(f"/api/posts/{post['_id']}/comments",
+                                           json={"post_id": str(post["_id"]), "content": f"fan-out {n}"},
+                                           headers={"Authorization": f"Bearer {token}"})
+                sent[response.json()["id"]] = start
+                await asyncio.sleep(0.05)
+        await asyncio.sleep(1)
+
+        for i, inbox in enumerate(received):
+            latencies = [(inbox[cid] - start) * 1000 for cid, start in sent.items() if cid in inbox]
+            line = f"  worker {i}: delivered {len(latencies)}/{len(sent)}"
+            if latencies:
+                line += f"   p50: {statistics.median(latencies):>8.2f} ms   p99: {percentile(latencies, 99):>8.2f} ms"
+            print(line)
+    finally:
+        for sio_client in clients:
+            await sio_client.disconnect()
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+async def main():
+    """Run all benchmarks"""
+    print("🚀 Starting i-Recommend Backend Benchmarks")
+    print(f"MongoDB: {os.environ['MONGO_URL']}  Database: {os.environ['DB_NAME']}")
+
+    bench_serialization()
+    bench_image_pipeline()
+    try:
+        await seed_feed()
+        await bench_feed_hydration()
+        await bench_sparse_fields()
+        await bench_compression()
+        await bench_like_toggle()
+        await bench_trending()
+        await bench_recommendations(int(os.environ.get('BENCH_RECOMMENDATION_LIKES', 1_000_000)))
+        await bench_login_burst()
+        await bench_socket_fanout("memory")
+        await bench_socket_fanout("mongo")
+        await bench_deep_pagination(int(os.environ.get('BENCH_PAGINATION_POSTS', 1_000_000)))
+        await bench_ndjson_round_trip(int(os.environ.get('BENCH_PAGINATION_POSTS', 1_000_000)))
+    finally:
+        await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
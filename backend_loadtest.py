@@ -0,0 +1,452 @@
+#!/usr/bin/env python3
+"""
+Load Tests for i-Recommend App
+Seeds a throwaway database at a configurable scale, drives the ASGI app with concurrent
+clients and reports throughput, p50/p95/p99 latency and Mongo round trips per endpoint,
+plus Socket.IO fan-out latency. With --ci, results are checked against
+loadtest_thresholds.json and any regression exits non-zero.
+
+Usage:
+    python backend_loadtest.py                       # local MongoDB at MONGO_URL
+    python backend_loadtest.py --mongomock           # in-memory stand-in (no round-trip counts)
+    python backend_loadtest.py --ci --json results.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from collections import Counter, defaultdict
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+import httpx
+import socketio
+import uvicorn
+
+BACKEND_DIR = Path(__file__).parent / "backend"
+DEFAULT_THRESHOLDS = Path(__file__).parent / "loadtest_thresholds.json"
+
+TAGS = ["books", "movies", "music", "food", "travel", "games", "design", "tech"]
+WORDS = ["classic", "hidden", "favourite", "weekend", "honest", "quick", "essential", "underrated"]
+ACTION_TYPES = ["buy", "read", "watch", "listen", "visit"]
+
+# The server module is imported by main() once the environment is configured
+server = None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the i-Recommend API")
+    parser.add_argument("--mongomock", action="store_true",
+                        help="use mongomock-motor instead of MONGO_URL (Mongo round trips are not counted)")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--likes", type=int, default=50000)
+    parser.add_argument("--follows", type=int, default=10000)
+    parser.add_argument("--comments", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50, help="concurrent HTTP clients")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds of HTTP load")
+    parser.add_argument("--sockets", type=int, default=100, help="Socket.IO clients for the fan-out run (0 to skip)")
+    parser.add_argument("--events", type=int, default=50, help="events emitted during the fan-out run")
+    parser.add_argument("--socket-port", type=int, default=18200)
+    parser.add_argument("--no-response-cache", action="store_true",
+                        help="disable the response cache so every request reaches the handler")
+    parser.add_argument("--ci", action="store_true",
+                        help="check results against --thresholds and exit 1 on regressions (implies --no-response-cache)")
+    parser.add_argument("--thresholds", type=Path, default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--json", type=Path, help="write results to this file")
+    parser.add_argument("--seed", type=int, default=42)
+    return parser.parse_args(argv)
+
+def configure_environment(args):
+    """Environment for the server module; must run before it is imported"""
+    os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+    os.environ['DB_NAME'] = os.environ.get('LOADTEST_DB_NAME', f"irecommend_loadtest_{uuid.uuid4().hex[:8]}")
+    # Many simulated users share one client address, so lift the per-client limits
+    for limit in ('RATE_LIMIT_AUTH', 'RATE_LIMIT_WRITE', 'RATE_LIMIT_TOGGLE', 'RATE_LIMIT_DEFAULT'):
+        os.environ.setdefault(limit, '1000000/1')
+    os.environ.setdefault('ADMISSION_MAX_CONCURRENT', str(max(512, args.concurrency * 2)))
+    if args.ci or args.no_response_cache:
+        # Entries expire as soon as they are stored, so thresholds measure the handlers
+        os.environ['RESPONSE_CACHE_TTL'] = '0'
+    if args.mongomock:
+        # $text queries are not supported by mongomock
+        os.environ['SEARCH_BACKEND'] = 'memory'
+
+def percentile(samples, pct):
+    """Return the pct-th percentile of a list of samples"""
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+def summarize(samples):
+    return {
+        "p50_ms": round(statistics.median(samples), 2),
+        "p95_ms": round(percentile(samples, 95), 2),
+        "p99_ms": round(percentile(samples, 99), 2),
+    }
+
+# Seeding
+
+async def seed(args, rng):
+    """Insert users, rooms, posts, follows, likes and comments with consistent counters"""
+    db = server.db
+    now = datetime.now(timezone.utc)
+    started = time.perf_counter()
+
+    users = [
+        {"_id": server.ObjectId(), "email": f"load{i}@example.com", "username": f"load{i}",
+         "password_hash": "", "name": f"Load User {i}", "avatar": "", "bio": "", "external_link": "",
+         "follower_count": 0, "following_count": 0, "rooms": [], "is_active": True,
+         "created_at": now - timedelta(days=30)}
+        for i in range(args.users)
+    ]
+    rooms = [
+        {"_id": server.ObjectId(), "user_id": users[i % args.users]["_id"], "name": f"{rng.choice(WORDS).title()} room {i}",
+         "color": "#FF5733", "post_count": 0, "created_at": now - timedelta(days=30)}
+        for i in range(args.rooms)
+    ]
+    for i, room in enumerate(rooms):
+        users[i % args.users]["rooms"].append(room["_id"])
+
+    posts = []
+    room_post_counts = Counter()
+    for i in range(args.posts):
+        room = rng.choice(rooms)
+        room_post_counts[room["_id"]] += 1
+        posts.append({
+            "_id": server.ObjectId(), "user_id": room["user_id"], "room_id": room["_id"],
+            "title": f"{rng.choice(WORDS).title()} {rng.choice(TAGS)} pick {i}",
+            "description": f"A {rng.choice(WORDS)} recommendation for anyone into {rng.choice(TAGS)}",
+            "media": "", "media_id": "", "media_type": "image", "tags": rng.sample(TAGS, 2),
+            "external_link": "", "recommendation_type": "recommend", "action_type": rng.choice(ACTION_TYPES),
+            "like_count": 0, "comment_count": 0, "repost_count": 0,
+            # Spread over a week so trending and cursor paging see a realistic range
+            "created_at": now - timedelta(seconds=rng.randrange(7 * 24 * 3600))
+        })
+    for room in rooms:
+        room["post_count"] = room_post_counts[room["_id"]]
+
+    # Follows and likes are skewed towards a few popular accounts and posts
+    user_weights = [1 / (i + 1) ** 0.8 for i in range(args.users)]
+    post_weights = [1 / (i + 1) ** 0.8 for i in range(args.posts)]
+    follows = set()
+    while len(follows) < min(args.follows, args.users * (args.users - 1)):
+        follower = rng.randrange(args.users)
+        following = rng.choices(range(args.users), user_weights)[0]
+        if follower != following:
+            follows.add((follower, following))
+    likes = set()
+    while len(likes) < min(args.likes, args.users * args.posts):
+        likes.add((rng.randrange(args.users), rng.choices(range(args.posts), post_weights)[0]))
+
+    follower_counts, following_counts = Counter(), Counter()
+    for follower, following in follows:
+        following_counts[follower] += 1
+        follower_counts[following] += 1
+    for i, user in enumerate(users):
+        user["follower_count"] = follower_counts[i]
+        user["following_count"] = following_counts[i]
+    like_counts = Counter(post for _, post in likes)
+    comments = []
+    for _ in range(args.comments):
+        post = rng.choices(range(args.posts), post_weights)[0]
+        comments.append({
+            "user_id": users[rng.randrange(args.users)]["_id"], "post_id": posts[post]["_id"],
+            "content": f"{rng.choice(WORDS).title()} pick!",
+            "created_at": posts[post]["created_at"] + timedelta(minutes=rng.randrange(1, 600))
+        })
+    comment_counts = Counter(comment["post_id"] for comment in comments)
+    for i, post in enumerate(posts):
+        post["like_count"] = like_counts[i]
+        post["comment_count"] = comment_counts[post["_id"]]
+
+    async def insert(collection, documents, batch_size=10000):
+        for start in range(0, len(documents), batch_size):
+            await collection.insert_many(documents[start:start + batch_size], ordered=False)
+
+    await insert(db.users, users)
+    await insert(db.rooms, rooms)
+    await insert(db.posts, posts)
+    await insert(db.follows, [
+        {"follower_id": users[follower]["_id"], "following_id": users[following]["_id"], "created_at": now}
+        for follower, following in follows
+    ])
+    await insert(db.likes, [
+        {"user_id": users[user]["_id"], "post_id": posts[post]["_id"],
+         "created_at": posts[post]["created_at"] + timedelta(minutes=rng.randrange(1, 600))}
+        for user, post in likes
+    ])
+    await insert(db.comments, comments)
+
+    print(f"  seeded {len(users):,} users, {len(rooms):,} rooms, {len(posts):,} posts, {len(follows):,} follows, "
+          f"{len(likes):,} likes, {len(comments):,} comments in {time.perf_counter() - started:.1f} s")
+    return users, rooms, posts
+
+# HTTP load
+
+class LoadContext:
+    """Seeded entities and tokens the request builders pick from"""
+    def __init__(self, users, posts, rng):
+        self.users = users
+        self.posts = posts
+        self.rng = rng
+        self.tokens = {user["_id"]: server.create_access_token(data={"sub": str(user["_id"])}) for user in users}
+        # Reads follow the same skew as the seeded likes
+        self.post_weights = [1 / (i + 1) ** 0.8 for i in range(len(posts))]
+
+    def user(self):
+        return self.rng.choice(self.users)
+
+    def post(self):
+        return self.rng.choices(self.posts, self.post_weights)[0]
+
+    def auth(self):
+        return {"Authorization": f"Bearer {self.tokens[self.user()['_id']]}"}
+
+# (endpoint as "METHOD route template", weight, request builder); the route template
+# matches the label MetricsMiddleware records, which is where round trips come from
+ENDPOINTS = [
+    ("GET /api/posts", 25, lambda ctx: ("GET", "/api/posts", {"params": {"limit": 20}})),
+    ("GET /api/posts/{post_id}", 20, lambda ctx: ("GET", f"/api/posts/{ctx.post()['_id']}", {})),
+    ("GET /api/users/{username}", 10, lambda ctx: ("GET", f"/api/users/{ctx.user()['username']}", {})),
+    ("GET /api/users/{username}/rooms", 5, lambda ctx: ("GET", f"/api/users/{ctx.user()['username']}/rooms", {})),
+    ("GET /api/posts/{post_id}/comments", 5, lambda ctx: ("GET", f"/api/posts/{ctx.post()['_id']}/comments", {})),
+    ("GET /api/posts/trending", 5, lambda ctx: ("GET", "/api/posts/trending", {})),
+    ("GET /api/search", 5, lambda ctx: ("GET", "/api/search", {"params": {"q": ctx.rng.choice(TAGS + WORDS)}})),
+    ("GET /api/feed/home", 15, lambda ctx: ("GET", "/api/feed/home", {"headers": ctx.auth()})),
+    ("POST /api/posts/{post_id}/like", 10, lambda ctx: ("POST", f"/api/posts/{ctx.post()['_id']}/like",
+                                                        {"headers": ctx.auth()})),
+]
+
+def round_trip_snapshot():
+    return {key: (hist.sum, hist.count) for key, hist in server.metrics.commands_per_request.items()}
+
+async def run_http_load(ctx, args):
+    """Run a weighted endpoint mix from args.concurrency clients for args.duration seconds"""
+    names = [name for name, _, _ in ENDPOINTS]
+    weights = [weight for _, weight, _ in ENDPOINTS]
+    builders = {name: build for name, _, build in ENDPOINTS}
+    latencies = defaultdict(list)
+    errors = Counter()
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", timeout=60) as http:
+        # Warm up connection pools, the principal cache and every code path once
+        for name in names:
+            method, path, kwargs = builders[name](ctx)
+            await http.request(method, path, **kwargs)
+
+        before = round_trip_snapshot()
+        deadline = time.perf_counter() + args.duration
+
+        async def client():
+            while time.perf_counter() < deadline:
+                name = ctx.rng.choices(names, weights)[0]
+                method, path, kwargs = builders[name](ctx)
+                start = time.perf_counter()
+                try:
+                    response = await http.request(method, path, **kwargs)
+                    if response.status_code >= 400:
+                        errors[name] += 1
+                except httpx.HTTPError:
+                    errors[name] += 1
+                latencies[name].append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[client() for _ in range(args.concurrency)])
+        elapsed = time.perf_counter() - started
+        after = round_trip_snapshot()
+
+    results = {}
+    for name in names:
+        samples = latencies[name]
+        if not samples:
+            continue
+        method, route = name.split(" ", 1)
+        total, count = after.get((method, route), (0, 0))
+        total_before, count_before = before.get((method, route), (0, 0))
+        results[name] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / elapsed, 1),
+            **summarize(samples),
+            "error_rate": round(errors[name] / len(samples), 4),
+            # mongomock does not emit command events, so there is nothing to count
+            "round_trips": None if args.mongomock or count == count_before
+            else round((total - total_before) / (count - count_before), 2),
+        }
+    total_requests = sum(len(samples) for samples in latencies.values())
+    return {"endpoints": results, "requests": total_requests, "rps": round(total_requests / elapsed, 1)}
+
+def print_http_results(http_results, args):
+    print(f"\n📊 HTTP load ({args.concurrency} clients, {args.duration:.0f} s): "
+          f"{http_results['requests']:,} requests, {http_results['rps']:,.1f} req/s")
+    print(f"  {'endpoint':<36} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'errors':>7} {'round trips':>12}")
+    for name, result in http_results["endpoints"].items():
+        round_trips = "n/a" if result["round_trips"] is None else f"{result['round_trips']:.2f}"
+        print(f"  {name:<36} {result['requests']:>9,} {result['rps']:>8.1f} {result['p50_ms']:>8.2f} "
+              f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['error_rate']:>7.1%} {round_trips:>12}")
+
+# Socket.IO fan-out
+
+async def run_socket_fanout(ctx, args):
+    """Subscribe args.sockets clients to one post and time comment_created delivery to each"""
+    config = uvicorn.Config(server.asgi_app, host="127.0.0.1", port=args.socket_port,
+                            log_level="warning", lifespan="off")
+    socket_server = uvicorn.Server(config)
+    serve_task = asyncio.create_task(socket_server.serve())
+    while not socket_server.started:
+        await asyncio.sleep(0.05)
+
+    post = ctx.posts[0]
+    received = defaultdict(list)
+    clients = []
+    try:
+        for i in range(args.sockets):
+            sio_client = socketio.AsyncClient()
+
+            def on_comment(data):
+                received[data["comment_id"]].append(time.perf_counter())
+
+            sio_client.on("comment_created", on_comment)
+            await sio_client.connect(f"http://127.0.0.1:{args.socket_port}",
+                                     auth={"token": ctx.tokens[ctx.users[i % len(ctx.users)]["_id"]]},
+                                     transports=["websocket"])
+            await sio_client.call("subscribe", {"post_id": str(post["_id"])})
+            clients.append(sio_client)
+
+        sent = {}
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest") as http:
+            for n in range(args.events):
+                start = time.perf_counter()
+                response = await http.post(f"/api/posts/{post['_id']}/comments",
+                                           json={"post_id": str(post["_id"]), "content": f"fan-out {n}"},
+                                           headers=ctx.auth())
+                sent[response.json()["id"]] = start
+                await asyncio.sleep(0.05)
+        await asyncio.sleep(1)
+    finally:
+        for sio_client in clients:
+            await sio_client.disconnect()
+        socket_server.should_exit = True
+        await serve_task
+
+    latencies = [(at - sent[comment_id]) * 1000 for comment_id, times in received.items() if comment_id in sent
+                 for at in times]
+    expected = len(sent) * args.sockets
+    result = {"sockets": args.sockets, "events": len(sent), "delivered": len(latencies),
+              "delivery_ratio": round(len(latencies) / expected, 4) if expected else 0.0}
+    if latencies:
+        result.update(summarize(latencies))
+    return result
+
+def print_socket_results(socket_results):
+    line = (f"  delivered {socket_results['delivered']:,}/{socket_results['events'] * socket_results['sockets']:,} "
+            f"({socket_results['delivery_ratio']:.1%})")
+    if socket_results["delivered"]:
+        line += (f"   p50: {socket_results['p50_ms']:>8.2f} ms   p95: {socket_results['p95_ms']:>8.2f} ms"
+                 f"   p99: {socket_results['p99_ms']:>8.2f} ms")
+    print(f"\n📊 Socket.IO fan-out ({socket_results['sockets']} subscribers, {socket_results['events']} events)")
+    print(line)
+
+# CI thresholds
+
+def check_thresholds(results, thresholds):
+    """Return a message for every threshold the results break"""
+    failures = []
+    for name, limits in thresholds.get("endpoints", {}).items():
+        result = results["http"]["endpoints"].get(name)
+        if result is None:
+            failures.append(f"{name}: no requests were made")
+            continue
+        if "max_round_trips" in limits and result["round_trips"] is not None \
+                and result["round_trips"] > limits["max_round_trips"]:
+            failures.append(f"{name}: {result['round_trips']} Mongo round trips per request "
+                            f"(max {limits['max_round_trips']})")
+        if "max_p95_ms" in limits and result["p95_ms"] > limits["max_p95_ms"]:
+            failures.append(f"{name}: p95 {result['p95_ms']} ms (max {limits['max_p95_ms']} ms)")
+        if "max_error_rate" in limits and result["error_rate"] > limits["max_error_rate"]:
+            failures.append(f"{name}: error rate {result['error_rate']:.2%} (max {limits['max_error_rate']:.2%})")
+    fanout_limits = thresholds.get("socket_fanout", {})
+    fanout = results.get("socket_fanout")
+    if fanout_limits and fanout:
+        if "min_delivery_ratio" in fanout_limits and fanout["delivery_ratio"] < fanout_limits["min_delivery_ratio"]:
+            failures.append(f"socket fan-out: delivered {fanout['delivery_ratio']:.2%} "
+                            f"(min {fanout_limits['min_delivery_ratio']:.2%})")
+        if "max_p95_ms" in fanout_limits and fanout.get("p95_ms", float("inf")) > fanout_limits["max_p95_ms"]:
+            failures.append(f"socket fan-out: p95 {fanout.get('p95_ms')} ms (max {fanout_limits['max_p95_ms']} ms)")
+    return failures
+
+async def run(args):
+    rng = random.Random(args.seed)
+    if args.mongomock:
+        from mongomock_motor import AsyncMongoMockClient
+        server.client = AsyncMongoMockClient(tz_aware=True)
+        server.db = server.client[os.environ['DB_NAME']]
+    else:
+        await server.ensure_indexes()
+
+    print("🚀 Starting i-Recommend Load Test")
+    print(f"MongoDB: {'mongomock' if args.mongomock else os.environ['MONGO_URL']}  Database: {os.environ['DB_NAME']}  "
+          f"Response cache: {'off' if os.environ.get('RESPONSE_CACHE_TTL') == '0' else 'on'}")
+    try:
+        users, rooms, posts = await seed(args, rng)
+        await server.trending.recompute()
+        await server.search_backend.sync()
+        ctx = LoadContext(users, posts, rng)
+
+        flush_task = asyncio.create_task(server.counters.flush_forever(server.COUNTER_FLUSH_SECONDS))
+        try:
+            results = {"http": await run_http_load(ctx, args)}
+        finally:
+            flush_task.cancel()
+            await server.counters.flush()
+        print_http_results(results["http"], args)
+
+        if args.sockets:
+            results["socket_fanout"] = await run_socket_fanout(ctx, args)
+            print_socket_results(results["socket_fanout"])
+    finally:
+        if not args.mongomock:
+            await server.client.drop_database(os.environ['DB_NAME'])
+        server.client.close()
+    return results
+
+def main(argv=None):
+    global server
+    args = parse_args(argv)
+    configure_environment(args)
+    sys.path.insert(0, str(BACKEND_DIR))
+    import server as server_module
+    server = server_module
+    # Per-request and per-emit INFO lines would dominate the run; keep warnings and slow requests
+    logging.getLogger().setLevel(logging.WARNING)
+    server.sio.logger.setLevel(logging.WARNING)
+
+    results = asyncio.run(run(args))
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+
+    if args.ci:
+        thresholds = json.loads(args.thresholds.read_text())
+        failures = check_thresholds(results, thresholds)
+        if args.mongomock:
+            print("\nℹ️ Round-trip thresholds are skipped under mongomock")
+        if failures:
+            print(f"\n❌ {len(failures)} threshold(s) exceeded:")
+            for failure in failures:
+                print(f"  - {failure}")
+            return 1
+        print("\n✅ All thresholds met")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
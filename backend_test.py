@@ -100,6 +100,27 @@ def test_health_endpoints():
     except Exception as e:
         results.log_failure("GET /api/health", f"Request failed: {str(e)}")
 
+    # Test liveness endpoint
+    try:
+        response = requests.get(f"{API_BASE}/health/live", timeout=10)
+        if response.status_code == 200 and response.json().get("status") == "ok":
+            results.log_success("GET /api/health/live - Liveness check")
+        else:
+            results.log_failure("GET /api/health/live", f"Status {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/health/live", f"Request failed: {str(e)}")
+
+    # Test readiness endpoint
+    try:
+        response = requests.get(f"{API_BASE}/health/ready", timeout=10)
+        data = response.json()
+        if response.status_code == 200 and data.get("status") in ("ok", "degraded") and "mongo" in data.get("checks", {}):
+            results.log_success(f"GET /api/health/ready - Readiness check ({data['status']})")
+        else:
+            results.log_failure("GET /api/health/ready", f"Status {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/health/ready", f"Request failed: {str(e)}")
+
 def test_auth_endpoints():
     """Test authentication endpoints"""
     print("\n🔍 Testing Authentication Endpoints...")
@@ -478,6 +499,221 @@ def test_follow_system():
     except Exception as e:
         results.log_failure("GET /api/users/{username}/following-status", f"Request failed: {str(e)}")
 
+def test_home_feed():
+    """Test home timeline endpoint"""
+    print("\n🔍 Testing Home Feed...")
+    
+    # Test getting home feed without authentication (should fail)
+    try:
+        response = requests.get(f"{API_BASE}/feed/home", timeout=10)
+        if response.status_code == 401:
+            results.log_success("GET /api/feed/home - Properly rejects unauthenticated requests")
+        else:
+            results.log_failure("GET /api/feed/home", f"Expected 401, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/feed/home", f"Request failed: {str(e)}")
+
+def test_batch_endpoints():
+    """Test batch post and status endpoints"""
+    print("\n🔍 Testing Batch Endpoints...")
+    
+    # Test fetching posts by ID without authentication
+    try:
+        response = requests.post(f"{API_BASE}/posts/batch", json={"post_ids": ["0" * 24]}, timeout=10)
+        if response.status_code == 200 and response.json() == []:
+            results.log_success("POST /api/posts/batch - Leaves out posts that do not exist")
+        else:
+            results.log_failure("POST /api/posts/batch", f"Expected 200 [], got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("POST /api/posts/batch", f"Request failed: {str(e)}")
+    
+    # Test viewer state without authentication (should fail)
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"include": "viewer_state"}, timeout=10)
+        if response.status_code == 401:
+            results.log_success("GET /api/posts?include=viewer_state - Properly rejects unauthenticated requests")
+        else:
+            results.log_failure("GET /api/posts?include=viewer_state", f"Expected 401, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/posts?include=viewer_state", f"Request failed: {str(e)}")
+    
+    # Test batch status endpoints without authentication (should fail)
+    for path, body in [("posts/liked-status", {"post_ids": []}), ("users/following-status", {"usernames": []})]:
+        try:
+            response = requests.post(f"{API_BASE}/{path}", json=body, timeout=10)
+            if response.status_code in [401, 403]:
+                results.log_success(f"POST /api/{path} - Properly rejects unauthenticated requests")
+            else:
+                results.log_failure(f"POST /api/{path}", f"Expected 401/403, got {response.status_code}: {response.text}")
+        except Exception as e:
+            results.log_failure(f"POST /api/{path}", f"Request failed: {str(e)}")
+
+def test_sparse_fields():
+    """Test field selection and compact post listings"""
+    print("\n🔍 Testing Sparse Fields...")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"limit": 5, "fields": "id,title,user.username"}, timeout=10)
+        posts = response.json() if response.status_code == 200 else None
+        if posts is not None and all(set(post) <= {"id", "title", "user"} for post in posts):
+            results.log_success("GET /api/posts?fields= - Returns only the selected fields")
+        else:
+            results.log_failure("GET /api/posts?fields=", f"Unexpected response {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/posts?fields=", f"Request failed: {str(e)}")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"limit": 5, "compact": "true"}, timeout=10)
+        if response.status_code == 200 and {"posts", "users", "rooms"} <= set(response.json()):
+            results.log_success("GET /api/posts?compact=true - Returns author and room side tables")
+        else:
+            results.log_failure("GET /api/posts?compact=true", f"Unexpected response {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/posts?compact=true", f"Request failed: {str(e)}")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"fields": "id,password_hash"}, timeout=10)
+        if response.status_code == 400:
+            results.log_success("GET /api/posts?fields= - Rejects unknown fields")
+        else:
+            results.log_failure("GET /api/posts?fields= (unknown)", f"Expected 400, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/posts?fields= (unknown)", f"Request failed: {str(e)}")
+
+def test_messaging_endpoints():
+    """Test direct messaging endpoints"""
+    print("\n🔍 Testing Direct Messaging...")
+    
+    # Test messaging endpoints without authentication (should fail)
+    endpoints = [
+        ("POST", "/messages", {"receiver_id": "507f1f77bcf86cd799439011", "content": "Hello"}),
+        ("GET", "/conversations", None),
+        ("GET", "/conversations/507f1f77bcf86cd799439011/messages", None),
+        ("POST", "/conversations/507f1f77bcf86cd799439011/read", None),
+    ]
+    for method, path, payload in endpoints:
+        try:
+            response = requests.request(method, f"{API_BASE}{path}", json=payload, timeout=10)
+            if response.status_code == 401:
+                results.log_success(f"{method} /api{path} - Properly rejects unauthenticated requests")
+            else:
+                results.log_failure(f"{method} /api{path}", f"Expected 401, got {response.status_code}: {response.text}")
+        except Exception as e:
+            results.log_failure(f"{method} /api{path}", f"Request failed: {str(e)}")
+
+def test_search_endpoints():
+    """Test search and autocomplete endpoints"""
+    print("\n🔍 Testing Search...")
+    
+    try:
+        response = requests.get(f"{API_BASE}/search", params={"q": "test"}, timeout=10)
+        if response.status_code == 200 and {"posts", "users", "rooms"} <= set(response.json()):
+            results.log_success("GET /api/search - Returns posts, users and rooms")
+        else:
+            results.log_failure("GET /api/search", f"Unexpected response {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/search", f"Request failed: {str(e)}")
+    
+    try:
+        response = requests.get(f"{API_BASE}/search", params={"q": "test", "type": "invalid"}, timeout=10)
+        if response.status_code == 400:
+            results.log_success("GET /api/search - Rejects unknown result types")
+        else:
+            results.log_failure("GET /api/search (invalid type)", f"Expected 400, got {response.status_code}")
+    except Exception as e:
+        results.log_failure("GET /api/search (invalid type)", f"Request failed: {str(e)}")
+    
+    try:
+        response = requests.get(f"{API_BASE}/search/autocomplete", params={"q": "te"}, timeout=10)
+        if response.status_code == 200 and isinstance(response.json(), list):
+            results.log_success("GET /api/search/autocomplete - Returns suggestions")
+        else:
+            results.log_failure("GET /api/search/autocomplete", f"Unexpected response {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/search/autocomplete", f"Request failed: {str(e)}")
+
+def test_conditional_requests():
+    """Test ETag revalidation on cached public endpoints"""
+    print("\n🏷️ Testing Conditional Requests...")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"limit": 5}, timeout=10)
+        etag = response.headers.get("ETag")
+        if response.status_code == 200 and etag:
+            results.log_success("GET /api/posts - Returns an ETag")
+            revalidated = requests.get(f"{API_BASE}/posts", params={"limit": 5},
+                                       headers={"If-None-Match": etag}, timeout=10)
+            if revalidated.status_code == 304:
+                results.log_success("GET /api/posts - Answers a matching If-None-Match with 304")
+            else:
+                results.log_failure("GET /api/posts (If-None-Match)", f"Expected 304, got {revalidated.status_code}")
+        else:
+            results.log_failure("GET /api/posts (ETag)", f"Unexpected response {response.status_code}: {response.headers}")
+    except Exception as e:
+        results.log_failure("GET /api/posts (ETag)", f"Request failed: {str(e)}")
+
+def test_response_compression():
+    """Test Accept-Encoding negotiation on JSON responses"""
+    print("\n🗜️ Testing Response Compression...")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"limit": 50},
+                                headers={"Accept-Encoding": "gzip"}, timeout=10)
+        encoding = response.headers.get("Content-Encoding")
+        if response.status_code == 200 and "accept-encoding" in response.headers.get("Vary", "").lower():
+            response.json()
+            results.log_success(f"GET /api/posts - Varies on Accept-Encoding (sent {encoding or 'identity'})")
+        else:
+            results.log_failure("GET /api/posts (compression)", f"Unexpected response {response.status_code}: {response.headers}")
+    except Exception as e:
+        results.log_failure("GET /api/posts (compression)", f"Request failed: {str(e)}")
+    
+    try:
+        response = requests.get(f"{API_BASE}/posts", params={"limit": 50},
+                                headers={"Accept-Encoding": "identity"}, timeout=10)
+        if response.status_code == 200 and "Content-Encoding" not in response.headers:
+            results.log_success("GET /api/posts - Sends identity when compression is not accepted")
+        else:
+            results.log_failure("GET /api/posts (identity)", f"Unexpected response {response.status_code}: {response.headers}")
+    except Exception as e:
+        results.log_failure("GET /api/posts (identity)", f"Request failed: {str(e)}")
+
+def test_media_endpoints():
+    """Test media upload and streaming endpoints"""
+    print("\n🔍 Testing Media Endpoints...")
+    
+    # Test uploading media without authentication (should fail)
+    try:
+        response = requests.post(f"{API_BASE}/media", 
+                               files={"file": ("test.png", b"\x89PNG\r\n\x1a\n", "image/png")}, 
+                               timeout=10)
+        if response.status_code == 401:
+            results.log_success("POST /api/media - Properly rejects unauthenticated requests")
+        else:
+            results.log_failure("POST /api/media", f"Expected 401, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("POST /api/media", f"Request failed: {str(e)}")
+
+    # Test getting media with invalid ID
+    try:
+        response = requests.get(f"{API_BASE}/media/invalid_id", timeout=10)
+        if response.status_code == 400:
+            results.log_success("GET /api/media/{media_id} - Properly handles invalid media ID")
+        else:
+            results.log_failure("GET /api/media/{media_id}", f"Expected 400, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/media/{media_id}", f"Request failed: {str(e)}")
+
+    # Test getting non-existent media
+    try:
+        response = requests.get(f"{API_BASE}/media/{'0' * 64}", timeout=10)
+        if response.status_code == 404:
+            results.log_success("GET /api/media/{media_id} - Properly handles non-existent media")
+        else:
+            results.log_failure("GET /api/media/{media_id}", f"Expected 404, got {response.status_code}: {response.text}")
+    except Exception as e:
+        results.log_failure("GET /api/media/{media_id}", f"Request failed: {str(e)}")
+
 def test_data_validation():
     """Test data validation and edge cases for Phase 2 features"""
     print("\n🔍 Testing Data Validation & Edge Cases...")
@@ -587,6 +823,14 @@ def main():
     test_post_management()
     test_social_features()
     test_follow_system()
+    test_home_feed()
+    test_batch_endpoints()
+    test_sparse_fields()
+    test_messaging_endpoints()
+    test_search_endpoints()
+    test_conditional_requests()
+    test_response_compression()
+    test_media_endpoints()
     test_data_validation()
     
     test_api_structure()
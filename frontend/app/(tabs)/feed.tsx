@@ -44,6 +44,11 @@ interface Post {
     name: string;
     color: string;
   };
+  viewer_state?: {
+    liked: boolean;
+    following_author: boolean;
+    is_author: boolean;
+  };
 }
 
 export default function FeedScreen() {
@@ -86,7 +91,7 @@ useEffect(() => {
         return;
       }
 
-      const response = await fetch(`${EXPO_PUBLIC_BACKEND_URL}/api/posts?limit=20`, {
+      const response = await fetch(`${EXPO_PUBLIC_BACKEND_URL}/api/posts?limit=20&include=viewer_state`, {
         method: 'GET',
         headers: {
           'Authorization': `Bearer ${token}`,
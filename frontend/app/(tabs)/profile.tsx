@@ -16,6 +16,7 @@ import AsyncStorage from '@react-native-async-storage/async-storage';
 import { useAuthStore } from '../../store/authStore';
 import { useThemeStore } from '../../store/themeStore';
 import { mockCurrentUser } from '../../data/mockData';
+import { resolveMediaUri } from '../../utils/media';
 
 export default function ProfileScreen() {
   const { user, logout } = useAuthStore();
@@ -87,7 +88,7 @@ export default function ProfileScreen() {
         <View style={styles.header}>
           <View style={styles.userInfo}>
             {profileData.avatar ? (
-              <Image source={{ uri: profileData.avatar }} style={styles.avatar} />
+              <Image source={{ uri: resolveMediaUri(profileData.avatar) }} style={styles.avatar} />
             ) : (
               <View style={[styles.avatar, styles.avatarPlaceholder]}>
                 <Ionicons name="person" size={40} color={theme.textSecondary} />
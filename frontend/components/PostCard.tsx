@@ -10,6 +10,7 @@ import {
 } from 'react-native';
 import { Ionicons } from '@expo/vector-icons';
 import { useThemeStore } from '../store/themeStore';
+import { resolveMediaUri } from '../utils/media';
 
 interface Post {
   id: string;
@@ -36,6 +37,11 @@ interface Post {
     name: string;
     color: string;
   };
+  viewer_state?: {
+    liked: boolean;
+    following_author: boolean;
+    is_author: boolean;
+  };
 }
 
 interface PostCardProps {
@@ -45,7 +51,8 @@ interface PostCardProps {
 
 export default function PostCard({ post, onLike }: PostCardProps) {
   const { theme } = useThemeStore();
-  const [liked, setLiked] = useState(false);
+  const initiallyLiked = post.viewer_state?.liked ?? false;
+  const [liked, setLiked] = useState(initiallyLiked);
   const [liking, setLiking] = useState(false);
 
   const handleLike = async () => {
@@ -127,7 +134,7 @@ export default function PostCard({ post, onLike }: PostCardProps) {
       <View style={styles.header}>
         <View style={styles.userInfo}>
           {post.user.avatar ? (
-            <Image source={{ uri: post.user.avatar }} style={styles.avatar} />
+            <Image source={{ uri: resolveMediaUri(post.user.avatar) }} style={styles.avatar} />
           ) : (
             <View style={[styles.avatar, styles.avatarPlaceholder]}>
               <Ionicons name="person" size={20} color={theme.textSecondary} />
@@ -153,7 +160,7 @@ export default function PostCard({ post, onLike }: PostCardProps) {
       {post.media && (
         <View style={styles.mediaContainer}>
           <Image 
-            source={{ uri: post.media }} 
+            source={{ uri: resolveMediaUri(post.media) }} 
             style={styles.media}
             resizeMode="cover"
           />
@@ -216,7 +223,7 @@ export default function PostCard({ post, onLike }: PostCardProps) {
             color={liked ? theme.error : theme.textSecondary} 
           />
           <Text style={[styles.actionCount, liked && { color: theme.error }]}>
-            {post.like_count + (liked ? 1 : 0)}
+            {post.like_count + (liked ? 1 : 0) - (initiallyLiked ? 1 : 0)}
           </Text>
         </TouchableOpacity>
 
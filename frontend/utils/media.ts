@@ -0,0 +1,5 @@
+const EXPO_PUBLIC_BACKEND_URL = process.env.EXPO_PUBLIC_BACKEND_URL;
+
+// The API returns server-relative media URLs unless it runs with MEDIA_BASE_URL set
+export const resolveMediaUri = (uri?: string) =>
+  uri && uri.startsWith('/') ? `${EXPO_PUBLIC_BACKEND_URL}${uri}` : uri;
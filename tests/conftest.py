@@ -0,0 +1,78 @@
+import os
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+# Configure the server before it is imported: cheap bcrypt, no rate limiting, in-process search
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "irecommend_test")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("SEARCH_BACKEND", "memory")
+for name in ("RATE_LIMIT_AUTH", "RATE_LIMIT_WRITE", "RATE_LIMIT_TOGGLE", "RATE_LIMIT_DEFAULT"):
+    os.environ.setdefault(name, "1000000/1")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db(monkeypatch, tmp_path):
+    """A fresh in-memory database with every index, plus fresh per-worker caches, buffers and media store"""
+    mongo = AsyncMongoMockClient(tz_aware=True)
+    database = mongo[os.environ["DB_NAME"]]
+    monkeypatch.setattr(server, "client", mongo)
+    monkeypatch.setattr(server, "db", database)
+    # GridFS needs a real server; blobs go to a temporary directory instead
+    monkeypatch.setattr(server, "_media_store", server.LocalMediaStore(tmp_path / "media"))
+    monkeypatch.setattr(server, "counters", server.CounterBuffer(server.COUNTER_FLUSH_BATCH))
+    monkeypatch.setattr(server, "principal_cache",
+                        server.PrincipalCache(server.PRINCIPAL_CACHE_SIZE, server.PRINCIPAL_CACHE_TTL))
+    monkeypatch.setattr(server, "response_cache", server.ResponseCache(
+        server.InMemoryResponseStore(server.RESPONSE_CACHE_SIZE, server.RESPONSE_CACHE_TTL)))
+    await server.ensure_indexes()
+    return database
+
+
+@pytest.fixture
+async def client(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as http:
+        yield http
+
+
+@pytest.fixture
+def register(client):
+    """Register a user and return Authorization headers for them"""
+    async def register_user(username: str) -> dict:
+        response = await client.post("/api/auth/register", json={
+            "email": f"{username}@example.com", "username": username,
+            "password": "secret123", "name": username.title(),
+        })
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return register_user
+
+
+@pytest.fixture
+def create_post(client):
+    """Create a room and a post in it for the given user, returning the post"""
+    async def create(headers: dict, title: str = "A post", room_id: str = None) -> dict:
+        if room_id is None:
+            room = await client.post("/api/rooms", json={"name": "Books", "color": "#FF5733"}, headers=headers)
+            room_id = room.json()["id"]
+        response = await client.post("/api/posts", json={
+            "room_id": room_id, "title": title, "description": "Worth it",
+            "recommendation_type": "recommend", "action_type": "read",
+        }, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()
+    return create
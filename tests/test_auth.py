@@ -0,0 +1,65 @@
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_register_rejects_duplicate_email(client, register):
+    await register("alice")
+    response = await client.post("/api/auth/register", json={
+        "email": "alice@example.com", "username": "alice2", "password": "secret123", "name": "Alice",
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+
+
+async def test_register_rejects_duplicate_username(client, register, db):
+    await register("alice")
+    response = await client.post("/api/auth/register", json={
+        "email": "other@example.com", "username": "alice", "password": "secret123", "name": "Alice",
+    })
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already taken"
+    assert await db.users.count_documents({}) == 1
+
+
+async def test_profile_update_rejects_taken_username(client, register):
+    await register("alice")
+    bob = await register("bob")
+    response = await client.put("/api/users/profile", json={"username": "alice"}, headers=bob)
+    assert response.status_code == 400
+    assert (await client.get("/api/users/bob")).status_code == 200
+
+
+async def test_startup_fails_when_a_unique_index_cannot_be_built(db):
+    await db.users.drop_index("email_unique")
+    await db.users.insert_many([
+        {"email": "dup@example.com", "username": "first"},
+        {"email": "dup@example.com", "username": "second"},
+    ])
+    with pytest.raises(RuntimeError, match="email_unique.*repair-duplicates"):
+        await server.ensure_indexes()
+
+
+async def test_repair_duplicates_lets_unique_indexes_build(db):
+    await db.users.drop_index("email_unique")
+    await db.likes.drop_index("user_post_unique")
+    first, second, post_id = ObjectId(), ObjectId(), ObjectId()
+    await db.users.insert_many([
+        {"_id": first, "email": "dup@example.com", "username": "first"},
+        {"_id": second, "email": "dup@example.com", "username": "second"},
+    ])
+    await db.posts.insert_one({"_id": post_id, "user_id": first, "like_count": 2})
+    await db.likes.insert_many([{"user_id": second, "post_id": post_id} for _ in range(2)])
+
+    assert (await server.repair_duplicates(dry_run=True))["users.email_unique"] == 1
+    assert await db.likes.count_documents({}) == 2
+
+    repaired = await server.repair_duplicates()
+    assert repaired["users.email_unique"] == 1 and repaired["likes.user_post_unique"] == 1
+    await server.ensure_indexes()
+    assert (await db.users.find_one({"_id": first}))["email"] == "dup@example.com"
+    assert (await db.users.find_one({"_id": second}))["email"] == f"dup@example.com-duplicate-{second}"
+    assert (await db.posts.find_one({"_id": post_id}))["like_count"] == 1
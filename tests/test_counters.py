@@ -0,0 +1,112 @@
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_like_is_buffered_until_flush(client, db, register, create_post):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+
+    response = await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    assert response.json() == {"liked": True, "like_count": 1}
+    assert (await db.posts.find_one({"_id": ObjectId(post["id"])}))["like_count"] == 0
+
+    await server.counters.flush()
+    assert (await db.posts.find_one({"_id": ObjectId(post["id"])}))["like_count"] == 1
+    assert server.counters.pending("posts", ObjectId(post["id"]), "like_count") == 0
+
+
+async def test_like_then_unlike_nets_to_zero(client, db, register, create_post):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+
+    await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    response = await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    assert response.json() == {"liked": False, "like_count": 0}
+
+    await server.counters.flush()
+    assert (await db.posts.find_one({"_id": ObjectId(post["id"])}))["like_count"] == 0
+
+
+async def test_failed_flush_keeps_deltas_for_the_next_one(client, db, register, create_post, monkeypatch):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+    post_id = ObjectId(post["id"])
+    await client.post(f"/api/users/alice/follow", headers=bob)
+    await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+
+    collection_type = type(db.posts)
+    bulk_write = collection_type.bulk_write
+
+    async def failing_bulk_write(self, *args, **kwargs):
+        if self.name == "posts":
+            raise RuntimeError("primary stepped down")
+        return await bulk_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", failing_bulk_write)
+    await server.counters.flush()
+    assert (await db.posts.find_one({"_id": post_id}))["like_count"] == 0
+    assert server.counters.pending("posts", post_id, "like_count") == 1
+    assert (await db.users.find_one({"username": "alice"}))["follower_count"] == 1
+
+    monkeypatch.setattr(collection_type, "bulk_write", bulk_write)
+    await server.counters.flush()
+    assert (await db.posts.find_one({"_id": post_id}))["like_count"] == 1
+    assert server.counters.pending("posts", post_id, "like_count") == 0
+
+
+async def test_partly_failed_flush_retries_only_the_failed_updates(client, db, register, create_post, monkeypatch):
+    alice, bob = await register("alice"), await register("bob")
+    first, second = await create_post(alice, title="First"), await create_post(alice, title="Second")
+    first_id, second_id = ObjectId(first["id"]), ObjectId(second["id"])
+    await client.post(f"/api/posts/{first['id']}/like", headers=bob)
+    await client.post(f"/api/posts/{second['id']}/like", headers=bob)
+
+    collection_type = type(db.posts)
+    bulk_write = collection_type.bulk_write
+
+    async def partly_failing_bulk_write(self, requests, *args, **kwargs):
+        if self.name != "posts":
+            return await bulk_write(self, requests, *args, **kwargs)
+        # The first update is applied, the second rejected
+        await bulk_write(self, requests[:1], *args, **kwargs)
+        raise BulkWriteError({"writeErrors": [{"index": 1, "code": 112, "errmsg": "write conflict"}],
+                              "nInserted": 0, "nUpserted": 0, "nMatched": 1, "nModified": 1, "nRemoved": 0})
+
+    monkeypatch.setattr(collection_type, "bulk_write", partly_failing_bulk_write)
+    await server.counters.flush()
+    assert server.counters.pending("posts", first_id, "like_count") == 0
+    assert server.counters.pending("posts", second_id, "like_count") == 1
+
+    monkeypatch.setattr(collection_type, "bulk_write", bulk_write)
+    await server.counters.flush()
+    assert (await db.posts.find_one({"_id": first_id}))["like_count"] == 1
+    assert (await db.posts.find_one({"_id": second_id}))["like_count"] == 1
+
+
+async def test_count_read_during_a_flush_is_not_doubled(client, db, register, create_post, monkeypatch):
+    alice, bob = await register("alice"), await register("bob")
+    first, second = await create_post(alice, title="First"), await create_post(alice, title="Second")
+    first_id = ObjectId(first["id"])
+    await client.post(f"/api/posts/{first['id']}/like", headers=bob)
+    await client.post(f"/api/posts/{second['id']}/like", headers=bob)
+    monkeypatch.setattr(server.counters, "batch_size", 1)
+
+    collection_type = type(db.posts)
+    bulk_write = collection_type.bulk_write
+    seen = []
+
+    async def observing_bulk_write(self, *args, **kwargs):
+        if self.name == "posts":
+            # The first post's batch has been written by the time the second one goes out
+            stored = (await db.posts.find_one({"_id": first_id}))["like_count"]
+            seen.append(stored + server.counters.pending("posts", first_id, "like_count"))
+        return await bulk_write(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", observing_bulk_write)
+    await server.counters.flush()
+    assert seen == [1, 1]
@@ -0,0 +1,82 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def chunked(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def export_all() -> bytes:
+    return b"".join([chunk async for chunk in server.export_ndjson([(name, {}) for name in server.EXPORT_COLLECTIONS])])
+
+
+async def test_export_then_import_restores_every_document(client, db, register, create_post, monkeypatch):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+    await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    await client.post("/api/users/alice/follow", headers=bob)
+    await server.counters.flush()
+    snapshot = {name: await db[name].find().sort("_id", 1).to_list(None) for name in server.EXPORT_COLLECTIONS}
+    dump = await export_all()
+
+    for name in server.EXPORT_COLLECTIONS:
+        await db[name].delete_many({})
+    # Chunks that split lines mid-document must still parse
+    result = await server.import_ndjson(chunked(dump + b"not json\n", 37))
+
+    assert result["invalid_lines"] == 1
+    assert result["documents"] == sum(len(docs) for docs in snapshot.values())
+    for name, docs in snapshot.items():
+        assert await db[name].find().sort("_id", 1).to_list(None) == docs
+
+
+async def test_insert_mode_skips_existing_and_upsert_replaces(client, db, register, create_post):
+    alice = await register("alice")
+    await create_post(alice)
+    dump = await export_all()
+
+    skipped = await server.import_ndjson(chunked(dump, 1024), "insert")
+    assert skipped["collections"]["posts"] == {"inserted": 0, "skipped": 1, "failed": 0}
+
+    await db.posts.update_many({}, {"$set": {"title": "Edited"}})
+    replaced = await server.import_ndjson(chunked(dump, 1024), "upsert")
+    assert replaced["collections"]["posts"]["replaced"] == 1
+    assert (await db.posts.find_one({}))["title"] == "A post"
+
+
+async def test_export_requires_an_admin(client, db, register, monkeypatch):
+    alice = await register("alice")
+    assert (await client.get("/api/admin/export/posts", headers=alice)).status_code == 403
+
+    user = await db.users.find_one({"username": "alice"})
+    monkeypatch.setattr(server, "ADMIN_USER_IDS", {str(user["_id"])})
+    response = await client.get("/api/admin/export/users", headers=alice)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+
+
+async def test_a_batch_that_fails_outright_is_reported(client, db, register, create_post, monkeypatch):
+    alice = await register("alice")
+    await create_post(alice)
+    dump = await export_all()
+    for name in server.EXPORT_COLLECTIONS:
+        await db[name].delete_many({})
+
+    collection_type = type(db.posts)
+    insert_many = collection_type.insert_many
+
+    async def failing_insert_many(self, *args, **kwargs):
+        if self.name == "posts":
+            raise RuntimeError("connection reset")
+        return await insert_many(self, *args, **kwargs)
+
+    monkeypatch.setattr(collection_type, "insert_many", failing_insert_many)
+    result = await server.import_ndjson(chunked(dump, 1024))
+
+    assert result["collections"]["posts"] == {"failed": 1}
+    assert result["errors"] == ["posts: connection reset"]
+    assert await db.users.count_documents({}) == 1
@@ -0,0 +1,171 @@
+import base64
+import hashlib
+import io
+from urllib.parse import urlparse
+
+import pytest
+from bson import ObjectId
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def png_bytes(width=64, height=48) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+CDN = "https://cdn.example.com"
+
+
+def assert_media_url(url: str, base: str = CDN):
+    parsed = urlparse(url)
+    assert url.startswith(f"{base}/api/media/") and parsed.scheme in ("http", "https") and parsed.netloc, url
+
+
+async def test_upload_urls_use_media_base_url_and_default_to_server_relative(client, register, monkeypatch):
+    alice = await register("alice")
+    uploaded = (await client.post("/api/media", files={"file": ("photo.png", png_bytes(), "image/png")}, headers=alice)).json()
+    assert uploaded["url"] == f"/api/media/{uploaded['id']}"
+    assert (await client.get(uploaded["url"])).status_code == 200
+
+    monkeypatch.setattr(server, "MEDIA_BASE_URL", CDN)
+    uploaded = (await client.post("/api/media", files={"file": ("photo.png", png_bytes(), "image/png")}, headers=alice)).json()
+    assert_media_url(uploaded["url"])
+    for url in uploaded["renditions"].values():
+        assert_media_url(url)
+
+
+async def test_stored_media_is_keyed_by_the_bytes_served(client, db, register):
+    alice = await register("alice")
+    upload = png_bytes()
+    first = (await client.post("/api/media", files={"file": ("a.png", upload, "image/png")}, headers=alice)).json()
+    served = (await client.get(f"/api/media/{first['id']}")).content
+    assert first["id"] == hashlib.sha256(served).hexdigest() != hashlib.sha256(upload).hexdigest()
+
+    again = (await client.post("/api/media", files={"file": ("b.png", upload, "image/png")}, headers=alice)).json()
+    assert again == first
+    assert await db.media_sources.find_one({"_id": hashlib.sha256(upload).hexdigest()}) == {
+        "_id": hashlib.sha256(upload).hexdigest(), "media_id": first["id"]
+    }
+
+
+async def test_documents_store_media_ids_and_urls_are_built_when_rendering(client, db, register, monkeypatch):
+    monkeypatch.setattr(server, "MEDIA_BASE_URL", CDN)
+    alice = await register("alice")
+    inline = "data:image/png;base64," + base64.b64encode(png_bytes()).decode()
+
+    room = (await client.post("/api/rooms", json={"name": "Books", "color": "#FF5733"}, headers=alice)).json()
+    post = (await client.post("/api/posts", json={
+        "room_id": room["id"], "title": "Photo", "description": "Look", "media": inline,
+        "recommendation_type": "recommend", "action_type": "buy",
+    }, headers=alice)).json()
+    assert_media_url(post["media"])
+    profile = (await client.put("/api/users/profile", json={"avatar": inline}, headers=alice)).json()
+    assert_media_url(profile["avatar"])
+
+    stored = await db.posts.find_one({"_id": ObjectId(post["id"])})
+    assert stored["media"] == "" and stored["media_id"] == post["media_id"]
+    assert stored["media_renditions"]["feed"] in post["media"]
+    assert "://" not in str(stored["media_renditions"])
+    user = await db.users.find_one({"username": "alice"})
+    assert user["avatar"] == "" and user["avatar_renditions"]["thumb"] in profile["avatar"]
+
+    # A new media origin applies to existing documents, including URLs stored by older versions
+    await db.posts.update_one({"_id": stored["_id"]}, {"$set": {
+        "media": f"http://old.example/api/media/{stored['media_renditions']['feed']}",
+        "media_renditions": {name: f"http://old.example/api/media/{media_id}"
+                             for name, media_id in stored["media_renditions"].items()},
+    }})
+    monkeypatch.setattr(server, "MEDIA_BASE_URL", "https://media.example.org")
+    listed = (await client.get("/api/posts")).json()[0]
+    assert listed["media"] == post["media"].replace(CDN, "https://media.example.org")
+    assert listed["media_renditions"] == {
+        name: url.replace(CDN, "https://media.example.org") for name, url in post["media_renditions"].items()
+    }
+    assert_media_url(listed["user"]["avatar"], "https://media.example.org")
+
+
+async def test_external_media_urls_pass_through(client, register):
+    alice = await register("alice")
+    room = (await client.post("/api/rooms", json={"name": "Books", "color": "#FF5733"}, headers=alice)).json()
+    post = (await client.post("/api/posts", json={
+        "room_id": room["id"], "title": "Link", "description": "Look", "media": "https://example.com/a.png",
+        "recommendation_type": "recommend", "action_type": "buy",
+    }, headers=alice)).json()
+    assert post["media"] == "https://example.com/a.png" and post["media_renditions"] == {}
+
+
+async def test_non_media_uploads_are_rejected_whatever_their_declared_type(client, register):
+    alice = await register("alice")
+    html = b"<script>alert(1)</script>"
+    for declared in ("text/html", "image/png"):
+        response = await client.post("/api/media", files={"file": ("x.png", html, declared)}, headers=alice)
+        assert response.status_code == 415
+
+    inline = "data:image/png;base64," + base64.b64encode(html).decode()
+    response = await client.put("/api/users/profile", json={"avatar": inline}, headers=alice)
+    assert response.status_code == 415
+
+
+async def test_media_is_served_with_nosniff_and_legacy_types_are_not_inlined(client, db, register):
+    alice = await register("alice")
+    uploaded = (await client.post("/api/media", files={"file": ("a.png", png_bytes(), "text/html")}, headers=alice)).json()
+    response = await client.get(f"/api/media/{uploaded['id']}")
+    assert response.headers["content-type"].startswith("image/")
+    assert response.headers["x-content-type-options"] == "nosniff"
+
+    await db.media.update_one({"_id": uploaded["id"]}, {"$set": {"content_type": "text/html"}})
+    response = await client.get(f"/api/media/{uploaded['id']}")
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["content-disposition"] == "attachment"
+
+
+def jpeg_with_gps(width=64, height=48) -> bytes:
+    exif = Image.Exif()
+    exif[0x8825] = {1: "N", 2: (48.0, 51.0, 29.0)}  # GPSInfo
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (30, 200, 30)).save(buffer, "JPEG", exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("declared", ["image/jpg", "image/heic", "application/octet-stream"])
+async def test_images_are_re_encoded_whatever_their_declared_type(client, register, declared):
+    alice = await register("alice")
+    upload = jpeg_with_gps()
+    assert Image.open(io.BytesIO(upload)).getexif()
+    uploaded = (await client.post("/api/media", files={"file": ("a.jpg", upload, declared)}, headers=alice)).json()
+    assert set(uploaded["renditions"]) == {"thumb", "feed", "full"}
+    served = (await client.get(urlparse(uploaded["url"]).path)).content
+    assert not Image.open(io.BytesIO(served)).getexif()
+
+
+async def test_images_without_a_sniffed_type_are_decoded_by_pillow(client, register):
+    alice = await register("alice")
+    buffer = io.BytesIO()
+    Image.new("RGB", (40, 30), (0, 0, 200)).save(buffer, "BMP")
+    uploaded = (await client.post("/api/media", files={"file": ("a.bmp", buffer.getvalue(), "image/bmp")},
+                                  headers=alice)).json()
+    # All three renditions of a small image are the same bytes, stored once
+    assert {rendition for rendition in uploaded["renditions"].values()} == {uploaded["url"]}
+    assert uploaded["content_type"].startswith("image/") and uploaded["content_type"] != "image/bmp"
+
+
+async def test_new_comments_embed_the_rendered_avatar(client, register, create_post, monkeypatch):
+    monkeypatch.setattr(server, "MEDIA_BASE_URL", CDN)
+    alice = await register("alice")
+    inline = "data:image/png;base64," + base64.b64encode(png_bytes()).decode()
+    await client.put("/api/users/profile", json={"avatar": inline}, headers=alice)
+    post = await create_post(alice)
+
+    response = await client.post(f"/api/posts/{post['id']}/comments",
+                                 json={"post_id": post["id"], "content": "Nice"}, headers=alice)
+    assert response.status_code == 200, response.text
+    comment = response.json()
+    assert comment["content"] == "Nice" and comment["user"]["username"] == "alice"
+    assert_media_url(comment["user"]["avatar"])
+    listed = (await client.get(f"/api/posts/{post['id']}/comments")).json()
+    assert [(c["id"], c["user"]) for c in listed] == [(comment["id"], comment["user"])]
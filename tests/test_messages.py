@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def emitted(monkeypatch):
+    """Socket.IO events the server emitted, as (event, data, to)"""
+    events = []
+
+    async def emit(event, data=None, to=None, **kwargs):
+        events.append((event, data, to))
+
+    monkeypatch.setattr(server.sio, "emit", emit)
+    return events
+
+
+@pytest.fixture
+def users(client, register):
+    """Register users and return {username: (headers, id)}"""
+    async def create(*usernames):
+        result = {}
+        for username in usernames:
+            headers = await register(username)
+            result[username] = (headers, (await client.get("/api/auth/me", headers=headers)).json()["id"])
+        return result
+    return create
+
+
+async def send(client, sender, receiver_id, content):
+    response = await client.post("/api/messages", json={"receiver_id": receiver_id, "content": content}, headers=sender)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_messages_are_delivered_live_and_listed_newest_first(client, users, emitted):
+    people = await users("alice", "bob")
+    (alice, alice_id), (bob, bob_id) = people["alice"], people["bob"]
+
+    first = await send(client, alice, bob_id, "Hi Bob")
+    second = await send(client, bob, alice_id, "Hi Alice")
+    await asyncio.sleep(0)
+    assert (first["sender_id"], first["receiver_id"], first["read"]) == (alice_id, bob_id, False)
+    assert ("message", first, [f"user:{bob_id}", f"user:{alice_id}"]) in emitted
+
+    for headers, peer_id in ((alice, bob_id), (bob, alice_id)):
+        history = (await client.get(f"/api/conversations/{peer_id}/messages", headers=headers)).json()
+        assert [message["id"] for message in history] == [second["id"], first["id"]]
+
+
+async def test_message_history_pages_with_cursors(client, users):
+    people = await users("alice", "bob")
+    (alice, _), (bob, bob_id) = people["alice"], people["bob"]
+    sent = [(await send(client, alice, bob_id, f"Message {i}"))["id"] for i in range(5)]
+
+    ids, cursor = [], None
+    while True:
+        response = await client.get(f"/api/conversations/{bob_id}/messages", headers=alice,
+                                    params={"limit": 2, **({"cursor": cursor} if cursor else {})})
+        ids.extend(message["id"] for message in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert ids == sent[::-1]
+
+
+async def test_conversations_track_the_last_message_and_unread_counts(client, users):
+    people = await users("alice", "bob", "carol")
+    (alice, alice_id), (bob, bob_id), (carol, carol_id) = people["alice"], people["bob"], people["carol"]
+
+    await send(client, bob, alice_id, "One")
+    await send(client, bob, alice_id, "Two")
+    await send(client, carol, alice_id, "x" * 500)
+
+    inbox = (await client.get("/api/conversations", headers=alice)).json()
+    assert [c["peer"]["username"] for c in inbox] == ["carol", "bob"]
+    assert [c["unread_count"] for c in inbox] == [1, 2]
+    assert inbox[1]["last_message"]["content"] == "Two"
+    assert len(inbox[0]["last_message"]["content"]) == server.MESSAGE_PREVIEW_LENGTH
+
+    # Replying moves the conversation to the top without adding unread messages for the sender
+    await send(client, alice, bob_id, "Three")
+    inbox = (await client.get("/api/conversations", headers=alice)).json()
+    assert [(c["peer"]["username"], c["unread_count"]) for c in inbox] == [("bob", 2), ("carol", 1)]
+    assert [c["unread_count"] for c in (await client.get("/api/conversations", headers=bob)).json()] == [1]
+
+    first_page = await client.get("/api/conversations", headers=alice, params={"limit": 1})
+    second_page = await client.get("/api/conversations", headers=alice,
+                                   params={"limit": 1, "cursor": first_page.headers["X-Next-Cursor"]})
+    assert [c["peer"]["id"] for c in first_page.json() + second_page.json()] == [bob_id, carol_id]
+
+
+async def test_mark_read_clears_unread_and_notifies_the_sender(client, users, emitted):
+    people = await users("alice", "bob")
+    (alice, alice_id), (bob, bob_id) = people["alice"], people["bob"]
+    await send(client, bob, alice_id, "One")
+    await send(client, bob, alice_id, "Two")
+    await send(client, alice, bob_id, "Mine")
+
+    response = await client.post(f"/api/conversations/{bob_id}/read", headers=alice)
+    assert response.json() == {"marked_read": 2}
+    await asyncio.sleep(0)
+    receipts = [(data, to) for event, data, to in emitted if event == "messages_read"]
+    assert len(receipts) == 1 and receipts[0][0]["user_id"] == alice_id and receipts[0][1] == f"user:{bob_id}"
+
+    history = (await client.get(f"/api/conversations/{bob_id}/messages", headers=alice)).json()
+    assert [m["read"] for m in history if m["sender_id"] == bob_id] == [True, True]
+    assert [m["read"] for m in history if m["sender_id"] == alice_id] == [False]
+    assert (await client.get("/api/conversations", headers=alice)).json()[0]["unread_count"] == 0
+
+    assert (await client.post(f"/api/conversations/{bob_id}/read", headers=alice)).json() == {"marked_read": 0}
+    await asyncio.sleep(0)
+    assert len([event for event, _, _ in emitted if event == "messages_read"]) == 1
+
+
+async def test_invalid_messages_are_rejected(client, users):
+    people = await users("alice")
+    alice, alice_id = people["alice"]
+
+    cases = [
+        ({"receiver_id": "nope", "content": "Hi"}, 400),
+        ({"receiver_id": alice_id, "content": "Hi"}, 400),
+        ({"receiver_id": "0" * 24, "content": "Hi"}, 404),
+    ]
+    for body, status in cases:
+        assert (await client.post("/api/messages", json=body, headers=alice)).status_code == status
+    people = await users("bob")
+    response = await client.post("/api/messages", json={"receiver_id": people["bob"][1], "content": ""}, headers=alice)
+    assert response.status_code == 400
+    assert (await client.get("/api/conversations/nope/messages", headers=alice)).status_code == 400
+    assert (await client.get("/api/conversations")).status_code == 403
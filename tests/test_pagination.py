@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def read_all_pages(client, path, limit):
+    """Follow X-Next-Cursor to the end, returning every post ID in order"""
+    ids, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = await client.get(path, params=params)
+        assert response.status_code == 200, response.text
+        ids.extend(post["id"] for post in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return ids
+
+
+async def test_cursor_pages_cover_every_post_once(client, register, create_post):
+    alice = await register("alice")
+    room_id = (await create_post(alice, "Post 0"))["room"]["id"]
+    for i in range(1, 7):
+        await create_post(alice, f"Post {i}", room_id)
+
+    first_page = (await client.get("/api/posts", params={"limit": 100})).json()
+    assert await read_all_pages(client, "/api/posts", 2) == [post["id"] for post in first_page]
+    assert len(first_page) == 7
+
+
+async def test_cursor_breaks_created_at_ties_by_id(client, db, register, create_post):
+    alice = await register("alice")
+    room_id = (await create_post(alice, "Post 0"))["room"]["id"]
+    for i in range(1, 5):
+        await create_post(alice, f"Post {i}", room_id)
+    await db.posts.update_many({}, {"$set": {"created_at": datetime(2024, 1, 1, tzinfo=timezone.utc)}})
+
+    ids = await read_all_pages(client, "/api/posts", 2)
+    assert len(ids) == len(set(ids)) == 5
+    assert ids == sorted(ids, reverse=True)
+
+
+async def test_invalid_cursor_is_rejected(client):
+    response = await client.get("/api/posts", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
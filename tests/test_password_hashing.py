@@ -0,0 +1,80 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def login(client, password="secret123"):
+    return await client.post("/api/auth/login", json={"email": "alice@example.com", "password": password})
+
+
+async def test_login_rehashes_when_bcrypt_rounds_change(client, db, register, monkeypatch):
+    await register("alice")
+    original = (await db.users.find_one({"username": "alice"}))["password_hash"]
+    assert original.split("$")[2] == "04"
+
+    assert (await login(client)).status_code == 200
+    assert (await db.users.find_one({"username": "alice"}))["password_hash"] == original
+
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 5)
+    assert (await login(client)).status_code == 200
+    upgraded = (await db.users.find_one({"username": "alice"}))["password_hash"]
+    assert upgraded.split("$")[2] == "05"
+    assert not server.password_needs_rehash(upgraded)
+    assert (await login(client)).status_code == 200
+
+
+async def test_failed_login_does_not_rehash(client, db, register, monkeypatch):
+    await register("alice")
+    original = (await db.users.find_one({"username": "alice"}))["password_hash"]
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 5)
+    assert (await login(client, "wrong")).status_code == 401
+    assert (await db.users.find_one({"username": "alice"}))["password_hash"] == original
+
+
+def test_unparseable_hashes_need_rehash():
+    assert server.password_needs_rehash("not-a-bcrypt-hash")
+    assert not server.password_needs_rehash(server.hash_password("secret123", server.BCRYPT_ROUNDS))
+
+
+async def test_hasher_bounds_concurrency_without_blocking_the_loop():
+    hasher = server.PasswordHasher(2, "thread")
+    lock = threading.Lock()
+    running, peak = 0, 0
+
+    def work():
+        nonlocal running, peak
+        with lock:
+            running += 1
+            peak = max(peak, running)
+        time.sleep(0.05)
+        with lock:
+            running -= 1
+        return True
+
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    tick_task = asyncio.create_task(ticker())
+    try:
+        calls = asyncio.gather(*(hasher._run(work) for _ in range(6)))
+        await asyncio.sleep(0.01)
+        assert hasher.active == 2 and hasher.queue_depth == 4
+        assert await calls == [True] * 6
+    finally:
+        tick_task.cancel()
+        hasher.shutdown()
+    assert peak == 2
+    assert hasher.active == hasher.queue_depth == 0
+    # Three rounds of 50ms on the pool; the loop kept running meanwhile
+    assert ticks >= 10
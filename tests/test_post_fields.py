@@ -0,0 +1,91 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def posts(client, register, create_post):
+    """Two authors with three posts in two rooms, newest last"""
+    alice, bob = await register("alice"), await register("bob")
+    first = await create_post(alice, "First")
+    second = await create_post(alice, "Second", first["room"]["id"])
+    third = await create_post(bob, "Third")
+    return {"alice": alice, "bob": bob, "posts": [first, second, third]}
+
+
+async def test_fields_selects_post_and_embedded_keys(client, posts):
+    listed = (await client.get("/api/posts", params={"fields": "id, title,user.username"})).json()
+    assert listed == [
+        {"id": post["id"], "title": post["title"], "user": {"username": post["user"]["username"]}}
+        for post in reversed(posts["posts"])
+    ]
+
+    listed = (await client.get("/api/posts", params={"fields": "id,room"})).json()
+    assert listed[0] == {"id": posts["posts"][2]["id"], "room": posts["posts"][2]["room"]}
+
+
+async def test_selection_projects_only_what_it_renders():
+    selection = server.post_selection("title,user.name")
+    assert "media" not in selection.projection and "description" not in selection.projection
+    assert set(selection.embeds) == {"user"}
+    assert selection.embeds["user"][1] == {"name": 1}
+    assert server.post_selection("title,user.name") is selection
+
+    # Computed fields read the document fields they are built from
+    assert {"media", "media_id", "media_renditions"} <= set(server.post_selection("media").projection)
+
+
+@pytest.mark.parametrize("fields", ["id,secret", "user.password_hash", "room.owner", "nope.id"])
+async def test_unknown_fields_are_rejected(client, fields):
+    response = await client.get("/api/posts", params={"fields": fields})
+    assert response.status_code == 400
+    assert response.json()["detail"].startswith("Unknown field")
+
+
+async def test_default_selection_matches_the_full_listing(client, posts):
+    full = (await client.get("/api/posts")).json()
+    everything = ",".join([*server.POST_FIELDS, *server.POST_EMBEDS])
+    assert (await client.get("/api/posts", params={"fields": everything})).json() == full
+    assert full[0] == {**posts["posts"][2], "created_at": full[0]["created_at"]}
+
+
+async def test_compact_moves_authors_and_rooms_into_side_tables(client, posts):
+    full = (await client.get("/api/posts")).json()
+    compact = (await client.get("/api/posts", params={"compact": "true"})).json()
+
+    assert set(compact) == {"posts", "users", "rooms"}
+    assert len(compact["users"]) == 2 and len(compact["rooms"]) == 2
+    for post, expanded in zip(compact["posts"], full):
+        assert "user" not in post and "room" not in post
+        assert compact["users"][post["user_id"]] == expanded["user"]
+        assert compact["rooms"][post["room_id"]] == expanded["room"]
+        assert {key: value for key, value in post.items() if key not in ("user_id", "room_id")} == {
+            key: value for key, value in expanded.items() if key not in ("user", "room")
+        }
+
+
+async def test_compact_side_tables_follow_the_field_selection(client, posts):
+    compact = (await client.get("/api/posts", params={"compact": "true", "fields": "title,user.username"})).json()
+    assert set(compact) == {"posts", "users"}
+    assert compact["posts"][0] == {"title": "Third", "user_id": posts["posts"][2]["user"]["id"]}
+    assert sorted(user["username"] for user in compact["users"].values()) == ["alice", "bob"]
+    assert all(set(user) == {"username"} for user in compact["users"].values())
+
+
+async def test_batch_and_viewer_state_support_fields_and_compact(client, posts):
+    first, _, third = posts["posts"]
+    response = await client.post("/api/posts/batch", params={
+        "fields": "id,like_count", "compact": "true", "include": "viewer_state",
+    }, json={"post_ids": [third["id"], first["id"]]}, headers=posts["alice"])
+    content = response.json()
+    assert [post["id"] for post in content["posts"]] == [third["id"], first["id"]]
+    assert [post["viewer_state"]["is_author"] for post in content["posts"]] == [False, True]
+    # No embed was selected, so there are no references or side tables either
+    assert set(content) == {"posts"}
+    assert set(content["posts"][0]) == {"id", "like_count", "viewer_state"}
+
+    listed = (await client.get("/api/posts", params={"compact": "true", "fields": "id", "include": "viewer_state"},
+                               headers=posts["bob"])).json()
+    assert [post["viewer_state"]["is_author"] for post in listed["posts"]] == [True, False, False]
@@ -0,0 +1,63 @@
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def me(client, headers) -> dict:
+    response = await client.get("/api/auth/me", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+async def test_authenticated_requests_are_served_from_the_cache(client, db, register):
+    alice = await register("alice")
+    first = await me(client, alice)
+    misses = server.principal_cache.misses
+
+    # Not invalidated, so a direct write is not seen until the entry expires
+    await db.users.update_one({"_id": ObjectId(first["id"])}, {"$set": {"bio": "changed behind the cache"}})
+    for _ in range(3):
+        assert (await me(client, alice))["bio"] == ""
+    assert server.principal_cache.misses == misses
+    assert server.principal_cache.hits >= 3
+
+
+async def test_profile_update_invalidates_the_principal(client, register):
+    alice = await register("alice")
+    await me(client, alice)
+
+    response = await client.put("/api/users/profile", json={"bio": "Reader", "username": "alice2"}, headers=alice)
+    assert response.status_code == 200
+    current = await me(client, alice)
+    assert (current["bio"], current["username"]) == ("Reader", "alice2")
+
+
+async def test_counter_flush_invalidates_followed_users(client, register):
+    alice, bob = await register("alice"), await register("bob")
+    assert (await me(client, alice))["follower_count"] == 0
+
+    await client.post("/api/users/alice/follow", headers=bob)
+    await server.counters.flush()
+    assert (await me(client, alice))["follower_count"] == 1
+    assert (await me(client, bob))["following_count"] == 1
+
+
+async def test_tokens_for_missing_users_are_rejected_and_not_cached(client):
+    token = server.create_access_token(data={"sub": str(ObjectId())})
+    response = await client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 401
+    assert len(server.principal_cache) == 0
+
+
+def test_cache_is_bounded_and_invalidates_by_any_id_type():
+    cache = server.PrincipalCache(2, 60)
+    ids = [ObjectId() for _ in range(3)]
+    for _id in ids:
+        cache.set(str(_id), object())
+    assert len(cache) == 2 and cache.get(str(ids[0])) is None
+
+    cache.invalidate(ids[1])
+    assert cache.get(str(ids[1])) is None and cache.get(str(ids[2])) is not None
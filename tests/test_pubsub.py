@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def collect(manager, got):
+    async for payload in manager._listen():
+        got.append(json.loads(payload))
+
+
+async def test_messages_are_relayed_once_as_json_across_cursor_restarts(db):
+    publisher = server.MongoPubSubManager(db)
+    listener = server.MongoPubSubManager(db)
+    # mongomock has no capped collections; its cursors end instead of tailing, so every
+    # poll exercises the resume path
+    publisher._collection_ready = listener._collection_ready = True
+    got = []
+    task = asyncio.create_task(collect(listener, got))
+    try:
+        await asyncio.sleep(0.05)
+        await publisher._publish({"method": "emit", "event": "x", "data": {"a": 1}})
+        await publisher._publish({"method": "emit", "event": "y", "data": {"a": 2}})
+        # A sequence number allocated before the last one but committed after it
+        late = await publisher._next_seq()
+        await publisher._publish({"method": "emit", "event": "z", "data": {"a": 3}})
+        await asyncio.sleep(0.3)
+        await db.socketio_messages.insert_one({
+            "channel": "socketio", "seq": late, "payload": json.dumps({"method": "emit", "event": "late"})
+        })
+        await asyncio.sleep(0.3)
+    finally:
+        task.cancel()
+
+    assert [message["event"] for message in got] == ["x", "y", "z", "late"]
+    stored = await db.socketio_messages.find_one({"payload": {"$ne": None}})
+    assert isinstance(stored["payload"], str)
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    """Allow two auth requests per client, refilling too slowly to matter in a test"""
+    monkeypatch.setattr(server, "rate_limiter", server.InMemoryRateLimiter())
+    monkeypatch.setitem(server.RATE_LIMIT_RULES, "auth", (2.0, 0.001))
+
+
+async def test_auth_burst_is_rejected_with_retry_after(client, limited):
+    credentials = {"email": "nobody@example.com", "password": "secret123"}
+    statuses = [(await client.post("/api/auth/login", json=credentials)).status_code for _ in range(2)]
+    assert statuses == [401, 401]
+
+    response = await client.post("/api/auth/login", json=credentials)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) > 0
+
+
+async def test_route_classes_have_separate_buckets(client, limited):
+    credentials = {"email": "nobody@example.com", "password": "secret123"}
+    for _ in range(3):
+        await client.post("/api/auth/login", json=credentials)
+    assert (await client.get("/api/posts")).status_code == 200
+
+
+@pytest.mark.parametrize("path", ["/api/health", "/api/health/live", "/api/health/ready", "/api/metrics"])
+async def test_probes_and_metrics_bypass_admission_control(client, monkeypatch, path):
+    monkeypatch.setattr(server, "rate_limiter", server.InMemoryRateLimiter())
+    monkeypatch.setitem(server.RATE_LIMIT_RULES, "default", (1.0, 0.001))
+
+    async def healthy():
+        return {"status": "ok", "checks": {}}
+
+    # The readiness checks need a real server's serverStatus; only admission is under test here
+    monkeypatch.setattr(server.readiness, "result", healthy)
+    statuses = [(await client.get(path)).status_code for _ in range(3)]
+    assert statuses == [200, 200, 200]
+    assert (await client.get("/api/posts")).status_code == 200
+    assert (await client.get("/api/posts")).status_code == 429
+
+
+def test_token_bucket_refills_over_time(monkeypatch):
+    limiter = server.InMemoryRateLimiter()
+    now = [1000.0]
+    monkeypatch.setattr(server.time, "monotonic", lambda: now[0])
+
+    async def acquire():
+        return await limiter.acquire("auth:client", 1, 0.5)
+
+    assert asyncio.run(acquire()) == 0
+    assert asyncio.run(acquire()) == pytest.approx(2.0)
+    now[0] += 2
+    assert asyncio.run(acquire()) == 0
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from jose import jwt
+import pytest
+import socketio
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def sockets(monkeypatch):
+    """Record what the Socket.IO server would send, save and join instead of using real sockets"""
+    sent = {"emits": [], "sessions": {}, "rooms": []}
+
+    async def emit(event, data=None, to=None, **kwargs):
+        sent["emits"].append((event, data, to))
+
+    async def save_session(sid, session, namespace=None):
+        sent["sessions"][sid] = session
+
+    async def enter_room(sid, room, namespace=None):
+        sent["rooms"].append((sid, room))
+
+    monkeypatch.setattr(server.sio, "emit", emit)
+    monkeypatch.setattr(server.sio, "save_session", save_session)
+    monkeypatch.setattr(server.sio, "enter_room", enter_room)
+    return sent
+
+
+def expired_token(user_id: str) -> str:
+    payload = {"sub": user_id, "exp": datetime.now(timezone.utc) - timedelta(minutes=1)}
+    return jwt.encode(payload, server.SECRET_KEY, algorithm=server.ALGORITHM)
+
+
+@pytest.mark.parametrize("auth", [
+    None,
+    {"token": "not-a-jwt"},
+    {"token": jwt.encode({"sub": str(ObjectId())}, "wrong-secret", algorithm="HS256")},
+    {"token": expired_token(str(ObjectId()))},
+    {"token": server.create_access_token(data={"sub": "not-an-object-id"})},
+])
+async def test_connect_rejects_missing_and_invalid_tokens(sockets, auth):
+    with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+        await server.connect("sid-1", {}, auth)
+    assert sockets["sessions"] == {} and sockets["rooms"] == []
+
+
+@pytest.mark.parametrize("where", ["auth", "query", "header"])
+async def test_connect_joins_the_user_channel(sockets, where):
+    user_id = str(ObjectId())
+    token = server.create_access_token(data={"sub": user_id})
+    environ, auth = {}, None
+    if where == "auth":
+        auth = {"token": token}
+    elif where == "query":
+        environ["QUERY_STRING"] = f"token={token}"
+    else:
+        environ["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+
+    await server.connect("sid-1", environ, auth)
+    assert sockets["sessions"] == {"sid-1": {"user_id": user_id}}
+    assert sockets["rooms"] == [("sid-1", f"user:{user_id}")]
+
+
+async def test_subscribe_accepts_only_valid_channels(sockets):
+    post_id = str(ObjectId())
+    assert await server.subscribe("sid-1", {"post_id": post_id}) == {"ok": True, "channel": f"post:{post_id}"}
+    assert (await server.subscribe("sid-1", {"room_id": "../admin"}))["ok"] is False
+    assert (await server.subscribe("sid-1", "post:1"))["ok"] is False
+    assert sockets["rooms"] == [("sid-1", f"post:{post_id}")]
+
+
+async def test_like_events_are_coalesced_per_post(sockets):
+    coalescer = server.LikeEventCoalescer(0.05)
+    coalescer.publish("a", 1, ["post:a"])
+    coalescer.publish("b", 7, ["post:b"])
+    coalescer.publish("a", 2, ["post:a"])
+    coalescer.publish("a", 3, ["post:a"])
+    assert sockets["emits"] == []
+
+    await asyncio.sleep(0.1)
+    assert sockets["emits"] == [
+        ("post_liked", {"post_id": "a", "like_count": 3}, ["post:a"]),
+        ("post_liked", {"post_id": "b", "like_count": 7}, ["post:b"]),
+    ]
+
+    # The next window starts afresh
+    coalescer.publish("a", 4, ["post:a"])
+    await asyncio.sleep(0.1)
+    assert sockets["emits"][-1] == ("post_liked", {"post_id": "a", "like_count": 4}, ["post:a"])
+    assert len(sockets["emits"]) == 3
+
+
+async def test_like_toggles_emit_one_event_with_the_final_count(client, register, create_post, sockets, monkeypatch):
+    monkeypatch.setattr(server, "like_events", server.LikeEventCoalescer(0.05))
+    alice, bob, carol = await register("alice"), await register("bob"), await register("carol")
+    post = await create_post(alice)
+    author_id = (await client.get("/api/auth/me", headers=alice)).json()["id"]
+
+    for headers in (bob, carol, bob):
+        await client.post(f"/api/posts/{post['id']}/like", headers=headers)
+    await asyncio.sleep(0.1)
+
+    liked = [(data, to) for event, data, to in sockets["emits"] if event == "post_liked"]
+    assert liked == [({"post_id": post["id"], "like_count": 1}, [f"post:{post['id']}", f"user:{author_id}"])]
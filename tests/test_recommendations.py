@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def like(db, user_id, post_id):
+    await db.likes.insert_one({"user_id": user_id, "post_id": post_id, "created_at": datetime.now(timezone.utc)})
+    await db.posts.update_one({"_id": post_id}, {"$inc": {"like_count": 1}}, upsert=True)
+
+
+async def neighbor_ids(db, post_id):
+    doc = await db.post_neighbors.find_one({"_id": post_id})
+    return [entry["post_id"] for entry in doc["neighbors"]] if doc else []
+
+
+async def test_refresh_removes_this_post_from_former_neighbours(db):
+    user_id, first, second = ObjectId(), ObjectId(), ObjectId()
+    await like(db, user_id, first)
+    await like(db, user_id, second)
+    await server.refresh_post_neighbors(first)
+    assert await neighbor_ids(db, first) == [second]
+    assert await neighbor_ids(db, second) == [first]
+
+    # The only shared liker takes their like back from the second post
+    await db.likes.delete_one({"user_id": user_id, "post_id": second})
+    await db.posts.update_one({"_id": second}, {"$inc": {"like_count": -1}})
+    await server.refresh_post_neighbors(first)
+
+    assert await neighbor_ids(db, first) == []
+    assert await neighbor_ids(db, second) == []
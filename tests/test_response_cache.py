@@ -0,0 +1,133 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_listing_is_served_from_cache_until_a_post_is_created(client, register, create_post):
+    alice = await register("alice")
+    first = await create_post(alice, "First")
+
+    assert [post["id"] for post in (await client.get("/api/posts")).json()] == [first["id"]]
+    hits = server.response_cache.hits
+    assert [post["id"] for post in (await client.get("/api/posts")).json()] == [first["id"]]
+    assert server.response_cache.hits == hits + 1
+
+    second = await create_post(alice, "Second", first["room"]["id"])
+    assert [post["id"] for post in (await client.get("/api/posts")).json()] == [second["id"], first["id"]]
+
+
+async def test_viewer_state_is_added_to_the_cached_page(client, register, create_post):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+    await client.get("/api/posts?limit=20")
+
+    hits = server.response_cache.hits
+    listed = (await client.get("/api/posts?limit=20&include=viewer_state", headers=bob)).json()
+    assert server.response_cache.hits == hits + 1
+    assert listed[0]["viewer_state"] == {"liked": False, "following_author": False, "is_author": False}
+
+    # Likes and follows do not invalidate the page, but the viewer state is read fresh
+    await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    await client.post("/api/users/alice/follow", headers=bob)
+    listed = (await client.get("/api/posts?limit=20&include=viewer_state", headers=bob)).json()
+    assert listed[0]["viewer_state"] == {"liked": True, "following_author": True, "is_author": False}
+    assert "viewer_state" not in (await client.get("/api/posts?limit=20")).json()[0]
+
+    compact = (await client.get("/api/posts?compact=true&include=viewer_state", headers=alice)).json()
+    assert compact["posts"][0]["viewer_state"]["is_author"] is True
+    assert (await client.get("/api/posts?include=viewer_state")).status_code == 401
+
+
+async def test_matching_etag_gets_304(client, register, create_post):
+    alice = await register("alice")
+    post = await create_post(alice)
+
+    response = await client.get(f"/api/posts/{post['id']}")
+    etag = response.headers["ETag"]
+    revalidated = await client.get(f"/api/posts/{post['id']}", headers={"If-None-Match": etag})
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == etag
+
+
+async def test_cached_responses_carry_cache_headers(client, register):
+    await register("alice")
+    response = await client.get("/api/users/alice")
+    assert response.headers["Cache-Control"] == f"public, max-age={server.RESPONSE_CACHE_MAX_AGE}"
+    assert response.headers["Vary"] == "Accept-Encoding"
+
+    cached = await client.get("/api/users/alice", headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304 and cached.content == b""
+
+
+async def test_room_listing_is_invalidated_by_new_rooms_and_posts(client, register, create_post):
+    alice = await register("alice")
+    post = await create_post(alice)
+    rooms = (await client.get("/api/users/alice/rooms")).json()
+    assert [(room["name"], room["post_count"]) for room in rooms] == [("Books", 1)]
+
+    hits = server.response_cache.hits
+    assert (await client.get("/api/users/alice/rooms")).json() == rooms
+    assert server.response_cache.hits == hits + 1
+
+    await create_post(alice, "Another", post["room"]["id"])
+    assert [room["post_count"] for room in (await client.get("/api/users/alice/rooms")).json()] == [2]
+    await client.post("/api/rooms", json={"name": "Music", "color": "#000000"}, headers=alice)
+    assert [room["name"] for room in (await client.get("/api/users/alice/rooms")).json()] == ["Books", "Music"]
+
+
+async def test_profile_update_invalidates_the_user(client, register):
+    alice = await register("alice")
+    assert (await client.get("/api/users/alice")).json()["bio"] == ""
+
+    await client.put("/api/users/profile", json={"bio": "Reads a lot"}, headers=alice)
+    assert (await client.get("/api/users/alice")).json()["bio"] == "Reads a lot"
+
+
+async def test_counter_flush_invalidates_the_post(client, register, create_post):
+    alice, bob = await register("alice"), await register("bob")
+    post = await create_post(alice)
+    assert (await client.get(f"/api/posts/{post['id']}")).json()["like_count"] == 0
+
+    await client.post(f"/api/posts/{post['id']}/like", headers=bob)
+    await server.counters.flush()
+    assert (await client.get(f"/api/posts/{post['id']}")).json()["like_count"] == 1
+
+
+async def test_response_built_across_an_invalidation_is_not_stored(client, register, create_post, monkeypatch):
+    alice = await register("alice")
+    post = await create_post(alice)
+    hydrate_posts = server.hydrate_posts
+
+    async def hydrate_during_write(posts):
+        server.response_cache.invalidate(f"post:{post['id']}")
+        return await hydrate_posts(posts)
+
+    monkeypatch.setattr(server, "hydrate_posts", hydrate_during_write)
+    await client.get(f"/api/posts/{post['id']}")
+    monkeypatch.setattr(server, "hydrate_posts", hydrate_posts)
+
+    misses = server.response_cache.misses
+    await client.get(f"/api/posts/{post['id']}")
+    assert server.response_cache.misses == misses + 1
+
+
+async def test_cached_response_not_worth_compressing_is_not_recompressed(client, register, create_post, monkeypatch):
+    alice = await register("alice")
+    room_id = None
+    for i in range(10):
+        post = await create_post(alice, f"Post {i}", room_id)
+        room_id = post["room"]["id"]
+
+    calls = []
+
+    async def incompressible(encoding, body, source):
+        calls.append(source)
+        return body + b"!"
+
+    monkeypatch.setattr(server.response_compressor, "compress", incompressible)
+    for _ in range(3):
+        response = await client.get("/api/posts", headers={"Accept-Encoding": "gzip"})
+        assert "content-encoding" not in response.headers
+    assert calls == ["cache"]
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_sync_picks_up_late_commits_and_edits_without_duplicates(db):
+    backend = server.InMemorySearchBackend()
+    now = datetime.now(timezone.utc)
+    early_id = ObjectId()
+    await db.rooms.insert_one({"_id": ObjectId(), "name": "Jazz records", "updated_at": now})
+    await backend.sync()
+
+    # A document with an older _id and updated_at commits after the sync that passed it
+    await db.rooms.insert_one({"_id": early_id, "name": "Jazz books", "updated_at": now - timedelta(seconds=5)})
+    await backend.sync()
+    assert {doc_id for doc_id, _ in await backend.search("rooms", "jazz", 10, {})} >= {early_id}
+    assert len(backend.indexes["rooms"].documents) == 2
+
+    # Edits bump updated_at and replace the indexed terms
+    await db.rooms.update_one({"_id": early_id}, {"$set": {"name": "Blues books", "updated_at": now}})
+    await backend.sync()
+    assert [doc_id for doc_id, _ in await backend.search("rooms", "blues", 10, {})] == [early_id]
+    assert len(backend.indexes["rooms"].documents) == 2
+
+
+async def test_autocomplete_ignores_case(db):
+    backend = server.InMemorySearchBackend()
+    backend.index("users", {"_id": ObjectId(), "username": "Alice", "name": "Alice"})
+    assert [suggestion["text"] for suggestion in await backend.autocomplete("ALI", 5)] == ["alice"]
@@ -0,0 +1,53 @@
+import asyncio
+
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def settle():
+    """Let fan-out, backfill and trim tasks finish"""
+    while server.background_tasks:
+        await asyncio.gather(*list(server.background_tasks), return_exceptions=True)
+
+
+async def test_post_fanned_out_during_backfill_is_listed_once(client, db, register, create_post):
+    alice, bob = await register("alice"), await register("bob")
+    await client.get("/api/feed/home", headers=bob)
+    await client.post("/api/users/alice/follow", headers=bob)
+    await settle()
+
+    bob_id = (await db.users.find_one({"username": "bob"}))["_id"]
+    post = await create_post(alice)
+    post_doc = await db.posts.find_one({"_id": ObjectId(post["id"])})
+    # The follow backfill and the new post's fan-out both deliver the same post
+    await asyncio.gather(
+        server.backfill_timeline(bob_id, post_doc["user_id"]),
+        server.fan_out_post(post_doc, 1),
+    )
+    await settle()
+
+    assert await db.timeline_entries.count_documents({"owner_id": bob_id, "post_id": post_doc["_id"]}) == 1
+    feed = (await client.get("/api/feed/home", headers=bob)).json()
+    assert [item["id"] for item in feed] == [post["id"]]
+
+
+async def test_unfollow_prunes_and_timeline_is_capped(client, db, register, create_post, monkeypatch):
+    monkeypatch.setattr(server, "TIMELINE_MAX_ENTRIES", 2)
+    alice, bob = await register("alice"), await register("bob")
+    await client.post("/api/users/alice/follow", headers=bob)
+    room = await client.post("/api/rooms", json={"name": "Books", "color": "#FF5733"}, headers=alice)
+    posts = [await create_post(alice, title=f"Post {i}", room_id=room.json()["id"]) for i in range(3)]
+
+    feed = (await client.get("/api/feed/home", headers=bob)).json()
+    assert [item["id"] for item in feed] == [post["id"] for post in reversed(posts)][:2]
+    await settle()
+    bob_id = (await db.users.find_one({"username": "bob"}))["_id"]
+    assert await db.timeline_entries.count_documents({"owner_id": bob_id}) == 2
+
+    await client.post("/api/users/alice/follow", headers=bob)
+    await settle()
+    assert (await client.get("/api/feed/home", headers=bob)).json() == []
@@ -0,0 +1,101 @@
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+HALF_LIFE = timedelta(hours=server.TRENDING_HALF_LIFE_HOURS)
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = server.TrendingEngine(server.TRENDING_TOP_K)
+    monkeypatch.setattr(server, "trending", engine)
+    return engine
+
+
+def post(action_type="read", tags=()):
+    return {"_id": ObjectId(), "action_type": action_type, "tags": list(tags)}
+
+
+def test_decay_weight_doubles_every_half_life_and_treats_naive_datetimes_as_utc():
+    epoch = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert server.decay_weight(epoch, epoch) == 1
+    assert server.decay_weight(epoch + HALF_LIFE, epoch) == pytest.approx(2)
+    assert server.decay_weight(epoch - 2 * HALF_LIFE, epoch) == pytest.approx(0.25)
+    assert server.decay_weight(epoch.replace(tzinfo=None) + HALF_LIFE, epoch) == pytest.approx(2)
+
+
+def test_scores_are_weighted_by_kind_and_decayed_to_the_present(engine):
+    now = datetime.now(timezone.utc)
+    fresh, old, discussed = post(), post(), post()
+    engine.record(fresh, "like", at=now)
+    engine.record(old, "like", at=now - HALF_LIFE)
+    engine.record(discussed, "comment", at=now)
+
+    scores = dict(engine.top("all", 10))
+    assert scores[fresh["_id"]] == pytest.approx(1, rel=1e-3)
+    assert scores[old["_id"]] == pytest.approx(0.5, rel=1e-3)
+    assert scores[discussed["_id"]] == pytest.approx(2, rel=1e-3)
+    assert [post_id for post_id, _ in engine.top("all", 10)] == [discussed["_id"], fresh["_id"], old["_id"]]
+
+
+def test_removing_an_event_drops_a_post_from_the_board(engine):
+    liked, other = post(), post()
+    at = datetime.now(timezone.utc)
+    engine.record(liked, "like", at=at)
+    engine.record(other, "like")
+    engine.record(liked, "like", at=at, count=-1)
+    assert [post_id for post_id, _ in engine.top("all", 10)] == [other["_id"]]
+
+
+def test_posts_are_ranked_on_their_action_and_tag_boards(engine):
+    book, song = post("read", ["Fantasy", "fantasy", "maps"]), post("listen", ["fantasy"])
+    engine.record(book, "like")
+    engine.record(song, "comment")
+
+    assert [post_id for post_id, _ in engine.top("action:read", 10)] == [book["_id"]]
+    assert [post_id for post_id, _ in engine.top("tag:fantasy", 10)] == [song["_id"], book["_id"]]
+    assert [post_id for post_id, _ in engine.top("tag:maps", 10)] == [book["_id"]]
+    assert engine.top("tag:unknown", 10) == []
+
+
+def test_boards_are_bounded_and_keep_the_highest_scores():
+    board = server.TrendingBoard(2)
+    ids = [ObjectId() for _ in range(5)]
+    for score, post_id in enumerate(ids, start=1):
+        board.add(post_id, float(score))
+    assert len(board.scores) <= 4
+    assert board.top(10) == [(ids[4], 5.0), (ids[3], 4.0)]
+    assert board.top(1) == [(ids[4], 5.0)]
+
+
+async def test_trending_endpoint_ranks_engaged_posts(client, register, create_post, engine):
+    alice, bob, carol = await register("alice"), await register("bob"), await register("carol")
+    liked = await create_post(alice, "Liked")
+    discussed = await create_post(alice, "Discussed")
+    await create_post(alice, "Ignored")
+
+    await client.post(f"/api/posts/{liked['id']}/like", headers=bob)
+    await client.post(f"/api/posts/{discussed['id']}/like", headers=bob)
+    await client.post(f"/api/posts/{discussed['id']}/like", headers=carol)
+    response = await client.post(f"/api/posts/{discussed['id']}/comments",
+                                 json={"post_id": discussed["id"], "content": "Agreed"}, headers=carol)
+    assert response.status_code == 200, response.text
+
+    ranked = (await client.get("/api/posts/trending")).json()
+    assert [p["title"] for p in ranked] == ["Discussed", "Liked"]
+    assert ranked[0]["trending_score"] == pytest.approx(4, rel=1e-3)
+    assert ranked[0]["user"]["username"] == "alice"
+    assert [p["title"] for p in (await client.get("/api/posts/trending", params={"limit": 1})).json()] == ["Discussed"]
+    assert (await client.get("/api/posts/trending", params={"action_type": "buy"})).json() == []
+
+    # Unliking takes the like back out
+    await client.post(f"/api/posts/{liked['id']}/like", headers=bob)
+    assert [p["title"] for p in (await client.get("/api/posts/trending")).json()] == ["Discussed"]
+
+    response = await client.get("/api/posts/trending", params={"action_type": "read", "tag": "x"})
+    assert response.status_code == 400